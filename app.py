@@ -1,30 +1,227 @@
 """
 Constructs the flask app using the typical create_app function.
+
+The app is created the first time app or application is imported from this
+module, eg. by wsgi.py or FLASK_APP, so code that only needs the Flask app
+and the db, like invoke tasks, can use create_flask_app without creating the
+api.
 """
 
-import connexion
-from connexion import FlaskApp
+import asyncio
+import functools
+import re
+from typing import TYPE_CHECKING
+
+from flask import Flask
 from fsd_utils import init_sentry
-from fsd_utils.healthchecks.checkers import DbChecker
-from fsd_utils.healthchecks.checkers import FlaskRunningChecker
-from fsd_utils.healthchecks.healthcheck import Healthcheck
 from fsd_utils.logging import logging
 
 from config import Config
+from core.cache import account_cache
+from core.metrics import RequestMetricsMiddleware
+from core.metrics import metrics
+from core.notifications import account_change_listener
+from core.startup import StartupTimings
+from core.stream import account_change_stream
+from db import async_db
 from db import db
 from db import migrate
+from db.replica import REPLICA_BIND_KEY
+from db.replica import ReplicaRoutingMiddleware
 
+if TYPE_CHECKING:
+    from connexion import AsyncApp
+    from connexion import FlaskApp
 
-def create_app() -> FlaskApp:
-    init_sentry()
-    connexion_app = connexion.FlaskApp(
-        __name__,
-        specification_dir=Config.FLASK_ROOT + "/openapi/",
-    )
-    connexion_app.add_api(Config.FLASK_ROOT + "/openapi/api.yml")
+# Matches the arguments in a Flask rule, eg. <path:filename>
+FLASK_RULE_ARGUMENT = re.compile(r"<(?:[^:<>]+:)?([^<>]+)>")
+
+
+def create_app() -> "FlaskApp | AsyncApp":
+    # Imported here rather than with this module, as they take most of the
+    # time importing it takes, and create_flask_app doesn't need them
+    import connexion
+    from connexion.middleware import MiddlewarePosition
+    from fsd_utils.healthchecks.checkers import DbChecker
+    from fsd_utils.healthchecks.checkers import FlaskRunningChecker
+    from fsd_utils.healthchecks.healthcheck import Healthcheck
+
+    from core.spec import load_spec
+    from core.spec import skip_validation
+
+    timings = StartupTimings()
+    with timings.phase("sentry"):
+        init_sentry()
+    with timings.phase("spec"):
+        spec, cached = load_spec(cache_dir=Config.OPENAPI_SPEC_CACHE_DIR or None)
+        timings.notes["spec"] = "cached" if cached else "parsed and validated"
+
+    if Config.ASYNC_REQUEST_PATH_ENABLED:
+        connexion_app = connexion.AsyncApp(
+            __name__,
+            specification_dir=Config.FLASK_ROOT + "/openapi/",
+        )
+        # The api is served by connexion directly, but the Flask app is still
+        # needed for config, extensions, the CLI and the healthcheck
+        connexion_app.app = Flask(__name__)
+    else:
+        connexion_app = connexion.FlaskApp(
+            __name__,
+            specification_dir=Config.FLASK_ROOT + "/openapi/",
+        )
+        with timings.phase("api"), skip_validation():
+            connexion_app.add_api(spec)
 
     # Configure Flask App
     flask_app = connexion_app.app
+    with timings.phase("extensions"):
+        _init_flask_app(flask_app)
+
+        # Evict accounts changed by other workers from the account cache
+        account_change_listener.init_app(flask_app)
+        account_change_listener.subscribe(account_cache.evict)
+        account_change_listener.start()
+
+        # Push account changes to clients of GET /accounts/stream as soon as
+        # the listener is notified of them
+        account_change_stream.init_app(flask_app)
+        account_change_listener.subscribe(account_change_stream.notify)
+
+        # Expose the request, cache and db pool metrics
+        metrics.init_app(flask_app)
+        connexion_app.add_middleware(
+            RequestMetricsMiddleware,
+            position=MiddlewarePosition.BEFORE_EXCEPTION,
+            flask_app=flask_app,
+        )
+
+        # Route the reads of read only operations to the replica
+        if Config.REPLICA_DATABASE_URL:
+            connexion_app.add_middleware(
+                ReplicaRoutingMiddleware,
+                position=MiddlewarePosition.BEFORE_EXCEPTION,
+                flask_app=flask_app,
+            )
+
+        # Add healthchecks to flask_app
+        health = Healthcheck(flask_app)
+        health.add_check(FlaskRunningChecker())
+        health.add_check(DbChecker(db))
+
+    if Config.ASYNC_REQUEST_PATH_ENABLED:
+        with timings.phase("api"):
+            async_db.init_app(flask_app)
+            _add_async_api(connexion_app, flask_app, spec)
+    else:
+        from core.account_async import ChangeStreamMiddleware
+
+        # Serve the change stream with a coroutine, so each open stream
+        # doesn't hold one of the worker's threads
+        connexion_app.add_middleware(
+            ChangeStreamMiddleware,
+            position=MiddlewarePosition.BEFORE_CONTEXT,
+            flask_app=flask_app,
+        )
+
+    timings.finish()
+    flask_app.extensions["startup_timings"] = timings
+    flask_app.logger.info(timings.report())
+    return connexion_app
+
+
+def before_fork(connexion_app: "FlaskApp | AsyncApp"):
+    """
+    Prepare an app created in a process that workers will be forked from,
+    eg. by gunicorn's preload_app, so the workers share as much of it as they
+    can and none of its connections
+    """
+    flask_app = connexion_app.app
+    # Threads aren't forked, and the workers start listeners of their own
+    account_change_listener.stop()
+    account_change_stream.stop()
+    # Connexion otherwise builds its middleware, with a validator for every
+    # operation, in each worker when it's first called. Starting the app up
+    # and shutting it down calls it without serving a request, so without
+    # starting any of the threads a request would
+    asyncio.run(_start_up_and_shut_down(connexion_app))
+    with flask_app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+async def _start_up_and_shut_down(asgi_app):
+    """
+    Run an ASGI app's lifespan, from its startup to its shutdown
+    """
+    messages = asyncio.Queue()
+    await messages.put({"type": "lifespan.startup"})
+
+    async def send(message):
+        if message["type"].endswith(".failed"):
+            raise RuntimeError(message.get("message", message["type"]))
+        if message["type"] == "lifespan.startup.complete":
+            await messages.put({"type": "lifespan.shutdown"})
+
+    await asgi_app(
+        {"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}},
+        messages.get,
+        send,
+    )
+
+
+def after_fork(connexion_app: "FlaskApp | AsyncApp"):
+    """
+    Set up a worker forked from a process that called before_fork
+    """
+    flask_app = connexion_app.app
+    with flask_app.app_context():
+        for engine in db.engines.values():
+            # Leaves any connection the parent has to the parent
+            engine.dispose(close=False)
+    if "async_db" in flask_app.extensions:
+        async_db.engine.sync_engine.dispose(close=False)
+        if async_db.replica_engine is not None:
+            async_db.replica_engine.sync_engine.dispose(close=False)
+    account_change_listener.start()
+
+
+def worker_db_connections(config) -> int:
+    """
+    The most db connections a worker of an app with this config opens, so
+    WEB_CONCURRENCY and the pool sizes can be chosen so that every worker of
+    every instance fits within the db's max_connections
+    """
+
+    def pool_connections(options: dict) -> int:
+        return options["pool_size"] + options["max_overflow"]
+
+    connections = pool_connections(config["SQLALCHEMY_ENGINE_OPTIONS"])
+    replica = config["SQLALCHEMY_BINDS"].get(REPLICA_BIND_KEY)
+    if replica:
+        connections += pool_connections(replica)
+    if config["ASYNC_REQUEST_PATH_ENABLED"]:
+        connections += pool_connections(config["ASYNC_SQLALCHEMY_ENGINE_OPTIONS"])
+        if replica:
+            connections += pool_connections(
+                config["ASYNC_REPLICA_SQLALCHEMY_ENGINE_OPTIONS"]
+            )
+    if config["ACCOUNT_CHANGE_LISTENER_ENABLED"]:
+        # LISTEN holds a connection of its own
+        connections += 1
+    return connections
+
+
+def create_flask_app() -> Flask:
+    """
+    Create a Flask app with the config, logging and db of the api, but not
+    the api itself or the account change listener
+    """
+    flask_app = Flask(__name__)
+    _init_flask_app(flask_app)
+    return flask_app
+
+
+def _init_flask_app(flask_app: Flask):
     flask_app.config.from_object("config.Config")
 
     # Initialise logging
@@ -35,14 +232,59 @@ def create_app() -> FlaskApp:
     # Bind Flask-Migrate db utilities to Flask app
     migrate.init_app(flask_app, db, directory="db/migrations", render_as_batch=True)
 
-    # Add healthchecks to flask_app
-    health = Healthcheck(flask_app)
-    health.add_check(FlaskRunningChecker())
-    health.add_check(DbChecker(db))
+    # Bind the per-process account cache to Flask app
+    account_cache.init_app(flask_app)
 
-    return connexion_app
 
+def _add_async_api(connexion_app: "AsyncApp", flask_app: Flask, spec: dict):
+    """
+    Serve the api with the coroutines in core.account_async, and every route
+    registered on the Flask app, eg. the healthcheck, through a WSGI adapter.
+    """
+    from a2wsgi import WSGIMiddleware
+    from connexion.resolver import Resolver
+
+    from core.spec import skip_validation
+
+    wsgi_app = WSGIMiddleware(flask_app.wsgi_app)
+    for rule in flask_app.url_map.iter_rules():
+        connexion_app.add_url_rule(
+            FLASK_RULE_ARGUMENT.sub(r"{\1}", rule.rule),
+            rule.endpoint,
+            wsgi_app,
+            methods=list(rule.methods),
+        )
+
+    with skip_validation():
+        connexion_app.add_api(
+            spec,
+            resolver=Resolver(functools.partial(_resolve_async_operation, flask_app)),
+        )
+
+
+def _resolve_async_operation(flask_app: Flask, operation_id: str):
+    from connexion.utils import get_function_from_name
+
+    function = get_function_from_name(
+        operation_id.replace("core.account.", "core.account_async.", 1)
+    )
+
+    @functools.wraps(function)
+    async def in_app_context(*args, **kwargs):
+        # Flask's app context is a context variable, so each request's task
+        # gets its own
+        with flask_app.app_context():
+            return await function(*args, **kwargs)
+
+    return in_app_context
 
-app = create_app()
 
-application = app.app
+def __getattr__(name: str):
+    global app, application
+    if name == "app":
+        app = create_app()
+        application = app.app
+        return app
+    if name == "application":
+        return __getattr__("app").app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
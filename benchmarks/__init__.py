@@ -0,0 +1,9 @@
+"""
+Benchmarks for every operation in openapi/api.yml, run against a local
+Postgres seeded with a synthetic population of accounts and roles.
+
+    python -m benchmarks.run seed --accounts 500000 --reset
+    python -m benchmarks.run run --output results.json
+
+See benchmarks/run.py for the options.
+"""
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Reruns the benchmarks and fails if any operation has regressed against the
+baseline results in benchmarks/baseline.json.
+
+An operation regresses when its p95 latency grows by more than
+--latency_tolerance, or its p95 db statements per request by more than
+--statements_tolerance, both fractions of the baseline. Latency depends on
+the machine, so compare against a baseline recorded on the same kind of
+machine, and update it when a change is meant to make an operation slower or
+faster.
+
+The benchmarks are run with the requests, sample and seed recorded in the
+baseline, against a db seeded with the same population:
+
+------------------------ How to run the script -----------------------
+>> python -m benchmarks.run seed --accounts 20000 --reset --database_url postgresql://...
+>> python -m benchmarks.compare --database_url postgresql://...
+
+To record a new baseline
+
+>> python -m benchmarks.compare --update --database_url postgresql://...
+
+or, against the local development db
+
+>> invoke seed-benchmark-db --accounts 20000 --reset
+>> invoke benchmark-compare [--update]
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import psycopg2
+
+from benchmarks.operations import spec_operation_ids
+from benchmarks.run import DEFAULT_REQUESTS
+from benchmarks.run import DEFAULT_SAMPLE_SIZE
+from benchmarks.run import DEFAULT_SEED
+from benchmarks.run import DEFAULT_WARMUP_REQUESTS
+from benchmarks.run import InProcessClient
+from benchmarks.run import population_counts
+from benchmarks.run import run_benchmarks
+from benchmarks.run import write_results
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+GATED_OPERATIONS_PREFIX = "core.account."
+DEFAULT_LATENCY_TOLERANCE = 0.25
+DEFAULT_STATEMENTS_TOLERANCE = 0.0
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def gated_operation_ids() -> List[str]:
+    return [
+        operation_id
+        for operation_id in spec_operation_ids()
+        if operation_id.startswith(GATED_OPERATIONS_PREFIX)
+    ]
+
+
+def rerun_baseline(
+    connection,
+    client,
+    baseline: Optional[dict],
+    check_population: bool = True,
+    log=print,
+) -> dict:
+    """
+    Run the benchmarks for every core.account operation, as they were run for
+    the baseline, or with the default settings if there isn't one yet
+    :raises ValueError:
+        if check_population is set and the db doesn't hold the population the
+        baseline was recorded against
+    """
+    meta = (baseline or {}).get("meta", {})
+    population = population_counts(connection)
+    if check_population and meta and population != meta["population"]:
+        raise ValueError(
+            f"The db holds {population}, but the baseline was recorded "
+            f"against {meta['population']}. Seed the db with the same "
+            f"population first."
+        )
+    return run_benchmarks(
+        connection,
+        client,
+        operation_ids=gated_operation_ids(),
+        requests=meta.get("requests", DEFAULT_REQUESTS),
+        warmup_requests=meta.get("warmup_requests", DEFAULT_WARMUP_REQUESTS),
+        sample_size=meta.get("sample_size", DEFAULT_SAMPLE_SIZE),
+        seed=meta.get("seed", DEFAULT_SEED),
+        log=log,
+    )
+
+
+def _change(baseline_value: Optional[float], value: Optional[float]) -> float:
+    if not baseline_value:
+        return 0.0 if not value else float("inf")
+    return (value - baseline_value) / baseline_value
+
+
+def compare_results(
+    baseline: dict,
+    results: dict,
+    latency_tolerance: float = DEFAULT_LATENCY_TOLERANCE,
+    statements_tolerance: float = DEFAULT_STATEMENTS_TOLERANCE,
+) -> Tuple[List[tuple], List[str]]:
+    """
+    Compare the p95 latency and statements of each operation in the baseline
+    :return:
+        The rows of a table of the changes, and a description of each
+        regression beyond the tolerances
+    """
+    rows = []
+    regressions = [
+        f"{operation_id} wasn't benchmarked"
+        for operation_id in baseline["operations"]
+        if operation_id not in results["operations"]
+    ]
+    for operation_id, result in results["operations"].items():
+        baseline_result = baseline["operations"].get(operation_id)
+        if baseline_result is None:
+            # Added since the baseline was recorded
+            rows.append((operation_id, "", None, None, 0.0, "NEW"))
+            continue
+
+        for metric, key, tolerance in (
+            ("p95 ms", "latency_ms", latency_tolerance),
+            ("stmts p95", "db_statements", statements_tolerance),
+        ):
+            baseline_value = (baseline_result[key] or {}).get("p95")
+            value = (result[key] or {}).get("p95")
+            change = _change(baseline_value, value)
+            regressed = change > tolerance
+            rows.append(
+                (
+                    operation_id,
+                    metric,
+                    baseline_value,
+                    value,
+                    change,
+                    "REGRESSED" if regressed else "",
+                )
+            )
+            if regressed:
+                regressions.append(
+                    f"{operation_id} {metric} went from {baseline_value} to "
+                    f"{value}, {change:+.0%} against a tolerance of {tolerance:+.0%}"
+                )
+
+        if result["errors"] > baseline_result["errors"]:
+            regressions.append(
+                f"{operation_id} had {result['errors']} errors, "
+                f"{result['status_codes']}"
+            )
+    return rows, regressions
+
+
+def format_comparison(rows: List[tuple]) -> str:
+    table = [("operation", "metric", "baseline", "now", "change", "")] + [
+        (
+            operation_id,
+            metric,
+            str(baseline_value),
+            str(value),
+            f"{change:+.1%}",
+            flag,
+        )
+        for operation_id, metric, baseline_value, value, change, flag in rows
+    ]
+    widths = [max(len(row[column]) for row in table) for column in range(6)]
+    return "\n".join(
+        "  ".join(
+            value.ljust(width) if column < 2 else value.rjust(width)
+            for column, (value, width) in enumerate(zip(row, widths))
+        ).rstrip()
+        for row in table
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--database_url",
+        help="The seeded db to benchmark, by default DATABASE_URL",
+        required=False,
+        default=os.getenv("DATABASE_URL"),
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--latency_tolerance",
+        type=float,
+        default=DEFAULT_LATENCY_TOLERANCE,
+        help="The fraction p95 latency may grow by, eg. 0.25 for 25%%",
+    )
+    parser.add_argument(
+        "--statements_tolerance",
+        type=float,
+        default=DEFAULT_STATEMENTS_TOLERANCE,
+        help="The fraction p95 db statements per request may grow by",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Write the results to the baseline rather than comparing them",
+    )
+    args = parser.parse_args()
+
+    # The app in this process uses the same db
+    os.environ["DATABASE_URL"] = args.database_url
+    baseline_results = load_baseline(args.baseline)
+    if baseline_results is None and not args.update:
+        sys.exit(f"There is no baseline at {args.baseline}, record one with --update")
+    db_connection = psycopg2.connect(args.database_url)
+    app_client = InProcessClient()
+    try:
+        new_results = rerun_baseline(
+            db_connection,
+            app_client,
+            baseline_results,
+            check_population=not args.update,
+        )
+    finally:
+        app_client.close()
+        db_connection.close()
+
+    if args.update:
+        write_results(new_results, args.baseline)
+        print(f"Updated {args.baseline}")
+        sys.exit(0)
+
+    comparison, regressed = compare_results(
+        baseline_results,
+        new_results,
+        latency_tolerance=args.latency_tolerance,
+        statements_tolerance=args.statements_tolerance,
+    )
+    print(format_comparison(comparison))
+    if regressed:
+        print("\n".join(["", "Regressions:", *regressed]))
+        sys.exit(1)
+    print("\nNo regressions")
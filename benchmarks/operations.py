@@ -0,0 +1,261 @@
+"""
+The requests made to benchmark each operation in openapi/api.yml.
+
+Requests are built from a Sample of the seeded accounts, with a
+random.Random seeded by the caller, so a run against the same population
+makes the same requests in the same order.
+"""
+
+import os
+import random
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import yaml
+
+SPEC_PATH = os.path.join(os.path.dirname(__file__), "..", "openapi", "api.yml")
+
+# Accounts created by post_account are given emails like this, so they can
+# be removed after a run
+NEW_ACCOUNT_EMAIL_PREFIX = "benchmark."
+NEW_ACCOUNT_EMAIL_DOMAIN = "example.com"
+
+BULK_GET_ACCOUNTS = 20
+BULK_POST_ACCOUNTS = 500
+BULK_PUT_ACCOUNTS = 100
+SEARCH_PAGE_SIZE = 100
+CHANGES_PAGE_SIZE = 500
+
+# A deterministic sample of accounts, ordered by a hash of their id and the
+# seed so it doesn't depend on the order they were inserted in
+SAMPLE_ACCOUNTS = """
+    SELECT
+        account.id::text,
+        account.email,
+        account.azure_ad_subject_id,
+        coalesce(
+            array_agg(role.role ORDER BY role.role) FILTER (WHERE role.id IS NOT NULL),
+            '{}'
+        )
+    FROM (
+        SELECT * FROM account ORDER BY md5(id::text || %(seed)s) LIMIT %(size)s
+    ) AS account
+    LEFT JOIN role ON role.account_id = account.id
+    GROUP BY account.id, account.email, account.azure_ad_subject_id
+    ORDER BY md5(account.id::text || %(seed)s)
+"""
+SAMPLE_FUND_ROUNDS = """
+    SELECT DISTINCT fund, round FROM role WHERE fund IS NOT NULL ORDER BY 1, 2
+"""
+
+
+class Sample:
+    """
+    Accounts, roles, funds and rounds and email domains drawn from the
+    seeded population to build requests with
+    """
+
+    def __init__(self, accounts: List[tuple], fund_rounds: List[tuple]):
+        self.accounts = accounts
+        # Accounts the api can update: email lookups are lowercased, and
+        # put_account needs the azure_ad_subject_id
+        self.writable_accounts = [
+            account
+            for account in accounts
+            if account[1] == account[1].lower() and account[2]
+        ]
+        self.roles = sorted({role for account in accounts for role in account[3]})
+        self.fund_rounds = fund_rounds
+        self.email_domains = sorted(
+            {account[1].split("@")[1].lower() for account in accounts}
+        )
+
+    @classmethod
+    def load(cls, connection, size: int, seed: int) -> "Sample":
+        """
+        :param connection: an open psycopg2 connection to the seeded db
+        :param size: the number of accounts to sample
+        :param seed: picks which accounts are sampled
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(SAMPLE_ACCOUNTS, {"seed": str(seed), "size": size})
+            accounts = cursor.fetchall()
+            cursor.execute(SAMPLE_FUND_ROUNDS)
+            fund_rounds = cursor.fetchall()
+        connection.rollback()
+        if not accounts:
+            raise ValueError("There are no accounts to benchmark, seed the db first")
+        return cls(accounts, fund_rounds)
+
+
+class BenchmarkRequest:
+    def __init__(
+        self,
+        method: str,
+        path: str,
+        params: Optional[dict] = None,
+        json: Optional[dict] = None,
+        headers: Optional[dict] = None,
+    ):
+        self.method = method
+        self.path = path
+        self.params = params
+        self.json = json
+        self.headers = headers or {}
+
+
+def _roles(rng: random.Random, sample: Sample) -> List[str]:
+    return rng.sample(sample.roles, min(rng.randint(1, 5), len(sample.roles)))
+
+
+def get_account(rng: random.Random, sample: Sample, index: int):
+    account_id, email, subject_id, _ = rng.choice(sample.accounts)
+    lookup = rng.choice(
+        [
+            {"account_id": account_id},
+            {"email_address": email.lower()},
+            {"azure_ad_subject_id": subject_id},
+        ]
+    )
+    if None in lookup.values():
+        lookup = {"account_id": account_id}
+    return BenchmarkRequest("GET", "/accounts", params=lookup)
+
+
+def post_account(rng: random.Random, sample: Sample, index: int):
+    return BenchmarkRequest(
+        "POST",
+        "/accounts",
+        json={
+            "email_address": (
+                f"{NEW_ACCOUNT_EMAIL_PREFIX}{rng.getrandbits(64):x}.{index}"
+                f"@{NEW_ACCOUNT_EMAIL_DOMAIN}"
+            )
+        },
+    )
+
+
+def put_account(rng: random.Random, sample: Sample, index: int):
+    account_id, _, subject_id, _ = rng.choice(sample.writable_accounts)
+    return BenchmarkRequest(
+        "PUT",
+        f"/accounts/{account_id}",
+        json={"roles": _roles(rng, sample), "azure_ad_subject_id": subject_id},
+    )
+
+
+def get_accounts_for_fund(rng: random.Random, sample: Sample, index: int):
+    fund, fund_round = rng.choice(sample.fund_rounds)
+    include_assessors, include_commenters = rng.choice(
+        [("true", "true"), ("true", "false"), ("false", "true")]
+    )
+    params = {
+        "include_assessors": include_assessors,
+        "include_commenters": include_commenters,
+    }
+    if fund_round and rng.random() < 0.5:
+        params["round_short_name"] = fund_round
+    return BenchmarkRequest("GET", f"/accounts/fund/{fund}", params=params)
+
+
+def search_accounts(rng: random.Random, sample: Sample, index: int):
+    body = rng.choice(
+        [
+            {"email_domain": rng.choice(sample.email_domains)},
+            {"roles": rng.sample(sample.roles, min(2, len(sample.roles)))},
+            {"partial_roles": [rng.choice(sample.roles).rsplit("_", 1)[0]]},
+        ]
+    )
+    return BenchmarkRequest(
+        "POST", "/accounts/search", json={**body, "limit": SEARCH_PAGE_SIZE}
+    )
+
+
+def get_account_changes(rng: random.Random, sample: Sample, index: int):
+    # The first page of a client syncing every account, which costs the same
+    # as any later page of the same size
+    return BenchmarkRequest(
+        "GET", "/accounts/changes", params={"limit": CHANGES_PAGE_SIZE}
+    )
+
+
+def get_bulk_accounts(rng: random.Random, sample: Sample, index: int):
+    accounts = rng.sample(sample.accounts, min(BULK_GET_ACCOUNTS, len(sample.accounts)))
+    return BenchmarkRequest(
+        "GET",
+        "/bulk-accounts",
+        params={"account_id": [account[0] for account in accounts]},
+    )
+
+
+def post_bulk_accounts(rng: random.Random, sample: Sample, index: int):
+    accounts = rng.sample(
+        sample.accounts, min(BULK_POST_ACCOUNTS, len(sample.accounts))
+    )
+    return BenchmarkRequest(
+        "POST",
+        "/bulk-accounts",
+        json={"account_ids": [account[0] for account in accounts]},
+    )
+
+
+def put_bulk_accounts(rng: random.Random, sample: Sample, index: int):
+    accounts = rng.sample(
+        sample.writable_accounts,
+        min(BULK_PUT_ACCOUNTS, len(sample.writable_accounts)),
+    )
+    return BenchmarkRequest(
+        "PUT",
+        "/bulk-accounts",
+        json={
+            "accounts": [
+                {
+                    "email_address": email,
+                    "azure_ad_subject_id": subject_id,
+                    "roles": _roles(rng, sample),
+                }
+                for _, email, subject_id, _ in accounts
+            ]
+        },
+    )
+
+
+# Builds the request for the index'th call of each operationId
+OPERATIONS: Dict[str, Callable[[random.Random, Sample, int], BenchmarkRequest]] = {
+    "core.account.get_account": get_account,
+    "core.account.post_account": post_account,
+    "core.account.put_account": put_account,
+    "core.account.get_accounts_for_fund": get_accounts_for_fund,
+    "core.account.search_accounts": search_accounts,
+    "core.account.get_account_changes": get_account_changes,
+    "core.account.get_bulk_accounts": get_bulk_accounts,
+    "core.account.post_bulk_accounts": post_bulk_accounts,
+    "core.account.put_bulk_accounts": put_bulk_accounts,
+}
+
+# Operations that don't return a response to time, and aren't benchmarked
+UNBENCHMARKED_OPERATIONS = {"core.account.stream_account_changes"}
+
+# Operations called less often than the others, as a fraction of the number
+# of requests, because each call takes much longer: rosters for large funds
+# have tens of thousands of accounts
+REQUEST_FRACTIONS = {"core.account.get_accounts_for_fund": 0.1}
+
+
+def spec_operation_ids(spec_path: str = SPEC_PATH) -> List[str]:
+    """
+    The operationId of every operation in the openapi spec that is
+    benchmarked, in the order they are defined
+    """
+    with open(spec_path) as file:
+        spec = yaml.safe_load(file)
+    return [
+        operation["operationId"]
+        for path in spec["paths"].values()
+        for operation in path.values()
+        if isinstance(operation, dict)
+        and "operationId" in operation
+        and operation["operationId"] not in UNBENCHMARKED_OPERATIONS
+    ]
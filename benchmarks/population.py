@@ -0,0 +1,227 @@
+"""
+Generates a synthetic population of accounts and roles shaped like the
+production account store, and copies it into the db.
+
+Everything is drawn from a random.Random seeded by the caller, so the same
+seed and sizes always produce the same population:
+
+- a handful of large funds hold most of the roles, as a few funds run most
+  rounds, with fund wide and round roles, eg. COF_ASSESSOR and
+  NSTF_COMMENTER_R2. Roles like COF_R2W3_ASSESSOR aren't generated, as
+  highest_role_map can't parse them.
+- most accounts hold a few roles in one "home" fund, while a long tail of
+  lead assessors and admins hold dozens
+- some emails are mixed case, as accounts created before emails were
+  lowercased are, and some accounts have no full_name or azure_ad_subject_id
+"""
+
+import io
+import math
+import random
+import string
+import uuid
+from typing import Callable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+# Short names of funds and their rounds, largest fund first
+FUNDS = [
+    ("COF", ["R2W2", "R2W3", "R3W1", "R3W2", "R3W3", "R4W1"]),
+    ("NSTF", ["R2"]),
+    ("CTDF", ["R1"]),
+    ("CYP", ["R1"]),
+    ("DPIF", ["R2", "R3"]),
+    ("HSRA", ["R1", "VR1"]),
+    ("COF25", ["R1", "EOI"]),
+    ("UKPSF", ["R1", "R2"]),
+    ("GBRF", ["R1"]),
+    ("LUF", ["R1", "R2", "R3"]),
+    ("TFF", ["R1"]),
+    ("PFN", ["RP"]),
+]
+# Weights of each role type, roles without a role type are admin roles
+ROLE_TYPES = [("COMMENTER", 55), ("ASSESSOR", 35), ("LEAD_ASSESSOR", 10)]
+ADMIN_ROLES = ["SECTION_151", "FSD_ADMIN", "FLA_ADMIN"]
+ADMIN_ROLE_PROBABILITY = 0.01
+# The chance a role is for the account's home fund rather than any fund
+HOME_FUND_PROBABILITY = 0.8
+MAX_ROLES_PER_ACCOUNT = 60
+
+# Internal domains are most common, then local authorities and personal email
+EMAIL_DOMAINS = [
+    ("communities.gov.uk", 40),
+    ("levellingup.gov.uk", 15),
+    ("example.gov.uk", 10),
+    ("leeds.gov.uk", 5),
+    ("manchester.gov.uk", 5),
+    ("bristol.gov.uk", 4),
+    ("cornwall.gov.uk", 3),
+    ("gmail.com", 8),
+    ("outlook.com", 5),
+    ("hotmail.co.uk", 3),
+    ("example.org", 2),
+]
+FIRST_NAMES = [
+    "Aisha", "Ben", "Chloe", "Daniel", "Emma", "Fatima", "George", "Hannah",
+    "Isaac", "Jane", "Kwame", "Laura", "Mohammed", "Niamh", "Oliver", "Priya",
+    "Rhys", "Sophie", "Tom", "Wei",
+]  # fmt: skip
+LAST_NAMES = [
+    "Ahmed", "Brown", "Campbell", "Davies", "Evans", "Green", "Hughes", "Jones",
+    "Khan", "Murphy", "Nowak", "Patel", "Roberts", "Smith", "Taylor", "Thomas",
+    "Walker", "Williams", "Wilson", "Wright",
+]  # fmt: skip
+
+LEGACY_EMAIL_PROBABILITY = 0.05
+FULL_NAME_PROBABILITY = 0.85
+AZURE_AD_SUBJECT_ID_PROBABILITY = 0.9
+
+# Accounts generated and copied into the db at a time
+COPY_BATCH_SIZE = 20_000
+
+
+def _zipf_weights(count: int, exponent: float = 1.1) -> List[float]:
+    return [1 / (rank**exponent) for rank in range(1, count + 1)]
+
+
+class Population:
+    """
+    Generates accounts, each a tuple of id, email, full_name,
+    azure_ad_subject_id and a list of roles
+    """
+
+    def __init__(self, accounts: int, roles_per_account: float, seed: int):
+        self.accounts = accounts
+        self.roles_per_account = roles_per_account
+        self.seed = seed
+        self._fund_weights = _zipf_weights(len(FUNDS))
+        self._domains, self._domain_weights = zip(*EMAIL_DOMAINS)
+        self._role_types, self._role_type_weights = zip(*ROLE_TYPES)
+
+    def __iter__(self) -> Iterator[Tuple[str, str, str, str, List[str]]]:
+        rng = random.Random(self.seed)
+        for index in range(self.accounts):
+            yield self._account(rng, index)
+
+    def _account(self, rng: random.Random, index: int):
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        # The index keeps emails unique
+        email = (
+            f"{first_name}.{last_name}{index}@"
+            + rng.choices(self._domains, self._domain_weights)[0]
+        )
+        if rng.random() >= LEGACY_EMAIL_PROBABILITY:
+            email = email.lower()
+
+        return (
+            str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            email,
+            (
+                f"{first_name} {last_name}"
+                if rng.random() < FULL_NAME_PROBABILITY
+                else None
+            ),
+            (
+                "".join(rng.choices(string.ascii_letters + string.digits, k=43))
+                if rng.random() < AZURE_AD_SUBJECT_ID_PROBABILITY
+                else None
+            ),
+            self._roles(rng),
+        )
+
+    def _roles(self, rng: random.Random) -> List[str]:
+        # Log-normal, so most accounts hold a few roles and a few hold dozens
+        count = min(
+            round(
+                rng.lognormvariate(math.log(max(self.roles_per_account, 0.1)) - 0.5, 1)
+            ),
+            MAX_ROLES_PER_ACCOUNT,
+        )
+        home_fund = rng.choices(FUNDS, self._fund_weights)[0]
+        roles = set()
+        # Draw again when a role is drawn twice, up to a point, as small funds
+        # only have a few roles
+        for _ in range(count * 4):
+            if len(roles) == count:
+                break
+            if rng.random() < ADMIN_ROLE_PROBABILITY:
+                roles.add(rng.choice(ADMIN_ROLES))
+                continue
+            fund, rounds = (
+                home_fund
+                if rng.random() < HOME_FUND_PROBABILITY
+                else rng.choices(FUNDS, self._fund_weights)[0]
+            )
+            role_type = rng.choices(self._role_types, self._role_type_weights)[0]
+            role_round = rng.choice(rounds)
+            roles.add(
+                rng.choice([f"{fund}_{role_type}", f"{fund}_{role_type}_{role_round}"])
+            )
+        return sorted(roles)
+
+
+def _copy_value(value) -> str:
+    # Generated values never contain tabs, newlines or backslashes
+    return "\\N" if value is None else value
+
+
+def seed_population(
+    connection, population: Population, log: Callable[[str], None] = print
+) -> Tuple[int, int]:
+    """
+    Copy a population into the account and role tables, committing it in one
+    transaction
+    :param connection: an open psycopg2 connection
+    :param population: the accounts to add, none of which may already exist
+    :param log: called with progress messages
+    :return: The number of accounts and roles added
+    """
+    accounts_added = roles_added = 0
+    try:
+        with connection.cursor() as cursor:
+            accounts = iter(population)
+            while True:
+                account_rows = io.StringIO()
+                role_rows = io.StringIO()
+                batch = 0
+                for account_id, email, full_name, subject_id, roles in accounts:
+                    account_rows.write(
+                        "\t".join(
+                            _copy_value(value)
+                            for value in (account_id, email, full_name, subject_id)
+                        )
+                        + "\n"
+                    )
+                    for role in roles:
+                        role_rows.write(f"{uuid.uuid4()}\t{account_id}\t{role}\n")
+                    roles_added += len(roles)
+                    batch += 1
+                    if batch == COPY_BATCH_SIZE:
+                        break
+                if not batch:
+                    break
+
+                account_rows.seek(0)
+                role_rows.seek(0)
+                cursor.copy_expert(
+                    "COPY account (id, email, full_name, azure_ad_subject_id) "
+                    "FROM STDIN",
+                    account_rows,
+                )
+                cursor.copy_expert(
+                    "COPY role (id, account_id, role) FROM STDIN", role_rows
+                )
+                accounts_added += batch
+                log(f"Copied {accounts_added} accounts and {roles_added} roles...")
+
+            cursor.execute("ANALYZE account")
+            cursor.execute("ANALYZE role")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    log(f"Seeded {accounts_added} accounts with {roles_added} roles")
+    return accounts_added, roles_added
@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+Seeds a local db with a synthetic population and benchmarks every operation
+in openapi/api.yml against it.
+
+Each operation is called in turn, after a few warm up calls, and its
+throughput, latency percentiles and the db statements each call ran (from the
+Server-Timing header) are printed and written to a JSON results file.
+
+By default the app is served in this process, through its test client, so
+results don't depend on a server's worker count. Pass --base_url to
+benchmark a running server instead, optionally with concurrent clients. The
+server needs DB_REQUEST_STATS_HEADER_ENABLED for statement counts.
+
+------------------------ How to run the script -----------------------
+Use a db of its own, as seeding with --reset removes every account.
+
+>> python -m benchmarks.run seed --accounts 500000 --roles_per_account 6 --reset \
+        --database_url postgresql://...
+>> python -m benchmarks.run run --requests 200 --output results.json \
+        --database_url postgresql://...
+
+or, against the local development db
+
+>> invoke seed-benchmark-db --accounts 500000 --reset
+>> invoke benchmark --output results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timezone
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+from requests import Session
+
+from benchmarks.operations import NEW_ACCOUNT_EMAIL_DOMAIN
+from benchmarks.operations import NEW_ACCOUNT_EMAIL_PREFIX
+from benchmarks.operations import OPERATIONS
+from benchmarks.operations import REQUEST_FRACTIONS
+from benchmarks.operations import Sample
+from benchmarks.operations import spec_operation_ids
+from benchmarks.population import Population
+from benchmarks.population import seed_population
+
+DEFAULT_REQUESTS = 200
+DEFAULT_WARMUP_REQUESTS = 10
+DEFAULT_SAMPLE_SIZE = 2000
+DEFAULT_SEED = 1
+
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) statements"')
+
+# The accounts benchmarks update, saved beforehand and restored afterwards so
+# every run starts from the same population
+SAVE_ACCOUNTS = """
+    SELECT id::text, full_name, azure_ad_subject_id, version
+    FROM account
+    WHERE id = ANY(%(ids)s::uuid[])
+"""
+SAVE_ROLES = """
+    SELECT id::text, account_id::text, role
+    FROM role
+    WHERE account_id = ANY(%(ids)s::uuid[])
+"""
+RESTORE_ACCOUNTS = """
+    UPDATE account SET
+        full_name = saved.full_name,
+        azure_ad_subject_id = saved.azure_ad_subject_id,
+        version = saved.version
+    FROM (VALUES %s) AS saved(id, full_name, azure_ad_subject_id, version)
+    WHERE account.id = saved.id::uuid
+"""
+REMOVE_ROLES = "DELETE FROM role WHERE account_id = ANY(%(ids)s::uuid[])"
+RESTORE_ROLES = "INSERT INTO role (id, account_id, role) VALUES %s"
+REMOVE_NEW_ACCOUNT_ROLES = """
+    DELETE FROM role
+    USING account
+    WHERE role.account_id = account.id AND account.email LIKE %(pattern)s
+"""
+REMOVE_NEW_ACCOUNTS = "DELETE FROM account WHERE email LIKE %(pattern)s"
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    """
+    The percentile of values, interpolating between the closest ranks
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def _summary(values: List[float], percents=(50, 90, 95, 99)) -> Optional[dict]:
+    if not values:
+        return None
+    return {
+        **{
+            f"p{percent}": round(percentile(values, percent), 3) for percent in percents
+        },
+        "mean": round(sum(values) / len(values), 3),
+        "max": round(max(values), 3),
+    }
+
+
+class OperationResult:
+    """
+    The calls made to one operation
+    """
+
+    def __init__(self):
+        self.latencies_ms: List[float] = []
+        self.db_ms: List[float] = []
+        self.db_statements: List[float] = []
+        self.status_codes: Dict[str, int] = {}
+        self.seconds = 0.0
+
+    def record(self, latency_seconds: float, status: int, server_timing: str):
+        self.latencies_ms.append(latency_seconds * 1000)
+        self.status_codes[str(status)] = self.status_codes.get(str(status), 0) + 1
+        db_timing = SERVER_TIMING_DB.search(server_timing or "")
+        if db_timing:
+            self.db_ms.append(float(db_timing.group(1)))
+            self.db_statements.append(int(db_timing.group(2)))
+
+    def as_dict(self) -> dict:
+        requests = len(self.latencies_ms)
+        return {
+            "requests": requests,
+            "errors": sum(
+                count
+                for status, count in self.status_codes.items()
+                if not (200 <= int(status) < 400)
+            ),
+            "status_codes": dict(sorted(self.status_codes.items())),
+            "throughput_per_second": (
+                round(requests / self.seconds, 2) if self.seconds else None
+            ),
+            "latency_ms": _summary(self.latencies_ms),
+            "db_ms": _summary(self.db_ms),
+            "db_statements": _summary(self.db_statements, percents=(50, 95)),
+        }
+
+
+class InProcessClient:
+    """
+    Calls the app in this process through its test client, by default the
+    app in app.py
+    """
+
+    def __init__(self, connexion_app=None):
+        if connexion_app is None:
+            # Imported here, as the app's config is read from the environment
+            # when it is first imported
+            from app import app as connexion_app
+
+        self.metrics = connexion_app.app.extensions["metrics"]
+        self.logger = connexion_app.app.logger
+        self._restore = (self.metrics.db_stats_header_enabled, self.logger.level)
+        self.metrics.db_stats_header_enabled = True
+        # Log as much as production does, rather than every request
+        self.logger.setLevel(logging.WARNING)
+        # Entered so every request runs on the same event loop, which the
+        # async path's connections are bound to
+        self.test_client = connexion_app.test_client().__enter__()
+        self.concurrent = False
+
+    def request(self, benchmark_request):
+        return self.test_client.request(
+            benchmark_request.method,
+            benchmark_request.path,
+            params=benchmark_request.params,
+            json=benchmark_request.json,
+            headers=benchmark_request.headers,
+        )
+
+    def close(self):
+        self.test_client.__exit__(None, None, None)
+        # Starlette leaves the streams to the app's lifespan open
+        for stream in (self.test_client.stream_send, self.test_client.stream_receive):
+            stream.send_stream.close()
+            stream.receive_stream.close()
+        self.metrics.db_stats_header_enabled, level = self._restore
+        self.logger.setLevel(level)
+
+
+class HttpClient:
+    """
+    Calls a running server, with a session per thread
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.concurrent = True
+        self._local = threading.local()
+
+    def request(self, benchmark_request):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = Session()
+        return session.request(
+            benchmark_request.method,
+            self.base_url + benchmark_request.path,
+            params=benchmark_request.params,
+            json=benchmark_request.json,
+            headers=benchmark_request.headers,
+        )
+
+    def close(self):
+        pass
+
+
+def benchmark_operation(
+    client,
+    operation_id: str,
+    sample: Sample,
+    requests: int,
+    warmup_requests: int = DEFAULT_WARMUP_REQUESTS,
+    concurrency: int = 1,
+    seed: int = DEFAULT_SEED,
+) -> OperationResult:
+    """
+    Call an operation requests times, after warmup_requests calls that
+    aren't measured
+    """
+    build_request = OPERATIONS[operation_id]
+    rng = random.Random(f"{seed}:{operation_id}")
+    benchmark_requests = [
+        build_request(rng, sample, index) for index in range(warmup_requests + requests)
+    ]
+    result = OperationResult()
+
+    def call(benchmark_request):
+        started = time.perf_counter()
+        response = client.request(benchmark_request)
+        return (
+            time.perf_counter() - started,
+            response.status_code,
+            response.headers.get("server-timing"),
+        )
+
+    for benchmark_request in benchmark_requests[:warmup_requests]:
+        call(benchmark_request)
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as executor:
+            for measurement in executor.map(call, benchmark_requests[warmup_requests:]):
+                result.record(*measurement)
+    else:
+        for benchmark_request in benchmark_requests[warmup_requests:]:
+            result.record(*call(benchmark_request))
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def population_counts(connection) -> dict:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT (SELECT count(*) FROM account), (SELECT count(*) FROM role)"
+        )
+        accounts, roles = cursor.fetchone()
+    connection.rollback()
+    return {"accounts": accounts, "roles": roles}
+
+
+def save_accounts(connection, account_ids: List[str]) -> Tuple[list, list]:
+    """
+    Save accounts and their roles, to be restored by restore_population
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(SAVE_ACCOUNTS, {"ids": account_ids})
+        accounts = cursor.fetchall()
+        cursor.execute(SAVE_ROLES, {"ids": account_ids})
+        roles = cursor.fetchall()
+    connection.rollback()
+    return accounts, roles
+
+
+def restore_population(connection, saved_accounts: Tuple[list, list]):
+    """
+    Undo the changes benchmarks make: restore the accounts saved by
+    save_accounts, and remove the accounts created by post_account
+    """
+    accounts, roles = saved_accounts
+    pattern = {"pattern": f"{NEW_ACCOUNT_EMAIL_PREFIX}%@{NEW_ACCOUNT_EMAIL_DOMAIN}"}
+    with connection.cursor() as cursor:
+        if accounts:
+            execute_values(cursor, RESTORE_ACCOUNTS, accounts)
+            cursor.execute(REMOVE_ROLES, {"ids": [account[0] for account in accounts]})
+        if roles:
+            execute_values(cursor, RESTORE_ROLES, roles)
+        cursor.execute(REMOVE_NEW_ACCOUNT_ROLES, pattern)
+        cursor.execute(REMOVE_NEW_ACCOUNTS, pattern)
+    connection.commit()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    connection,
+    client,
+    operation_ids: Optional[List[str]] = None,
+    requests: int = DEFAULT_REQUESTS,
+    warmup_requests: int = DEFAULT_WARMUP_REQUESTS,
+    concurrency: int = 1,
+    sample_size: int = DEFAULT_SAMPLE_SIZE,
+    seed: int = DEFAULT_SEED,
+    log: Callable[[str], None] = print,
+) -> dict:
+    """
+    Benchmark operations in the openapi spec
+    :param connection: an open psycopg2 connection to the db the app uses
+    :param client: the client to call the app with
+    :param operation_ids: the operations to benchmark, by default all of them
+    :return: The results, ready to be written as JSON
+    """
+    if operation_ids is None:
+        operation_ids = spec_operation_ids()
+    missing = [
+        operation_id for operation_id in operation_ids if operation_id not in OPERATIONS
+    ]
+    if missing:
+        raise ValueError(f"No benchmark for {', '.join(missing)}")
+    if concurrency > 1 and not client.concurrent:
+        raise ValueError("Concurrent requests need a running server, see --base_url")
+
+    sample = Sample.load(connection, sample_size, seed)
+    saved_accounts = save_accounts(
+        connection, [account[0] for account in sample.writable_accounts]
+    )
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "population": population_counts(connection),
+            "requests": requests,
+            "warmup_requests": warmup_requests,
+            "concurrency": concurrency,
+            "sample_size": sample_size,
+            "seed": seed,
+        },
+        "operations": {},
+    }
+    try:
+        for operation_id in operation_ids:
+            log(f"Benchmarking {operation_id}...")
+            fraction = REQUEST_FRACTIONS.get(operation_id, 1)
+            results["operations"][operation_id] = benchmark_operation(
+                client,
+                operation_id,
+                sample,
+                max(round(requests * fraction), 1),
+                warmup_requests=round(warmup_requests * fraction),
+                concurrency=concurrency,
+                seed=seed,
+            ).as_dict()
+    finally:
+        restore_population(connection, saved_accounts)
+    return results
+
+
+def format_results(results: dict) -> str:
+    """
+    A table of the results, one operation per row
+    """
+    header = (
+        "operation",
+        "req/s",
+        "p50 ms",
+        "p95 ms",
+        "p99 ms",
+        "stmts p95",
+        "errors",
+    )
+    rows = [header]
+    for operation_id, result in results["operations"].items():
+        latency = result["latency_ms"] or {}
+        statements = result["db_statements"] or {}
+        rows.append(
+            (
+                operation_id,
+                str(result["throughput_per_second"]),
+                str(latency.get("p50")),
+                str(latency.get("p95")),
+                str(latency.get("p99")),
+                str(statements.get("p95")),
+                str(result["errors"]),
+            )
+        )
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    return "\n".join(
+        "  ".join(
+            value.ljust(width) if column == 0 else value.rjust(width)
+            for column, (value, width) in enumerate(zip(row, widths))
+        )
+        for row in rows
+    )
+
+
+def write_results(results: dict, path: str):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+        file.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--database_url",
+        help="The db to seed and benchmark, by default DATABASE_URL",
+        required=False,
+        default=os.getenv("DATABASE_URL"),
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_command = commands.add_parser("seed", help="Seed a synthetic population")
+    seed_command.add_argument("--accounts", type=int, default=500_000)
+    seed_command.add_argument(
+        "--roles_per_account",
+        type=float,
+        default=6,
+        help="The mean number of roles held by each account",
+    )
+    seed_command.add_argument(
+        "--reset",
+        action="store_true",
+        help="Remove every account and role first",
+    )
+
+    run_command = commands.add_parser("run", help="Benchmark the api operations")
+    run_command.add_argument(
+        "--operation",
+        action="append",
+        dest="operations",
+        help="An operationId to benchmark, by default every operation",
+    )
+    run_command.add_argument("--requests", type=int, default=DEFAULT_REQUESTS)
+    run_command.add_argument(
+        "--warmup_requests", type=int, default=DEFAULT_WARMUP_REQUESTS
+    )
+    run_command.add_argument("--sample_size", type=int, default=DEFAULT_SAMPLE_SIZE)
+    run_command.add_argument(
+        "--base_url", help="A running server to benchmark, eg. http://localhost:8080"
+    )
+    run_command.add_argument("--concurrency", type=int, default=1)
+    run_command.add_argument(
+        "--async_request_path",
+        action="store_true",
+        help="Benchmark core.account_async, when the app is served in this process",
+    )
+    run_command.add_argument("--output", help="A file to write the results to")
+    args = parser.parse_args()
+
+    db_connection = psycopg2.connect(args.database_url)
+    try:
+        if args.command == "seed":
+            if args.reset:
+                with db_connection.cursor() as db_cursor:
+                    db_cursor.execute("TRUNCATE role, account")
+                db_connection.commit()
+            seed_population(
+                db_connection,
+                Population(args.accounts, args.roles_per_account, args.seed),
+            )
+        else:
+            # The app in this process uses the same db
+            os.environ["DATABASE_URL"] = args.database_url
+            if args.async_request_path:
+                os.environ["ASYNC_REQUEST_PATH_ENABLED"] = "true"
+            app_client = (
+                HttpClient(args.base_url) if args.base_url else InProcessClient()
+            )
+            try:
+                benchmark_results = run_benchmarks(
+                    db_connection,
+                    app_client,
+                    operation_ids=args.operations,
+                    requests=args.requests,
+                    warmup_requests=args.warmup_requests,
+                    concurrency=args.concurrency,
+                    sample_size=args.sample_size,
+                    seed=args.seed,
+                )
+            finally:
+                app_client.close()
+            print(format_results(benchmark_results))
+            if args.output:
+                write_results(benchmark_results, args.output)
+    finally:
+        db_connection.close()
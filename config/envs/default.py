@@ -7,6 +7,13 @@ from pathlib import Path
 from fsd_utils import CommonConfig
 from fsd_utils import configclass
 
+from db.pool import InstrumentedAsyncAdaptedQueuePool
+from db.pool import InstrumentedAsyncAdaptedReplicaQueuePool
+from db.pool import InstrumentedQueuePool
+from db.pool import InstrumentedReplicaQueuePool
+from db.pool import unique_prepared_statement_name
+from db.replica import REPLICA_BIND_KEY
+
 
 @configclass
 class DefaultConfig(object):
@@ -23,3 +30,102 @@ class DefaultConfig(object):
         "postgres://", "postgresql://"
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool, per worker process
+    DB_POOL_SIZE = int(environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT_SECONDS = int(environ.get("DB_POOL_TIMEOUT_SECONDS", 10))
+    DB_POOL_RECYCLE_SECONDS = int(environ.get("DB_POOL_RECYCLE_SECONDS", 1800))
+    DB_POOL_PRE_PING = environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+    # Connect through PgBouncer in transaction pooling mode, where consecutive
+    # transactions may run on different server connections
+    DB_PGBOUNCER_TRANSACTION_POOLING = (
+        environ.get("DB_PGBOUNCER_TRANSACTION_POOLING", "false").lower() == "true"
+    )
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    # Where the validated openapi spec is cached, see core.spec, or empty to
+    # parse and validate it every time the app is created
+    OPENAPI_SPEC_CACHE_DIR = environ.get(
+        "OPENAPI_SPEC_CACHE_DIR", FLASK_ROOT + "/openapi/.cache"
+    )
+    # Serve the api with core.account_async on an asyncpg engine, rather than
+    # with core.account on a thread per in-flight request
+    ASYNC_REQUEST_PATH_ENABLED = (
+        environ.get("ASYNC_REQUEST_PATH_ENABLED", "false").lower() == "true"
+    )
+    ASYNC_SQLALCHEMY_ENGINE_OPTIONS = {
+        **SQLALCHEMY_ENGINE_OPTIONS,
+        "poolclass": InstrumentedAsyncAdaptedQueuePool,
+    }
+    if DB_PGBOUNCER_TRANSACTION_POOLING:
+        # psycopg2 never prepares statements server side, but asyncpg does
+        # unless its statement caches are off and every name is unique
+        ASYNC_SQLALCHEMY_ENGINE_OPTIONS["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": unique_prepared_statement_name,
+        }
+
+    # A read replica of the db, that operations decorated with
+    # db.replica.reads_from_replica read from, or empty to read from the
+    # primary. Reads made this long after the same client last wrote still go
+    # to the primary, so clients see their own writes.
+    REPLICA_DATABASE_URL = environ.get("REPLICA_DATABASE_URL", "")
+    REPLICA_READ_YOUR_WRITES_SECONDS = int(
+        environ.get("REPLICA_READ_YOUR_WRITES_SECONDS", 10)
+    )
+    SQLALCHEMY_BINDS = {}
+    if REPLICA_DATABASE_URL:
+        SQLALCHEMY_BINDS[REPLICA_BIND_KEY] = {
+            **SQLALCHEMY_ENGINE_OPTIONS,
+            "url": REPLICA_DATABASE_URL,
+            "poolclass": InstrumentedReplicaQueuePool,
+        }
+    ASYNC_REPLICA_SQLALCHEMY_ENGINE_OPTIONS = {
+        **ASYNC_SQLALCHEMY_ENGINE_OPTIONS,
+        "poolclass": InstrumentedAsyncAdaptedReplicaQueuePool,
+    }
+
+    # Per-request db statement counts and time, sent in a Server-Timing
+    # response header when enabled and logged as a warning above the threshold
+    DB_REQUEST_STATS_HEADER_ENABLED = (
+        environ.get("DB_REQUEST_STATS_HEADER_ENABLED", "false").lower() == "true"
+    )
+    DB_REQUEST_STATEMENTS_WARNING_THRESHOLD = int(
+        environ.get("DB_REQUEST_STATEMENTS_WARNING_THRESHOLD", 25)
+    )
+
+    # Account cache
+    ACCOUNT_CACHE_MAXSIZE = int(environ.get("ACCOUNT_CACHE_MAXSIZE", 10000))
+    ACCOUNT_CACHE_TTL_SECONDS = int(environ.get("ACCOUNT_CACHE_TTL_SECONDS", 30))
+    # Evict accounts changed by other workers, or outside the app, from the cache
+    ACCOUNT_CHANGE_LISTENER_ENABLED = (
+        environ.get("ACCOUNT_CHANGE_LISTENER_ENABLED", "true").lower() == "true"
+    )
+    # LISTEN needs a session of its own, so when connecting through PgBouncer
+    # in transaction pooling mode this must bypass it. Defaults to
+    # SQLALCHEMY_DATABASE_URI.
+    ACCOUNT_CHANGE_LISTENER_DATABASE_URL = environ.get(
+        "ACCOUNT_CHANGE_LISTENER_DATABASE_URL", ""
+    ).replace("postgres://", "postgresql://")
+
+    # Account change stream, GET /accounts/stream. Changes are read as soon
+    # as the listener is notified of them, and every POLL_SECONDS for those
+    # only readable once an older transaction has finished.
+    ACCOUNT_CHANGE_STREAM_POLL_SECONDS = float(
+        environ.get("ACCOUNT_CHANGE_STREAM_POLL_SECONDS", 5)
+    )
+    ACCOUNT_CHANGE_STREAM_HEARTBEAT_SECONDS = float(
+        environ.get("ACCOUNT_CHANGE_STREAM_HEARTBEAT_SECONDS", 15)
+    )
+    # Streams are ended after this long, and clients reconnect and carry on
+    # from the last event they received
+    ACCOUNT_CHANGE_STREAM_MAX_SECONDS = float(
+        environ.get("ACCOUNT_CHANGE_STREAM_MAX_SECONDS", 300)
+    )
@@ -11,3 +11,6 @@ from config.envs.default import DefaultConfig as Config
 class DevelopmentConfig(Config):
     # Logging
     FSD_LOG_LEVEL = logging.DEBUG
+
+    # Database
+    DB_REQUEST_STATS_HEADER_ENABLED = True
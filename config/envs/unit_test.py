@@ -3,6 +3,7 @@
 import logging
 
 from fsd_utils import configclass
+from sqlalchemy.pool import NullPool
 
 from config.envs.default import DefaultConfig as Config
 
@@ -15,3 +16,13 @@ class UnitTestConfig(Config):
     # Database
     SQLALCHEMY_DATABASE_URI = Config.SQLALCHEMY_DATABASE_URI + "_UNIT_TEST"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Each test client runs requests on its own event loop
+    ASYNC_SQLALCHEMY_ENGINE_OPTIONS = {"poolclass": NullPool}
+    ASYNC_REPLICA_SQLALCHEMY_ENGINE_OPTIONS = {"poolclass": NullPool}
+    DB_REQUEST_STATS_HEADER_ENABLED = True
+
+    # Tests start their own listener where they need one
+    ACCOUNT_CHANGE_LISTENER_ENABLED = False
+    # So the account change stream reads changes without the listener
+    ACCOUNT_CHANGE_STREAM_POLL_SECONDS = 0.1
+    ACCOUNT_CHANGE_STREAM_MAX_SECONDS = 2
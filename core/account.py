@@ -2,24 +2,71 @@
 Contains the functions directly used by the openapi spec.
 """
 
+import binascii
+import hashlib
+import itertools
+import uuid
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Mapping
+from typing import Optional
 from typing import Tuple
 
 import sqlalchemy
 from email_validator import validate_email
+from flask import Response
+from flask import current_app
 from flask import request
+from flask import stream_with_context
+from sqlalchemy import ARRAY
+from sqlalchemy import and_
 from sqlalchemy import any_
+from sqlalchemy import bindparam
 from sqlalchemy import delete
 from sqlalchemy import or_
+from sqlalchemy import Select
+from sqlalchemy import String
+from sqlalchemy import func
 from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import selectinload
-
+from sqlalchemy.orm import subqueryload
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.datastructures import ETags
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import quote_etag
+from werkzeug.http import unquote_etag
+
+from core.cache import account_cache
+from core.changes import change_results
+from core.changes import changed_accounts_statement
+from core.changes import changes_statement
 from db import db
 from db.models.account import Account
+from db.models.role import ASSESSOR
+from db.models.role import COMMENTER
+from db.models.role import LEAD_ASSESSOR
 from db.models.role import Role
+from db.replica import iterate_as_read
+from db.replica import reads_from_replica
 from db.schemas.account import AccountSchema
+from db.schemas.account import serialize_account
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+SEARCH_ACCOUNTS_DEFAULT_LIMIT = 100
+ACCOUNT_CHANGES_DEFAULT_LIMIT = 500
+STREAM_ACCOUNTS_BATCH_SIZE = 500
 
 
+# Reads from the primary, as the accounts it returns are cached, and the
+# cache is kept fresh by the primary's change notifications
 def get_account(
     account_id: str = None,
     email_address: str = None,
@@ -42,25 +89,49 @@ def get_account(
             )
         }, 400
 
-    stmnt = select(Account)
     email_address = email_address.lower() if email_address else email_address
 
-    if account_id:
-        stmnt = stmnt.filter(Account.id == account_id)
-    if email_address:
-        stmnt = stmnt.filter(Account.email == email_address)
-    if azure_ad_subject_id:
-        stmnt = stmnt.filter(Account.azure_ad_subject_id == azure_ad_subject_id)
+    cached = account_cache.get_versioned(
+        account_id=account_id,
+        email_address=email_address,
+        azure_ad_subject_id=azure_ad_subject_id,
+    )
+    if cached and cached[1] is not None:
+        cached_account, version = cached
+        return _conditional_response(
+            cached_account,
+            _account_etag(cached_account["account_id"], version),
+            request.if_none_match,
+        )
+    cache_generation = account_cache.generation
+
+    conditions = _account_conditions(account_id, email_address, azure_ad_subject_id)
 
     try:
-        result = db.session.execute(stmnt)
+        if request.if_none_match:
+            # Check the version before loading and serialising the account
+            account_id_and_version = db.session.execute(
+                select(Account.id, Account.version).filter(*conditions)
+            ).one()
+            etag = _account_etag(*account_id_and_version)
+            if _etag_matches(request.if_none_match, etag):
+                return _not_modified(etag)
+
+        result = db.session.execute(select(Account).filter(*conditions))
         account = result.scalars().one()
         account_schema = AccountSchema()
-        return account_schema.dump(account), 200
+        account_json = account_schema.dump(account)
+        account_cache.set(account_json, cache_generation, account.version)
+        return _conditional_response(
+            account_json,
+            _account_etag(account.id, account.version),
+            request.if_none_match,
+        )
     except sqlalchemy.exc.NoResultFound:
         return {"error": "No matching account found"}, 404
 
 
+@reads_from_replica
 def get_bulk_accounts(
     account_id: list,
 ) -> Dict:
@@ -74,21 +145,412 @@ def get_bulk_accounts(
     if not account_id:
         return {"error": "Bad request: please provide at least 1 account_id "}, 400
 
-    stmnt = select(Account)
-    stmnt = stmnt.filter(Account.id.in_(account_id))
+    return _get_bulk_accounts(account_id)
 
+
+@reads_from_replica
+def post_bulk_accounts(body: dict) -> Dict:
+    """
+    Get multiple accounts corresponding to the account ids in the request
+    body, for batches too large to send as query parameters
+    :param body: dict containing the account_ids to search
+    :return:
+        Nested dict of account_id: {account object}
+    """
+    account_ids = body.get("account_ids")
+    if not account_ids:
+        return {"error": "Bad request: please provide at least 1 account_id "}, 400
+
+    return _get_bulk_accounts(account_ids)
+
+
+def put_bulk_accounts(body: dict) -> Tuple[dict, int]:
+    """
+    Create or update a batch of accounts, matched by email, replacing each
+    one's roles, all in one transaction. Accounts whose azure_ad_subject_id
+    clashes with another account are skipped and reported as errors.
+    :param body: dict containing the accounts to upsert
+    :return:
+        dict with the account id and status of each account, in the order
+        they were given
+    """
     try:
-        result = db.session.scalars(stmnt)
-        account_schema = AccountSchema()
+        accounts = _bulk_upsert_accounts(body["accounts"])
+    except ValueError as e:
+        return {"error": f"Bad request: {e}"}, 400
 
-        accounts_metadatas = {
-            str(account_row.id): account_schema.dump(account_row)
-            for account_row in result
+    errors = _bulk_upsert_errors(
+        accounts, db.session.execute(_bulk_upsert_existing_statement(accounts))
+    )
+    upserts = {
+        email: account for email, account in accounts.items() if email not in errors
+    }
+    statuses = {}
+    if upserts:
+        try:
+            _record_upserted(
+                upserts,
+                db.session.execute(_bulk_upsert_statement(upserts)),
+                statuses,
+                "updated",
+            )
+            unchanged_emails = [email for email in upserts if email not in statuses]
+            if unchanged_emails:
+                _record_upserted(
+                    upserts,
+                    db.session.execute(
+                        _bulk_upsert_unchanged_statement(unchanged_emails)
+                    ),
+                    statuses,
+                    "unchanged",
+                )
+
+            existing_roles = db.session.execute(_bulk_upsert_roles_statement(upserts))
+            for stmnt in _bulk_upsert_role_statements(
+                upserts, existing_roles, statuses
+            ):
+                db.session.execute(stmnt)
+            db.session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            db.session.rollback()
+            return _bulk_upsert_conflict_error()
+        _invalidate_upserted(upserts, statuses)
+
+    return _bulk_upsert_response(accounts, errors, statuses)
+
+
+def _bulk_upsert_accounts(accounts: List[dict]) -> Dict[str, dict]:
+    """
+    Normalise the accounts in a put_bulk_accounts request as put_account
+    does, keyed by lowercased email, giving each one the id it will have if
+    it is created
+    :raises ValueError: if an email or azure_ad_subject_id is given twice
+    """
+    normalised = {}
+    subject_ids = set()
+    for account in accounts:
+        email = account["email_address"].lower()
+        azure_ad_subject_id = account.get("azure_ad_subject_id") or None
+        if email in normalised:
+            raise ValueError(f"{email} is given more than once")
+        if azure_ad_subject_id in subject_ids:
+            raise ValueError(f"{azure_ad_subject_id} is given more than once")
+        if azure_ad_subject_id:
+            subject_ids.add(azure_ad_subject_id)
+        normalised[email] = {
+            "account_id": uuid.uuid4(),
+            "full_name": account.get("full_name") or None,
+            "azure_ad_subject_id": azure_ad_subject_id,
+            "roles": list(dict.fromkeys(role.upper() for role in account["roles"])),
         }
+    return normalised
 
-        return accounts_metadatas, 200
-    except sqlalchemy.exc.NoResultFound:
-        return {"error": "No matching account found"}, 404
+
+def _array(values: Iterable, item_type):
+    # Batches are bound as one array per column rather than one parameter
+    # per value, so the number of parameters doesn't grow with the batch
+    return sqlalchemy.literal(list(values), ARRAY(item_type))
+
+
+def _bulk_upsert_existing_statement(accounts: Dict[str, dict]):
+    subject_ids = [
+        account["azure_ad_subject_id"]
+        for account in accounts.values()
+        if account["azure_ad_subject_id"]
+    ]
+    return select(Account.email, Account.azure_ad_subject_id).filter(
+        or_(
+            Account.email == any_(_array(accounts, String)),
+            Account.azure_ad_subject_id == any_(_array(subject_ids, String)),
+        )
+    )
+
+
+def _bulk_upsert_errors(
+    accounts: Dict[str, dict], existing: Iterable[tuple]
+) -> Dict[str, str]:
+    # As with put_account, an account's azure_ad_subject_id can be set but
+    # not changed
+    emails_by_subject_id = {
+        account["azure_ad_subject_id"]: email
+        for email, account in accounts.items()
+        if account["azure_ad_subject_id"]
+    }
+    errors = {}
+    for existing_email, existing_subject_id in existing:
+        account = accounts.get(existing_email)
+        if (
+            account
+            and account["azure_ad_subject_id"]
+            and existing_subject_id
+            and account["azure_ad_subject_id"] != existing_subject_id
+        ):
+            errors[existing_email] = (
+                "The account already has a different azure_ad_subject_id"
+            )
+        email = emails_by_subject_id.get(existing_subject_id)
+        if email and email != existing_email:
+            errors[email] = "The azure_ad_subject_id is used by another account"
+    return errors
+
+
+def _bulk_upsert_statement(accounts: Dict[str, dict]):
+    """
+    Insert the accounts, or update the existing account with the same email
+    if its full_name or azure_ad_subject_id is changed, returning the id and
+    email of every account inserted or updated
+    """
+    columns = ["id", "email", "full_name", "azure_ad_subject_id"]
+    rows = (
+        func.unnest(
+            _array((account["account_id"] for account in accounts.values()), UUID),
+            _array(accounts, String),
+            _array((account["full_name"] for account in accounts.values()), String),
+            _array(
+                (account["azure_ad_subject_id"] for account in accounts.values()),
+                String,
+            ),
+        )
+        .table_valued(*columns)
+        .render_derived()
+    )
+    stmnt = insert(Account).from_select(columns, select(rows))
+    # Values that aren't given are left as they are
+    full_name = func.coalesce(stmnt.excluded.full_name, Account.full_name)
+    azure_ad_subject_id = func.coalesce(
+        stmnt.excluded.azure_ad_subject_id, Account.azure_ad_subject_id
+    )
+    return stmnt.on_conflict_do_update(
+        index_elements=[Account.email],
+        set_={
+            "full_name": full_name,
+            "azure_ad_subject_id": azure_ad_subject_id,
+            "version": Account.version + 1,
+        },
+        # Conflicting rows are locked for the rest of the transaction even
+        # when they aren't updated
+        where=or_(
+            Account.full_name.is_distinct_from(full_name),
+            Account.azure_ad_subject_id.is_distinct_from(azure_ad_subject_id),
+        ),
+    ).returning(Account.id, Account.email)
+
+
+def _bulk_upsert_unchanged_statement(emails: List[str]):
+    return select(Account.id, Account.email).filter(
+        Account.email == any_(_array(emails, String))
+    )
+
+
+def _record_upserted(
+    accounts: Dict[str, dict],
+    rows: Iterable[tuple],
+    statuses: Dict[str, str],
+    existing_status: str,
+):
+    # Accounts keep the id generated for them only if they were created
+    for account_id, email in rows:
+        account = accounts[email]
+        statuses[email] = (
+            "created" if account_id == account["account_id"] else existing_status
+        )
+        account["account_id"] = account_id
+
+
+def _bulk_upsert_roles_statement(accounts: Dict[str, dict]):
+    return select(Role.id, Role.account_id, Role.role).filter(
+        Role.account_id
+        == any_(_array((account["account_id"] for account in accounts.values()), UUID))
+    )
+
+
+def _bulk_upsert_role_statements(
+    accounts: Dict[str, dict], existing_roles: Iterable[tuple], statuses: Dict[str, str]
+) -> list:
+    """
+    Build the statements replacing each account's existing roles with the
+    requested ones, marking unchanged accounts whose roles change as updated
+    :return:
+        A list of at most one DELETE, one INSERT and one UPDATE of versions
+    """
+    emails_by_account_id = {
+        account["account_id"]: email for email, account in accounts.items()
+    }
+    kept_roles = set()
+    changed_emails = set()
+    role_ids_to_delete = []
+    for role_id, account_id, role in existing_roles:
+        email = emails_by_account_id[account_id]
+        if role in accounts[email]["roles"] and (email, role) not in kept_roles:
+            kept_roles.add((email, role))
+        else:
+            role_ids_to_delete.append(role_id)
+            changed_emails.add(email)
+    roles_to_add = []
+    for email, account in accounts.items():
+        for role in account["roles"]:
+            if (email, role) not in kept_roles:
+                roles_to_add.append((uuid.uuid4(), account["account_id"], role))
+                changed_emails.add(email)
+
+    stmnts = []
+    if role_ids_to_delete:
+        stmnts.append(
+            delete(Role).where(Role.id == any_(_array(role_ids_to_delete, UUID)))
+        )
+    if roles_to_add:
+        columns = ["id", "account_id", "role"]
+        rows = (
+            func.unnest(
+                _array((role_id for role_id, _, _ in roles_to_add), UUID),
+                _array((account_id for _, account_id, _ in roles_to_add), UUID),
+                _array((role for _, _, role in roles_to_add), String),
+            )
+            .table_valued(*columns)
+            .render_derived()
+        )
+        stmnts.append(insert(Role).from_select(columns, select(rows)))
+    # Accounts created or updated by the upsert already have a new version
+    newly_changed_emails = [
+        email for email in changed_emails if statuses[email] == "unchanged"
+    ]
+    if newly_changed_emails:
+        stmnts.append(
+            update(Account)
+            .where(
+                Account.id
+                == any_(
+                    _array(
+                        (
+                            accounts[email]["account_id"]
+                            for email in newly_changed_emails
+                        ),
+                        UUID,
+                    )
+                )
+            )
+            .values(version=Account.version + 1)
+        )
+        statuses.update((email, "updated") for email in newly_changed_emails)
+    return stmnts
+
+
+def _invalidate_upserted(accounts: Dict[str, dict], statuses: Dict[str, str]):
+    for email, status in statuses.items():
+        if status != "unchanged":
+            account_cache.invalidate(account_id=accounts[email]["account_id"])
+
+
+def _bulk_upsert_conflict_error() -> Tuple[dict, int]:
+    return {
+        "error": "The accounts were changed by another request, please try again"
+    }, 409
+
+
+def _bulk_upsert_response(
+    accounts: Dict[str, dict], errors: Dict[str, str], statuses: Dict[str, str]
+) -> Tuple[dict, int]:
+    results = []
+    for email, account in accounts.items():
+        if email in errors:
+            results.append(
+                {"email_address": email, "status": "error", "error": errors[email]}
+            )
+            continue
+        results.append(
+            {
+                "email_address": email,
+                "account_id": str(account["account_id"]),
+                "status": statuses[email],
+            }
+        )
+    return {"accounts": results}, 200
+
+
+def _get_bulk_accounts(account_ids: list) -> Tuple[dict, int, dict]:
+    if request.if_none_match:
+        # Check the versions before loading and serialising the accounts
+        versions = db.session.execute(_bulk_account_versions_statement(account_ids))
+        etag = _bulk_accounts_etag(versions)
+        if _etag_matches(request.if_none_match, etag):
+            return _not_modified(etag)
+
+    accounts = db.session.scalars(_bulk_accounts_statement(account_ids)).all()
+
+    return _bulk_accounts_response(accounts, request.if_none_match)
+
+
+def _account_conditions(
+    account_id: str = None,
+    email_address: str = None,
+    azure_ad_subject_id: str = None,
+) -> list:
+    conditions = []
+    if account_id:
+        conditions.append(Account.id == account_id)
+    if email_address:
+        conditions.append(Account.email == email_address)
+    if azure_ad_subject_id:
+        conditions.append(Account.azure_ad_subject_id == azure_ad_subject_id)
+    return conditions
+
+
+def _bulk_account_ids(account_ids: list):
+    # The ids are bound as a single uuid[] parameter rather than one
+    # parameter each, so every batch size shares one cached plan
+    return bindparam("account_ids", list(set(account_ids)), type_=ARRAY(UUID))
+
+
+def _bulk_account_versions_statement(account_ids: list):
+    return select(Account.id, Account.version).filter(
+        Account.id == any_(_bulk_account_ids(account_ids))
+    )
+
+
+def _bulk_accounts_statement(account_ids: list):
+    # Roles for the whole batch are loaded by one further query
+    return (
+        select(Account)
+        .filter(Account.id == any_(_bulk_account_ids(account_ids)))
+        .options(subqueryload(Account.roles).lazyload(Role.account))
+    )
+
+
+def _bulk_accounts_response(
+    accounts: Iterable[Account], if_none_match: ETags
+) -> Tuple[dict, int, dict]:
+    return _conditional_response(
+        {str(account.id): serialize_account(account) for account in accounts},
+        _bulk_accounts_etag((account.id, account.version) for account in accounts),
+        if_none_match,
+    )
+
+
+def _account_etag(account_id, version: int) -> str:
+    return quote_etag(f"{str(account_id).lower()}-{version}")
+
+
+def _bulk_accounts_etag(account_ids_and_versions: Iterable[tuple]) -> str:
+    versions = sorted(
+        f"{account_id}-{version}" for account_id, version in account_ids_and_versions
+    )
+    return quote_etag(hashlib.sha256(",".join(versions).encode()).hexdigest())
+
+
+def _etag_matches(if_none_match: ETags, etag: str) -> bool:
+    return if_none_match.contains_weak(unquote_etag(etag)[0])
+
+
+def _conditional_response(
+    body: dict, etag: str, if_none_match: ETags
+) -> Tuple[dict, int, dict]:
+    if _etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    return body, 200, {"ETag": etag}
+
+
+def _not_modified(etag: str) -> Tuple[str, int, dict]:
+    return "", 304, {"ETag": etag}
 
 
 def put_account(account_id: str) -> Tuple[dict, int]:
@@ -121,61 +583,118 @@ def put_account(account_id: str) -> Tuple[dict, int]:
     full_name = request.json.get("full_name")
     email = request.json.get("email_address", "").lower()
 
-    # Check account exists
+    # Check account exists, locking it so concurrent updates apply in turn
     try:
         account = (
-            db.session.query(Account)
-            .filter(
-                Account.id == account_id,
-                or_(
-                    Account.azure_ad_subject_id == azure_ad_subject_id,
-                    Account.azure_ad_subject_id.is_(None),
-                ),
+            db.session.scalars(
+                _account_for_update_statement(account_id, azure_ad_subject_id)
             )
+            .unique()
             .one()
         )
     except sqlalchemy.exc.NoResultFound:
         return {"error": "No account matching those details could be found"}, 404
 
-    # Delete existing roles
-    stmnt = delete(Role).where(Role.account_id == account_id)
-    db.session.execute(stmnt)
+    roles_to_delete, roles_to_add = _update_account(
+        account,
+        roles,
+        email=email,
+        full_name=full_name,
+        azure_ad_subject_id=azure_ad_subject_id,
+    )
 
-    if email:
-        try:
-            account.email = email
-            db.session.commit()
-        except sqlalchemy.exc.IntegrityError:
-            db.session.flush()
-            db.session.rollback()
-            return {
-                "error": "Email cannot be updated - another account may already be using this email",
-                "domain": parse_domain(email),
-            }, 401
-    if full_name:
-        account.full_name = full_name
-    if azure_ad_subject_id:
-        account.azure_ad_subject_id = azure_ad_subject_id
+    try:
+        if roles_to_delete:
+            db.session.execute(
+                delete(Role).where(Role.id.in_([role.id for role in roles_to_delete]))
+            )
+        db.session.add_all(roles_to_add)
+        db.session.flush()
+    except sqlalchemy.exc.IntegrityError:
+        db.session.rollback()
+        return _email_in_use_error(email)
 
-    # Update current roles
-    current_roles = []
-    for role in roles:
-        current_role = Role()
-        current_role.account_id = account_id
-        current_role.role = role.upper()
-        current_roles.append(current_role)
+    # Serialise before committing, which would expire the account
+    account_json = AccountSchema().dump(account)
+    etag = _account_etag(account.id, account.version)
+    db.session.commit()
+    account_cache.invalidate(account_id=account_id)
 
-    db.session.add_all(current_roles)
+    return account_json, 201, {"ETag": etag}
 
-    db.session.commit()
 
-    get_account_stmnt = select(Account).filter(Account.id == account_id)
+def _account_for_update_statement(account_id: str, azure_ad_subject_id: str):
+    return (
+        select(Account)
+        .filter(
+            Account.id == account_id,
+            or_(
+                Account.azure_ad_subject_id == azure_ad_subject_id,
+                Account.azure_ad_subject_id.is_(None),
+            ),
+        )
+        .options(joinedload(Account.roles).lazyload(Role.account))
+        .with_for_update(of=Account)
+    )
+
+
+def _update_account(
+    account: Account,
+    roles: list,
+    email: str = None,
+    full_name: str = None,
+    azure_ad_subject_id: str = None,
+) -> Tuple[List[Role], List[Role]]:
+    """
+    Apply a put_account request to an account loaded with its roles, bumping
+    its version if anything changed
+    :return:
+        Tuple of the roles to delete and the new roles to insert. The
+        account's roles are already the requested roles, in the order they
+        were given, so it can be serialised before the changes are flushed.
+    """
+    requested_roles = list(dict.fromkeys(role.upper() for role in roles))
+    kept_roles = {}
+    roles_to_delete = []
+    for role in account.roles:
+        if role.role in requested_roles and role.role not in kept_roles:
+            kept_roles[role.role] = role
+        else:
+            roles_to_delete.append(role)
+    roles_to_add = [
+        Role(account_id=account.id, role=role)
+        for role in requested_roles
+        if role not in kept_roles
+    ]
+    added_roles = {role.role: role for role in roles_to_add}
+    # Replace the loaded collection without flagging it as changed, as the
+    # rows are inserted and deleted directly
+    set_committed_value(
+        account,
+        "roles",
+        [kept_roles.get(role) or added_roles[role] for role in requested_roles],
+    )
+
+    changed = bool(roles_to_delete or roles_to_add)
+    for attribute, value in (
+        ("email", email),
+        ("full_name", full_name),
+        ("azure_ad_subject_id", azure_ad_subject_id),
+    ):
+        if value and getattr(account, attribute) != value:
+            setattr(account, attribute, value)
+            changed = True
+    if changed:
+        account.version += 1
 
-    result = db.session.execute(get_account_stmnt)
-    account = result.scalars().one()
-    account_schema = AccountSchema()
+    return roles_to_delete, roles_to_add
 
-    return account_schema.dump(account), 201
+
+def _email_in_use_error(email: str) -> Tuple[dict, int]:
+    return {
+        "error": "Email cannot be updated - another account may already be using this email",
+        "domain": parse_domain(email),
+    }, 401
 
 
 def parse_domain(email: str):
@@ -212,6 +731,9 @@ def post_account() -> Tuple[dict, int]:
         )
         db.session.add(new_account)
         db.session.commit()
+        account_cache.invalidate(
+            email_address=email_address, azure_ad_subject_id=azure_ad_subject_id
+        )
         new_account_json = {
             "account_id": new_account.id,
             "email_address": email_address,
@@ -226,68 +748,220 @@ def post_account() -> Tuple[dict, int]:
         )
 
 
+@reads_from_replica
 def get_accounts_for_fund(fund_short_name):
+    stmnt = _fund_accounts_statement(fund_short_name, request.args)
+    if stmnt is None:
+        return {
+            "error": "One of include_assessors or include_commenters must be true"
+        }, 400
+
+    if _wants_ndjson(request.accept_mimetypes):
+        # Stream one account per line from a server-side cursor, so memory use
+        # doesn't grow with the size of the roster
+        accounts = db.session.scalars(
+            stmnt.execution_options(yield_per=STREAM_ACCOUNTS_BATCH_SIZE)
+        )
+        first_account = next(accounts, None)
+        if first_account is None:
+            return {"error": "No matching accounts found"}, 404
+
+        return Response(
+            stream_with_context(
+                iterate_as_read(
+                    _account_lines(itertools.chain([first_account], accounts))
+                )
+            ),
+            mimetype=NDJSON_MIMETYPE,
+        )
+
+    results = db.session.scalars(stmnt).all()
+    if not results:
+        return {"error": "No matching accounts found"}, 404
+
+    return [serialize_account(account) for account in results], 200
+
+
+def _fund_accounts_statement(fund_short_name: str, args: Mapping[str, str]):
+    """
+    Build the statement selecting the accounts with roles for a fund, or
+    return None if the query args exclude every role type
+    """
     include_assessors = (
-        True
-        if request.args.get("include_assessors", "true").lower() == "true"
-        else False
+        True if args.get("include_assessors", "true").lower() == "true" else False
     )
     include_commenters = (
-        True
-        if request.args.get("include_commenters", "true").lower() == "true"
-        else False
+        True if args.get("include_commenters", "true").lower() == "true" else False
     )
-    round_short_name = request.args.get("round_short_name")
+    round_short_name = args.get("round_short_name")
     if not include_assessors and not include_commenters:
-        return {
-            "error": "One of include_assessors or include_commenters must be true"
-        }, 400
-    query = (
-        db.session.query(Account)
-        .join(Role)  # Explicitly join the tables
-        .filter(
-            Role.role.like(f"%{fund_short_name}%")
-        )  # Filter based on the Role attribute
-        .options(selectinload(Account.roles))
-    )
+        return None
+    # Every condition must hold for the same role, matched with EXISTS so each
+    # account is returned once without having to de-duplicate joined rows
+    role_conditions = [Role.fund == fund_short_name]
     if round_short_name:
-        query = query.filter(Role.role.like(f"%{round_short_name}%"))
+        role_conditions.append(Role.round == round_short_name)
 
     if include_commenters and not include_assessors:
-        query = query.filter(Role.role.like("%COMMENTER%"))
+        role_conditions.append(Role.role_type == COMMENTER)
     elif include_assessors and not include_commenters:
-        query = query.filter(Role.role.like("%ASSESSOR%"))
+        role_conditions.append(Role.role_type.in_([LEAD_ASSESSOR, ASSESSOR]))
     else:
-        query = query.filter(
-            or_(Role.role.like("%ASSESSOR%"), Role.role.like("%COMMENTER%"))
-        )
+        role_conditions.append(Role.role_type.in_([LEAD_ASSESSOR, ASSESSOR, COMMENTER]))
 
-    results = query.all()
-    if not results:
-        return {"error": "No matching accounts found"}, 404
+    return (
+        select(Account)
+        .filter(Account.roles.any(and_(*role_conditions)))
+        .options(selectinload(Account.roles))
+    )
 
-    account_schema = AccountSchema()
-    return account_schema.dump(results, many=True), 200
 
+def _wants_ndjson(accept_mimetypes: MIMEAccept) -> bool:
+    return (
+        accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+        == NDJSON_MIMETYPE
+    )
 
-def search_accounts(body):
-    email_domain = body.get("email_domain", None)
-    roles = body.get("roles", list())
-    partial_roles = body.get("partial_roles", list())
 
-    query = db.session.query(Account).join(Role).options(selectinload(Account.roles))
+def _account_line(account: Account) -> str:
+    return current_app.json.dumps(serialize_account(account)) + "\n"
+
+
+def _account_lines(accounts: Iterable[Account]) -> Iterator[str]:
+    for account in accounts:
+        yield _account_line(account)
+
+
+def _encode_search_cursor(email: str) -> str:
+    return urlsafe_b64encode(email.encode()).decode()
+
+
+def _decode_search_cursor(cursor: str) -> str:
+    return urlsafe_b64decode(cursor.encode()).decode()
+
+
+def _search_accounts_statement(
+    email_domain: str = None, roles: list = None, partial_roles: list = None
+):
+    stmnt = select(Account).options(selectinload(Account.roles))
 
     if email_domain:
-        query = query.filter(Account.email.ilike(f"%@{email_domain}"))
+        stmnt = stmnt.filter(Account.email_domain == email_domain.lower())
 
+    # Filter on roles with EXISTS rather than a join, so each account is
+    # matched once and a page of results is a page of accounts. Roles are
+    # matched with LIKE, so they may contain wildcards
     if roles:
-        query = query.filter(Role.role.like(any_(roles)))
+        stmnt = stmnt.filter(Account.roles.any(Role.role.like(any_(roles))))
 
     elif partial_roles:
         wildcard_partial_roles = [
             "%" + partial_role + "%" for partial_role in partial_roles
         ]
-        query = query.filter(Role.role.like(any_(wildcard_partial_roles)))
+        stmnt = stmnt.filter(
+            Account.roles.any(Role.role.like(any_(wildcard_partial_roles)))
+        )
+
+    else:
+        stmnt = stmnt.filter(Account.roles.any())
+
+    return stmnt.order_by(Account.email)
+
+
+def _search_accounts_request_statement(body: dict) -> Tuple[Select, Optional[int]]:
+    """
+    Build the statement for a search request, and the page size if it asks
+    for a page of results
+    :raises ValueError: if the cursor is invalid
+    """
+    limit = body.get("limit", None)
+    cursor = body.get("cursor", None)
+
+    stmnt = _search_accounts_statement(
+        email_domain=body.get("email_domain", None),
+        roles=body.get("roles", list()),
+        partial_roles=body.get("partial_roles", list()),
+    )
 
-    account_schema = AccountSchema()
-    return account_schema.dump(query.order_by(Account.email).all(), many=True), 200
+    if limit is None and cursor is None:
+        return stmnt, None
+
+    # Keyset pagination: seek past the last email returned using the unique
+    # email index, so every page costs the same as the first
+    limit = limit or SEARCH_ACCOUNTS_DEFAULT_LIMIT
+    if cursor:
+        stmnt = stmnt.filter(Account.email > _decode_search_cursor(cursor))
+
+    # Fetch one extra account to find out whether there is another page
+    return stmnt.limit(limit + 1), limit
+
+
+def _search_accounts_response(accounts: list, limit: Optional[int]):
+    if limit is None:
+        return [serialize_account(account) for account in accounts], 200
+
+    next_cursor = (
+        _encode_search_cursor(accounts[limit - 1].email)
+        if len(accounts) > limit
+        else None
+    )
+
+    return {
+        "accounts": [serialize_account(account) for account in accounts[:limit]],
+        "next_cursor": next_cursor,
+    }, 200
+
+
+@reads_from_replica
+def search_accounts(body):
+    try:
+        stmnt, limit = _search_accounts_request_statement(body)
+    except (binascii.Error, UnicodeDecodeError):
+        return {"error": "Bad request: invalid cursor"}, 400
+
+    return _search_accounts_response(db.session.scalars(stmnt).all(), limit)
+
+
+def _account_changes_response(
+    changes: list, accounts: Iterable[Account], since: Optional[str], limit: int
+) -> Tuple[dict, int]:
+    results = change_results(changes[:limit], accounts)
+    return {
+        "changes": [change for _, change in results],
+        # With no new changes the client polls again with the same cursor
+        "next_cursor": results[-1][0] if results else since,
+        "has_more": len(changes) > limit,
+    }, 200
+
+
+@reads_from_replica
+def get_account_changes(
+    since: str = None, limit: int = ACCOUNT_CHANGES_DEFAULT_LIMIT
+) -> Tuple[dict, int]:
+    """
+    Get the accounts changed or deleted since a cursor, oldest first, to keep
+    a copy of the accounts in sync
+    :param since: (str) the next_cursor of the previous page, or None to get
+        every account
+    :param limit: (int) the most changes to return
+    :return:
+        Tuple of the page of changes (or error) dict and status int
+    """
+    try:
+        stmnt = changes_statement(since, limit)
+    except ValueError:
+        return {"error": "Bad request: invalid cursor"}, 400
+
+    changes = db.session.execute(stmnt).all()
+    accounts = db.session.scalars(changed_accounts_statement(changes[:limit])).all()
+
+    return _account_changes_response(changes, accounts, since, limit)
+
+
+def stream_account_changes():
+    """
+    Served by core.account_async.ChangeStreamMiddleware before the request
+    reaches Flask, as a stream would otherwise hold one of the worker's
+    threads for as long as it's open
+    """
+    return {"error": "The account change stream isn't served by Flask"}, 501
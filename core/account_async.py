@@ -0,0 +1,542 @@
+"""
+Asyncio versions of the functions in core.account, used by the openapi spec
+in place of them when ASYNC_REQUEST_PATH_ENABLED is set.
+
+They build the same statements as core.account but run them on async_db, so
+a worker waiting on the db yields to other requests instead of holding a
+thread. Lazy loading isn't possible on an AsyncSession, so every statement
+that returns accounts eager loads their roles.
+
+GET /accounts/stream is served by stream_account_changes on the sync request
+path too, by ChangeStreamMiddleware, as each open stream would otherwise hold
+one of the worker's threads.
+"""
+
+import asyncio
+import binascii
+from typing import AsyncIterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import sqlalchemy
+from connexion import request
+from flask import current_app
+from sqlalchemy import delete
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.responses import Response
+from starlette.responses import StreamingResponse
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+from werkzeug.http import parse_etags
+
+from core.account import ACCOUNT_CHANGES_DEFAULT_LIMIT
+from core.account import NDJSON_MIMETYPE
+from core.account import STREAM_ACCOUNTS_BATCH_SIZE
+from core.account import _account_changes_response
+from core.account import _account_conditions
+from core.account import _account_etag
+from core.account import _account_for_update_statement
+from core.account import _account_line
+from core.account import _bulk_account_versions_statement
+from core.account import _bulk_accounts_etag
+from core.account import _bulk_accounts_response
+from core.account import _bulk_accounts_statement
+from core.account import _bulk_upsert_accounts
+from core.account import _bulk_upsert_conflict_error
+from core.account import _bulk_upsert_errors
+from core.account import _bulk_upsert_existing_statement
+from core.account import _bulk_upsert_response
+from core.account import _bulk_upsert_role_statements
+from core.account import _bulk_upsert_roles_statement
+from core.account import _bulk_upsert_statement
+from core.account import _bulk_upsert_unchanged_statement
+from core.account import _conditional_response
+from core.account import _email_in_use_error
+from core.account import _etag_matches
+from core.account import _fund_accounts_statement
+from core.account import _invalidate_upserted
+from core.account import _not_modified
+from core.account import _record_upserted
+from core.account import _search_accounts_request_statement
+from core.account import _search_accounts_response
+from core.account import _update_account
+from core.account import _wants_ndjson
+from core.cache import account_cache
+from core.changes import Change
+from core.changes import async_change_pages
+from core.changes import change_pages
+from core.changes import changed_accounts_statement
+from core.changes import changes_statement
+from core.stream import EVENT_STREAM_HEADERS
+from core.stream import EVENT_STREAM_MIMETYPE
+from core.stream import HEARTBEAT
+from core.stream import STREAM_PAGE_SIZE
+from core.stream import Subscription
+from core.stream import account_change_stream
+from core.stream import format_event
+from db import async_db
+from db import db
+from db.models.account import Account
+from db.models.role import Role
+from db.replica import reads_from_replica
+from db.schemas.account import AccountSchema
+from db.schemas.account import serialize_account
+
+STREAM_OPERATION_ID = "core.account.stream_account_changes"
+
+
+async def get_account(
+    account_id: str = None,
+    email_address: str = None,
+    azure_ad_subject_id: str = None,
+) -> Tuple[dict, int]:
+    """
+    As core.account.get_account
+    """
+    if not any([account_id, email_address, azure_ad_subject_id]):
+        return {
+            "error": (
+                "Bad request: please provide at least 1 query argument of "
+                "account_id, email_address or azure_ad_subject_id"
+            )
+        }, 400
+
+    email_address = email_address.lower() if email_address else email_address
+    if_none_match = parse_etags(request.headers.get("If-None-Match"))
+
+    cached = account_cache.get_versioned(
+        account_id=account_id,
+        email_address=email_address,
+        azure_ad_subject_id=azure_ad_subject_id,
+    )
+    if cached and cached[1] is not None:
+        cached_account, version = cached
+        return _conditional_response(
+            cached_account,
+            _account_etag(cached_account["account_id"], version),
+            if_none_match,
+        )
+    cache_generation = account_cache.generation
+
+    conditions = _account_conditions(account_id, email_address, azure_ad_subject_id)
+
+    async with async_db.session() as session:
+        try:
+            if if_none_match:
+                # Check the version before loading and serialising the account
+                account_id_and_version = (
+                    await session.execute(
+                        select(Account.id, Account.version).filter(*conditions)
+                    )
+                ).one()
+                etag = _account_etag(*account_id_and_version)
+                if _etag_matches(if_none_match, etag):
+                    return _not_modified(etag)
+
+            account = (
+                await session.scalars(
+                    select(Account)
+                    .filter(*conditions)
+                    .options(selectinload(Account.roles))
+                )
+            ).one()
+        except sqlalchemy.exc.NoResultFound:
+            return {"error": "No matching account found"}, 404
+
+    account_json = AccountSchema().dump(account)
+    account_cache.set(account_json, cache_generation, account.version)
+    return _conditional_response(
+        account_json, _account_etag(account.id, account.version), if_none_match
+    )
+
+
+@reads_from_replica
+async def get_bulk_accounts(account_id: list):
+    """
+    As core.account.get_bulk_accounts
+    """
+    if not account_id:
+        return {"error": "Bad request: please provide at least 1 account_id "}, 400
+
+    return await _get_bulk_accounts(account_id)
+
+
+@reads_from_replica
+async def post_bulk_accounts(body: dict):
+    """
+    As core.account.post_bulk_accounts
+    """
+    account_ids = body.get("account_ids")
+    if not account_ids:
+        return {"error": "Bad request: please provide at least 1 account_id "}, 400
+
+    return await _get_bulk_accounts(account_ids)
+
+
+async def _get_bulk_accounts(account_ids: list):
+    if_none_match = parse_etags(request.headers.get("If-None-Match"))
+
+    async with async_db.session() as session:
+        if if_none_match:
+            # Check the versions before loading and serialising the accounts
+            versions = await session.execute(
+                _bulk_account_versions_statement(account_ids)
+            )
+            etag = _bulk_accounts_etag(versions)
+            if _etag_matches(if_none_match, etag):
+                return _not_modified(etag)
+
+        accounts = (await session.scalars(_bulk_accounts_statement(account_ids))).all()
+
+    return _bulk_accounts_response(accounts, if_none_match)
+
+
+async def put_bulk_accounts(body: dict):
+    """
+    As core.account.put_bulk_accounts
+    """
+    try:
+        accounts = _bulk_upsert_accounts(body["accounts"])
+    except ValueError as e:
+        return {"error": f"Bad request: {e}"}, 400
+
+    async with async_db.session() as session:
+        errors = _bulk_upsert_errors(
+            accounts, await session.execute(_bulk_upsert_existing_statement(accounts))
+        )
+        upserts = {
+            email: account for email, account in accounts.items() if email not in errors
+        }
+        statuses = {}
+        if upserts:
+            try:
+                _record_upserted(
+                    upserts,
+                    await session.execute(_bulk_upsert_statement(upserts)),
+                    statuses,
+                    "updated",
+                )
+                unchanged_emails = [email for email in upserts if email not in statuses]
+                if unchanged_emails:
+                    _record_upserted(
+                        upserts,
+                        await session.execute(
+                            _bulk_upsert_unchanged_statement(unchanged_emails)
+                        ),
+                        statuses,
+                        "unchanged",
+                    )
+
+                existing_roles = await session.execute(
+                    _bulk_upsert_roles_statement(upserts)
+                )
+                for stmnt in _bulk_upsert_role_statements(
+                    upserts, existing_roles, statuses
+                ):
+                    await session.execute(stmnt)
+                await session.commit()
+            except sqlalchemy.exc.IntegrityError:
+                await session.rollback()
+                return _bulk_upsert_conflict_error()
+            _invalidate_upserted(upserts, statuses)
+
+    return _bulk_upsert_response(accounts, errors, statuses)
+
+
+async def put_account(account_id: str, body: dict) -> Tuple[dict, int]:
+    """
+    As core.account.put_account
+    """
+    try:
+        roles = body["roles"]
+    except KeyError:
+        return {"error": "roles are required"}, 401
+    try:
+        azure_ad_subject_id = body["azure_ad_subject_id"]
+    except KeyError:
+        return {"error": "azure_ad_subject_id is required"}, 401
+
+    full_name = body.get("full_name")
+    email = body.get("email_address", "").lower()
+
+    async with async_db.session() as session:
+        try:
+            account = (
+                (
+                    await session.scalars(
+                        _account_for_update_statement(account_id, azure_ad_subject_id)
+                    )
+                )
+                .unique()
+                .one()
+            )
+        except sqlalchemy.exc.NoResultFound:
+            return {"error": "No account matching those details could be found"}, 404
+
+        roles_to_delete, roles_to_add = _update_account(
+            account,
+            roles,
+            email=email,
+            full_name=full_name,
+            azure_ad_subject_id=azure_ad_subject_id,
+        )
+
+        try:
+            if roles_to_delete:
+                await session.execute(
+                    delete(Role).where(
+                        Role.id.in_([role.id for role in roles_to_delete])
+                    )
+                )
+            session.add_all(roles_to_add)
+            await session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            await session.rollback()
+            return _email_in_use_error(email)
+    account_cache.invalidate(account_id=account_id)
+
+    return (
+        AccountSchema().dump(account),
+        201,
+        {"ETag": _account_etag(account.id, account.version)},
+    )
+
+
+async def post_account(body: dict) -> Tuple[dict, int]:
+    """
+    As core.account.post_account
+    """
+    email_address = body.get("email_address", "").lower()
+    azure_ad_subject_id = body.get("azure_ad_subject_id")
+    if not email_address:
+        return {"error": "email_address is required"}, 400
+
+    async with async_db.session() as session:
+        new_account = Account(
+            email=email_address, azure_ad_subject_id=azure_ad_subject_id
+        )
+        session.add(new_account)
+        try:
+            await session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            await session.rollback()
+            return (
+                "An account with that email or azure_ad_subject_id already exists",
+                409,
+            )
+
+    account_cache.invalidate(
+        email_address=email_address, azure_ad_subject_id=azure_ad_subject_id
+    )
+    return {
+        "account_id": new_account.id,
+        "email_address": email_address,
+        "azure_ad_subject_id": azure_ad_subject_id,
+    }, 201
+
+
+@reads_from_replica
+async def get_accounts_for_fund(fund_short_name):
+    """
+    As core.account.get_accounts_for_fund
+    """
+    stmnt = _fund_accounts_statement(fund_short_name, request.query_params)
+    if stmnt is None:
+        return {
+            "error": "One of include_assessors or include_commenters must be true"
+        }, 400
+
+    if _wants_ndjson(parse_accept_header(request.headers.get("Accept"), MIMEAccept)):
+        # The session stays open until the last account has been streamed
+        session = async_db.session()
+        accounts = await session.stream_scalars(
+            stmnt.execution_options(yield_per=STREAM_ACCOUNTS_BATCH_SIZE)
+        )
+        try:
+            first_account = await accounts.__anext__()
+        except StopAsyncIteration:
+            await session.close()
+            return {"error": "No matching accounts found"}, 404
+
+        return StreamingResponse(
+            _account_lines(
+                current_app._get_current_object(), session, first_account, accounts
+            ),
+            media_type=NDJSON_MIMETYPE,
+        )
+
+    async with async_db.session() as session:
+        results = (await session.scalars(stmnt)).all()
+    if not results:
+        return {"error": "No matching accounts found"}, 404
+
+    return [serialize_account(account) for account in results], 200
+
+
+async def _account_lines(
+    app, session: AsyncSession, first_account: Account, accounts
+) -> AsyncIterator[str]:
+    # Runs after the handler has returned, outside its app context
+    try:
+        with app.app_context():
+            yield _account_line(first_account)
+            async for account in accounts:
+                yield _account_line(account)
+    finally:
+        await session.close()
+
+
+@reads_from_replica
+async def search_accounts(body):
+    """
+    As core.account.search_accounts
+    """
+    try:
+        stmnt, limit = _search_accounts_request_statement(body)
+    except (binascii.Error, UnicodeDecodeError):
+        return {"error": "Bad request: invalid cursor"}, 400
+
+    async with async_db.session() as session:
+        accounts = (await session.scalars(stmnt)).all()
+
+    return _search_accounts_response(accounts, limit)
+
+
+@reads_from_replica
+async def get_account_changes(
+    since: str = None, limit: int = ACCOUNT_CHANGES_DEFAULT_LIMIT
+) -> Tuple[dict, int]:
+    """
+    As core.account.get_account_changes
+    """
+    try:
+        stmnt = changes_statement(since, limit)
+    except ValueError:
+        return {"error": "Bad request: invalid cursor"}, 400
+
+    async with async_db.session() as session:
+        changes = (await session.execute(stmnt)).all()
+        accounts = (
+            await session.scalars(changed_accounts_statement(changes[:limit]))
+        ).all()
+
+    return _account_changes_response(changes, accounts, since, limit)
+
+
+async def stream_account_changes():
+    """
+    Stream the accounts changed from now on as server-sent events, after the
+    changes since the event id in the Last-Event-ID header if given, which
+    EventSource clients send when they reconnect
+    """
+    return await _change_stream_response(
+        current_app._get_current_object(), request.headers.get("Last-Event-ID")
+    )
+
+
+class ChangeStreamMiddleware:
+    """
+    ASGI middleware serving GET /accounts/stream on the sync request path
+    with stream_account_changes, rather than passing it on to the Flask app,
+    where each open stream would hold one of the worker's threads.
+
+    It sits after connexion's routing, so the request has been matched to
+    the operation, and its parameters validated, by the time it's served.
+    """
+
+    def __init__(self, app, flask_app):
+        self.app = app
+        self.flask_app = flask_app
+
+    async def __call__(self, scope, receive, send):
+        routing = scope.get("extensions", {}).get("connexion_routing", {})
+        if (
+            scope["type"] != "http"
+            or routing.get("operation_id") != STREAM_OPERATION_ID
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        with self.flask_app.app_context():
+            response = await _change_stream_response(
+                self.flask_app, Headers(scope=scope).get("Last-Event-ID")
+            )
+        await response(scope, receive, send)
+
+
+async def _change_stream_response(app, last_event_id: Optional[str]) -> Response:
+    loop = asyncio.get_running_loop()
+    woken = asyncio.Event()
+    try:
+        # Blocks until this worker's stream has started
+        subscription = await asyncio.to_thread(
+            account_change_stream.subscribe,
+            lambda: loop.call_soon_threadsafe(woken.set),
+            last_event_id,
+        )
+    except ValueError:
+        return JSONResponse({"error": "Bad request: invalid Last-Event-ID"}, 400)
+    except TimeoutError:
+        return JSONResponse({"error": "The account change stream is unavailable"}, 503)
+
+    return StreamingResponse(
+        _change_events(app, subscription, woken),
+        media_type=EVENT_STREAM_MIMETYPE,
+        headers=EVENT_STREAM_HEADERS,
+    )
+
+
+async def _change_events(
+    app, subscription: Subscription, woken: asyncio.Event
+) -> AsyncIterator[str]:
+    # Runs after the response has been returned, outside its app context
+    try:
+        with app.app_context():
+            # Starts the response straight away, rather than with the first change
+            yield HEARTBEAT
+            if subscription.missed:
+                since, until = subscription.missed
+                async for results in _missed_change_pages(app, since, until):
+                    for cursor, change in results:
+                        yield format_event(cursor, change)
+
+            # The client reconnects once the subscription is dropped or
+            # expires, and catches up from the last event it received
+            while subscription.open:
+                try:
+                    await asyncio.wait_for(woken.wait(), subscription.wait_seconds())
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+                    continue
+                woken.clear()
+                for cursor, change in subscription.take():
+                    yield format_event(cursor, change)
+    finally:
+        subscription.close()
+
+
+async def _missed_change_pages(
+    app, since: str, until: str
+) -> AsyncIterator[List[Change]]:
+    if "async_db" in app.extensions:
+        async with async_db.session() as session:
+            async for results in async_change_pages(
+                session, since, STREAM_PAGE_SIZE, until
+            ):
+                yield results
+        return
+
+    # The sync request path has no async_db, so the pages are read with
+    # db.session in a thread, which runs in a copy of this app context
+    pages = change_pages(db.session, since, STREAM_PAGE_SIZE, until)
+    try:
+        while (results := await asyncio.to_thread(next, pages, None)) is not None:
+            yield results
+    finally:
+        # Rather than staying in a transaction while the stream is open
+        await asyncio.to_thread(db.session.close)
@@ -0,0 +1,234 @@
+"""
+A bounded, per-process cache of serialised accounts.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+from prometheus_client import Counter
+from prometheus_client import Gauge
+
+CACHE_LOOKUPS = Counter(
+    "account_cache_lookups_total", "Account cache lookups", ["result"]
+)
+CACHE_REMOVALS = Counter(
+    "account_cache_removals_total",
+    "Entries dropped from the account cache to make room or because they expired",
+    ["reason"],
+)
+CACHE_ENTRIES = Gauge(
+    "account_cache_entries",
+    "Accounts currently in the account cache",
+    multiprocess_mode="livesum",
+)
+
+
+class AccountCache:
+    """
+    LRU cache of serialised accounts where every entry also expires after a
+    fixed time to live.
+
+    Each account is stored once, keyed by its account id, and can be looked
+    up by account id, lowercased email address or Azure AD subject id.
+    Entries are the dicts returned by the account endpoints, so callers must
+    treat them as read only.
+
+    The cache is disabled when either ACCOUNT_CACHE_MAXSIZE or
+    ACCOUNT_CACHE_TTL_SECONDS is 0.
+    """
+
+    def __init__(self, app=None):
+        self.maxsize = 0
+        self.ttl = 0
+        self._entries: "OrderedDict[str, Tuple[float, dict, Optional[int]]]" = (
+            OrderedDict()
+        )
+        self._ids_by_email: Dict[str, str] = {}
+        self._ids_by_subject_id: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        # Bumped on every invalidation, so an account read from the db before
+        # a concurrent invalidation is never stored after it
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config.get("ACCOUNT_CACHE_MAXSIZE", 0)
+        self.ttl = app.config.get("ACCOUNT_CACHE_TTL_SECONDS", 0)
+        self.clear()
+        app.extensions["account_cache"] = self
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(
+        self,
+        account_id: str = None,
+        email_address: str = None,
+        azure_ad_subject_id: str = None,
+    ) -> Optional[dict]:
+        """
+        Return the cached account matching every given lookup key, or None
+        :param account_id: (str) the id to search
+        :param email_address: (str) the lowercased email to search
+        :param azure_ad_subject_id: (str) the azure_ad_subject_id to search
+        :return:
+            The serialised account dict, or None on a miss
+        """
+        entry = self.get_versioned(account_id, email_address, azure_ad_subject_id)
+        return entry[0] if entry else None
+
+    def get_versioned(
+        self,
+        account_id: str = None,
+        email_address: str = None,
+        azure_ad_subject_id: str = None,
+    ) -> Optional[Tuple[dict, Optional[int]]]:
+        """
+        As get, but also returns the account version the entry was stored with
+        :return:
+            Tuple of the serialised account dict and its version, or None on
+            a miss
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            key = self._resolve_key(account_id, email_address, azure_ad_subject_id)
+            entry = self._entries.get(key) if key else None
+            if entry is None:
+                self._miss()
+                return None
+            expires_at, account, version = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                CACHE_REMOVALS.labels("expired").inc()
+                self._miss()
+                return None
+            if (
+                (account_id and str(account_id).lower() != account["account_id"])
+                or (email_address and email_address != account["email_address"])
+                or (
+                    azure_ad_subject_id
+                    and azure_ad_subject_id != account["azure_ad_subject_id"]
+                )
+            ):
+                self._miss()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.labels("hit").inc()
+            return account, version
+
+    def set(self, account: dict, generation: int = None, version: int = None):
+        """
+        Add or replace a serialised account, evicting the least recently used
+        entry if the cache is full
+        :param account: (dict) the serialised account
+        :param generation: (int) the cache generation read before the account
+            was loaded, if anything has been invalidated since then the
+            account may be stale and is not stored
+        :param version: (int) the account's version column
+        """
+        if not self.enabled:
+            return
+        key = account["account_id"]
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, account, version)
+            if account["email_address"]:
+                self._ids_by_email[account["email_address"]] = key
+            if account["azure_ad_subject_id"]:
+                self._ids_by_subject_id[account["azure_ad_subject_id"]] = key
+            CACHE_ENTRIES.set(len(self._entries))
+            while len(self._entries) > self.maxsize:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+                CACHE_REMOVALS.labels("evicted").inc()
+
+    def invalidate(
+        self,
+        account_id: str = None,
+        email_address: str = None,
+        azure_ad_subject_id: str = None,
+    ):
+        """
+        Remove any entries matching any of the given lookup keys
+        :param account_id: (str) the id to remove
+        :param email_address: (str) the lowercased email to remove
+        :param azure_ad_subject_id: (str) the azure_ad_subject_id to remove
+        """
+        with self._lock:
+            self.generation += 1
+            for key in {
+                str(account_id).lower() if account_id else None,
+                self._ids_by_email.get(email_address),
+                self._ids_by_subject_id.get(azure_ad_subject_id),
+            }:
+                if key:
+                    self._remove(key)
+
+    def evict(self, account_id: Optional[str]):
+        """
+        Remove an account changed elsewhere, or everything if account_id is None
+        :param account_id: (str) the id of the changed account
+        """
+        if account_id is None:
+            self.clear()
+        else:
+            self.invalidate(account_id=account_id)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._ids_by_email.clear()
+            self._ids_by_subject_id.clear()
+            CACHE_ENTRIES.set(0)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _miss(self):
+        self.misses += 1
+        CACHE_LOOKUPS.labels("miss").inc()
+
+    def _resolve_key(self, account_id, email_address, azure_ad_subject_id):
+        if account_id:
+            return str(account_id).lower()
+        if email_address:
+            return self._ids_by_email.get(email_address)
+        return self._ids_by_subject_id.get(azure_ad_subject_id)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        _, account, _ = entry
+        if self._ids_by_email.get(account["email_address"]) == key:
+            del self._ids_by_email[account["email_address"]]
+        if self._ids_by_subject_id.get(account["azure_ad_subject_id"]) == key:
+            del self._ids_by_subject_id[account["azure_ad_subject_id"]]
+        CACHE_ENTRIES.set(len(self._entries))
+
+
+account_cache = AccountCache()
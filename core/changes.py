@@ -0,0 +1,181 @@
+"""
+Reads the account change log, account_change, which the db's triggers on
+account and role write to whenever a statement changes an account or its
+roles.
+
+Changes are identified by a cursor made from the id of the transaction that
+made the change and the id of its row, and are read in that order by the
+changes endpoint and the change stream. Transactions don't commit in the
+order their ids are assigned, so only the changes of transactions older
+than every one still running are read, as a change committed later can't
+come before them.
+"""
+
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
+from typing import AsyncIterator
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from sqlalchemy import ARRAY
+from sqlalchemy import BigInteger
+from sqlalchemy import Select
+from sqlalchemy import String
+from sqlalchemy import any_
+from sqlalchemy import bindparam
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import subqueryload
+
+from db.models.account import Account
+from db.models.account_change import AccountChange
+from db.models.role import Role
+from db.schemas.account import serialize_account
+
+
+# The cursor of a change and its json, as returned by /accounts/changes
+Change = Tuple[str, dict]
+
+
+def encode_cursor(xid: int, change_id: int) -> str:
+    return urlsafe_b64encode(f"{xid}.{change_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """
+    :raises ValueError: if the cursor is invalid
+    """
+    xid, change_id = urlsafe_b64decode(cursor.encode()).decode().split(".")
+    return int(xid), int(change_id)
+
+
+def _finished_changes_statement() -> Select:
+    return select(AccountChange.xid, AccountChange.id, AccountChange.account_id).filter(
+        AccountChange.xid
+        < func.pg_snapshot_xmin(func.pg_current_snapshot())
+        .cast(String)
+        .cast(BigInteger)
+    )
+
+
+def changes_statement(
+    since: Optional[str], limit: int, until: Optional[str] = None
+) -> Select:
+    """
+    Build the statement selecting the page of changes after the since cursor,
+    and up to the until cursor if given
+    :raises ValueError: if a cursor is invalid
+    """
+    stmnt = _finished_changes_statement().order_by(AccountChange.xid, AccountChange.id)
+    if since:
+        stmnt = stmnt.filter(
+            tuple_(AccountChange.xid, AccountChange.id) > tuple_(*decode_cursor(since))
+        )
+    if until:
+        stmnt = stmnt.filter(
+            tuple_(AccountChange.xid, AccountChange.id) <= tuple_(*decode_cursor(until))
+        )
+
+    # Fetch one extra change to find out whether there are more
+    return stmnt.limit(limit + 1)
+
+
+def latest_change_statement() -> Select:
+    return (
+        _finished_changes_statement()
+        .order_by(AccountChange.xid.desc(), AccountChange.id.desc())
+        .limit(1)
+    )
+
+
+def changed_accounts_statement(changes: Iterable) -> Select:
+    # Roles for the whole page are loaded by one further query
+    account_ids = list({change.account_id for change in changes})
+    return (
+        select(Account)
+        .filter(
+            Account.id == any_(bindparam("account_ids", account_ids, type_=ARRAY(UUID)))
+        )
+        .options(subqueryload(Account.roles).lazyload(Role.account))
+    )
+
+
+def change_results(changes: list, accounts: Iterable[Account]) -> List[Change]:
+    """
+    The cursor and json of each account changed, in the order of its last
+    change, as an account changed more than once is returned once
+    """
+    accounts_by_id = {account.id: account for account in accounts}
+    last_changes = {change.account_id: change.id for change in changes}
+
+    results = []
+    for change in changes:
+        if last_changes[change.account_id] != change.id:
+            continue
+        account = accounts_by_id.get(change.account_id)
+        results.append(
+            (
+                encode_cursor(change.xid, change.id),
+                {
+                    "account_id": str(change.account_id),
+                    "deleted": account is None,
+                    "account": serialize_account(account) if account else None,
+                },
+            )
+        )
+    return results
+
+
+def change_pages(
+    session: Session, since: Optional[str], page_size: int, until: Optional[str] = None
+) -> Iterator[List[Change]]:
+    """
+    Yield the pages of changes after the since cursor, and up to the until
+    cursor if given, each ending the session's transaction once read
+    :raises ValueError: if a cursor is invalid
+    """
+    while True:
+        changes = session.execute(changes_statement(since, page_size, until)).all()
+        if not changes:
+            return
+        accounts = session.scalars(changed_accounts_statement(changes[:page_size]))
+        results = change_results(changes[:page_size], accounts.all())
+        # Expire the accounts read, so later pages read them afresh
+        session.rollback()
+        yield results
+        if len(changes) <= page_size:
+            return
+        since = results[-1][0]
+
+
+async def async_change_pages(
+    session: AsyncSession,
+    since: Optional[str],
+    page_size: int,
+    until: Optional[str] = None,
+) -> AsyncIterator[List[Change]]:
+    """
+    As change_pages, with an async session
+    """
+    while True:
+        changes = (
+            await session.execute(changes_statement(since, page_size, until))
+        ).all()
+        if not changes:
+            return
+        accounts = await session.scalars(
+            changed_accounts_statement(changes[:page_size])
+        )
+        results = change_results(changes[:page_size], accounts.all())
+        await session.rollback()
+        yield results
+        if len(changes) <= page_size:
+            return
+        since = results[-1][0]
@@ -0,0 +1,285 @@
+"""
+Exposes the process's Prometheus metrics, and records metrics for every
+request served.
+
+Under gunicorn, each worker has its own metrics. Setting
+PROMETHEUS_MULTIPROC_DIR, as run/gunicorn does, makes every worker write its
+metrics to files in that directory so /metrics reports the totals across all
+workers, whichever worker serves it.
+"""
+
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from flask import Response
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import REGISTRY
+from prometheus_client import CollectorRegistry
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client import generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Requests that aren't for an api operation, eg. /healthcheck
+OTHER_OPERATION = "other"
+
+REQUEST_DURATION_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time taken to serve a request, until the last of the response is sent",
+    ["operation", "method", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds",
+    "Time spent executing db statements while serving a request",
+    ["operation"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+RESPONSE_SIZE_BYTES = Histogram(
+    "http_response_size_bytes",
+    "Size of response bodies",
+    ["operation"],
+    buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000),
+)
+REQUEST_DB_STATEMENTS = Histogram(
+    "http_request_db_statements",
+    "Number of db statements executed while serving a request",
+    ["operation"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests currently being served",
+    multiprocess_mode="livesum",
+)
+# Labelled with each worker's pid in multiprocess mode
+PROCESS_MEMORY_BYTES = Gauge(
+    "process_memory_bytes",
+    "Memory of the process: resident (rss), its share of pages shared with "
+    "other processes (pss), and pages only it uses (uss)",
+    ["kind"],
+    multiprocess_mode="liveall",
+)
+# Reading the memory of a process takes a while, so it's only read again
+# by requests served this long after it was last read
+MEMORY_SAMPLE_INTERVAL_SECONDS = 15
+
+
+def process_memory(pid="self") -> Optional[Dict[str, int]]:
+    """
+    The rss, pss and uss of a process in bytes, or None without a Linux /proc
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            # The first line is the range of addresses covered
+            fields = {
+                name: int(value.split()[0]) * 1024
+                for name, value in (line.split(":", 1) for line in file.readlines()[1:])
+            }
+    except OSError:
+        return None
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+class RequestDbStats:
+    """
+    The db statements run while serving a request, and how long they took
+    """
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.statements} statements"'
+
+
+# Set for the duration of each request, and copied into the thread a sync
+# request is served on, so db statements can be attributed to the request
+_request_db_stats: ContextVar[Optional[RequestDbStats]] = ContextVar(
+    "request_db_stats", default=None
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware recording the duration, db statements and response size
+    of each request, labelled with the connexion operationId it was routed
+    to, with the Metrics extension of the given Flask app.
+
+    It sits outside connexion's routing, so the operation is read from the
+    scope once the request has been served. Connexion's middleware pass on
+    shallow copies of the scope, so the extensions dict the routing
+    middleware adds the operation to is created here to be shared with them.
+    """
+
+    def __init__(self, app, flask_app):
+        self.app = app
+        self.flask_app = flask_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self.flask_app.extensions["metrics"]
+        scope.setdefault("extensions", {})
+        db_stats = RequestDbStats()
+        token = _request_db_stats.set(db_stats)
+        status = "500"
+        response_size = 0
+
+        async def send_and_measure(message):
+            nonlocal status, response_size
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                if metrics.db_stats_header_enabled:
+                    # Statements run while a response streams aren't included
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", db_stats.server_timing().encode()),
+                    ]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            _request_db_stats.reset(token)
+            metrics.record_request(
+                _operation_id(scope),
+                scope["method"],
+                status,
+                time.perf_counter() - started,
+                db_stats,
+                response_size,
+            )
+
+
+def _operation_id(scope) -> str:
+    routing = scope.get("extensions", {}).get("connexion_routing", {})
+    return routing.get("operation_id") or OTHER_OPERATION
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["statement_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("statement_started", None)
+    db_stats = _request_db_stats.get()
+    if db_stats is not None and started is not None:
+        db_stats.statements += 1
+        db_stats.seconds += time.perf_counter() - started
+
+
+class Metrics:
+    """
+    Serves every metric in the default Prometheus registry, such as the db
+    pool metrics in db.pool, at /metrics, and records the requests measured
+    by RequestMetricsMiddleware.
+
+    Each request's db statements are logged, as a warning when there are
+    more than DB_REQUEST_STATEMENTS_WARNING_THRESHOLD of them, and passed to
+    every subscriber along with the request's operation.
+    """
+
+    def __init__(self, app=None):
+        self.db_stats_header_enabled = False
+        self.statements_warning_threshold = None
+        self.logger = logging.getLogger(__name__)
+        self._subscribers: List[Callable[[str, RequestDbStats], None]] = []
+        self._memory_sampled_at = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.db_stats_header_enabled = app.config.get(
+            "DB_REQUEST_STATS_HEADER_ENABLED", False
+        )
+        self.statements_warning_threshold = app.config.get(
+            "DB_REQUEST_STATEMENTS_WARNING_THRESHOLD"
+        )
+        self.logger = app.logger
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        app.extensions["metrics"] = self
+
+    def subscribe(self, callback: Callable[[str, RequestDbStats], None]):
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[str, RequestDbStats], None]):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def record_request(
+        self,
+        operation: str,
+        method: str,
+        status: str,
+        seconds: float,
+        db_stats: RequestDbStats,
+        response_size: int,
+    ):
+        REQUEST_DURATION_SECONDS.labels(operation, method, status).observe(seconds)
+        REQUEST_DB_SECONDS.labels(operation).observe(db_stats.seconds)
+        REQUEST_DB_STATEMENTS.labels(operation).observe(db_stats.statements)
+        RESPONSE_SIZE_BYTES.labels(operation).observe(response_size)
+
+        message = (
+            f"{operation} ran {db_stats.statements} db statements in "
+            f"{db_stats.seconds * 1000:.1f}ms"
+        )
+        if (
+            self.statements_warning_threshold is not None
+            and db_stats.statements > self.statements_warning_threshold
+        ):
+            self.logger.warning(message)
+        else:
+            self.logger.debug(message)
+
+        for callback in list(self._subscribers):
+            callback(operation, db_stats)
+
+        if (
+            self._memory_sampled_at is None
+            or time.monotonic() - self._memory_sampled_at
+            >= MEMORY_SAMPLE_INTERVAL_SECONDS
+        ):
+            self.sample_memory()
+
+    def sample_memory(self):
+        self._memory_sampled_at = time.monotonic()
+        memory = process_memory()
+        for kind, value in (memory or {}).items():
+            PROCESS_MEMORY_BYTES.labels(kind).set(value)
+
+    def metrics_view(self):
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+metrics = Metrics()
@@ -0,0 +1,120 @@
+"""
+Listens for account change notifications published by the db.
+
+Triggers on the account and role tables call pg_notify on the
+account_changes channel whenever a statement changes an account or its
+roles, so every write is covered, including ones made outside this app.
+"""
+
+import json
+import logging
+import select
+import threading
+from typing import Callable
+from typing import List
+from typing import Optional
+
+import psycopg2
+from sqlalchemy.engine import make_url
+
+ACCOUNT_CHANGES_CHANNEL = "account_changes"
+
+
+class AccountChangeListener:
+    """
+    Runs a background thread holding a dedicated db connection that LISTENs
+    on the account_changes channel and passes each changed account id to
+    every subscriber.
+
+    Subscribers are called with None, meaning "anything may have changed",
+    when a single statement changed too many accounts to name them all and
+    after the connection is re-established, as notifications sent while
+    disconnected are lost.
+    """
+
+    def __init__(self, app=None):
+        self.dsn = None
+        self.enabled = False
+        self.logger = logging.getLogger(__name__)
+        self._subscribers: List[Callable[[Optional[str]], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.dsn = (
+            make_url(
+                app.config.get("ACCOUNT_CHANGE_LISTENER_DATABASE_URL")
+                or app.config["SQLALCHEMY_DATABASE_URI"]
+            )
+            .set(drivername="postgresql")
+            .render_as_string(hide_password=False)
+        )
+        self.enabled = app.config.get("ACCOUNT_CHANGE_LISTENER_ENABLED", False)
+        self.logger = app.logger
+        app.extensions["account_change_listener"] = self
+
+    def subscribe(self, callback: Callable[[Optional[str]], None]):
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Optional[str]], None]):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="account-change-listener", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        retry_delay = 1
+        while not self._stopping.is_set():
+            try:
+                self._listen()
+                retry_delay = 1
+            except psycopg2.Error:
+                self.logger.exception("Account change listener lost its connection")
+                self._stopping.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+
+    def _listen(self):
+        connection = psycopg2.connect(self.dsn)
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {ACCOUNT_CHANGES_CHANNEL}")
+            # Anything could have changed while we weren't listening
+            self._publish(None)
+            while not self._stopping.is_set():
+                if select.select([connection], [], [], 1) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    self._publish(json.loads(notify.payload)["account_id"])
+        finally:
+            connection.close()
+
+    def _publish(self, account_id: Optional[str]):
+        for callback in list(self._subscribers):
+            try:
+                callback(account_id)
+            except Exception:
+                self.logger.exception(
+                    f"Account change subscriber {callback} failed for {account_id}"
+                )
+
+
+account_change_listener = AccountChangeListener()
@@ -0,0 +1,133 @@
+"""
+Loads the openapi spec for connexion, caching it once it has been validated.
+
+Connexion parses api.yml and validates it against the OpenAPI schema every
+time an app is created, which is most of the time create_app takes. Once a
+spec has been validated it is cached as JSON, named after a hash of the spec
+and the connexion version, so a cached spec is only ever used for the exact
+spec and validator it was checked against. Apps created with a cached spec
+skip the validation.
+
+Images build the cache in advance with
+
+    python -m core.spec
+"""
+
+import contextlib
+import copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from importlib.metadata import version
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import yaml
+from connexion.spec import OpenAPISpecification
+from connexion.spec import Specification
+
+SPEC_PATH = os.path.join(os.path.dirname(__file__), "..", "openapi", "api.yml")
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(SPEC_PATH), ".cache")
+# Bump when the cached spec changes shape, to ignore older caches
+CACHE_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+# Specs already loaded by this process, by cache file name
+_loaded_specs: Dict[str, dict] = {}
+
+
+def spec_hash(spec_path: str = SPEC_PATH) -> str:
+    digest = hashlib.sha256(f"{CACHE_FORMAT}:{version('connexion')}:".encode())
+    with open(spec_path, "rb") as file:
+        digest.update(file.read())
+    return digest.hexdigest()
+
+
+def cache_file_name(spec_path: str = SPEC_PATH) -> str:
+    name = os.path.splitext(os.path.basename(spec_path))[0]
+    return f"{name}.{spec_hash(spec_path)[:16]}.json"
+
+
+def _parse_and_validate(spec_path: str) -> dict:
+    with open(spec_path, "rb") as file:
+        # libyaml's loader, where it is installed, parses it many times faster
+        spec = yaml.load(file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    # Round trip through JSON for the string keys connexion expects, eg. for
+    # response codes, exactly as they'll be read back from the cache
+    spec = json.loads(json.dumps(spec))
+    # Raises connexion.exceptions.InvalidSpecification
+    Specification.from_dict(copy.deepcopy(spec))
+    return spec
+
+
+def _write_cache(cache_path: str, spec: dict):
+    # Written to a temporary file and renamed, so workers starting at the same
+    # time never read a partly written cache
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=os.path.dirname(cache_path), suffix=".tmp", delete=False
+    ) as file:
+        json.dump(spec, file)
+    os.replace(file.name, cache_path)
+
+
+def load_spec(
+    spec_path: str = SPEC_PATH, cache_dir: Optional[str] = DEFAULT_CACHE_DIR
+) -> Tuple[dict, bool]:
+    """
+    Load the validated spec, from the cache if it holds this spec
+    :param cache_dir: where cached specs are kept, or None not to cache them
+    :return:
+        A copy of the spec for connexion, which can be added with
+        skip_validation, and whether it came from the cache
+    """
+    name = cache_file_name(spec_path)
+    if name in _loaded_specs:
+        return copy.deepcopy(_loaded_specs[name]), True
+
+    cache_path = os.path.join(cache_dir, name) if cache_dir else None
+    cached = False
+    spec = None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as file:
+                spec = json.load(file)
+            cached = True
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring the unreadable spec cache {cache_path}")
+
+    if spec is None:
+        spec = _parse_and_validate(spec_path)
+        if cache_path:
+            try:
+                _write_cache(cache_path, spec)
+            except OSError:
+                logger.warning(f"Couldn't write the spec cache {cache_path}")
+
+    _loaded_specs[name] = spec
+    return copy.deepcopy(spec), cached
+
+
+@contextlib.contextmanager
+def skip_validation():
+    """
+    Stop connexion validating specs added while in this context, for specs
+    load_spec has already validated
+    """
+    OpenAPISpecification._validate_spec = classmethod(lambda cls, spec: None)
+    try:
+        yield
+    finally:
+        del OpenAPISpecification._validate_spec
+
+
+if __name__ == "__main__":
+    _, was_cached = load_spec()
+    print(
+        f"{os.path.join(DEFAULT_CACHE_DIR, cache_file_name())} "
+        + ("is up to date" if was_cached else "written")
+    )
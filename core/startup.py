@@ -0,0 +1,42 @@
+"""
+Times the phases of creating the app, so slow cold starts can be traced to
+the phase responsible.
+"""
+
+import contextlib
+import time
+from typing import Dict
+
+
+class StartupTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.phases: Dict[str, float] = {}
+        # Shown after a phase's time, eg. whether the spec was cached
+        self.notes: Dict[str, str] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (
+                self.phases.get(name, 0.0) + time.perf_counter() - started
+            )
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def total_seconds(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def report(self) -> str:
+        phases = ", ".join(
+            f"{name} {seconds * 1000:.0f}ms"
+            + (f" ({self.notes[name]})" if name in self.notes else "")
+            for name, seconds in self.phases.items()
+        )
+        return f"App created in {self.total_seconds * 1000:.0f}ms: {phases}"
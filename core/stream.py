@@ -0,0 +1,271 @@
+"""
+Fans account changes out to the clients of the change stream,
+GET /accounts/stream.
+
+Each worker reads the change log with a single background thread, woken by
+the account change listener's notifications, and passes every new change to
+each of its subscribers. So the db is read once for each change, however
+many clients are subscribed, rather than once for each client.
+
+A client reconnecting with the id of the last event it received gets the
+changes it missed from the change log before the stream's new changes. So
+streams are ended after ACCOUNT_CHANGE_STREAM_MAX_SECONDS without losing
+anything, which also closes the subscriptions of clients that have gone
+without the server noticing.
+
+The streams are served by coroutines in core.account_async on both request
+paths, so an open stream doesn't hold one of a sync worker's threads.
+"""
+
+import collections
+import logging
+import threading
+import time
+from typing import Callable
+from typing import Deque
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from flask import current_app
+from prometheus_client import Counter
+from prometheus_client import Gauge
+
+from core.changes import Change
+from core.changes import change_pages
+from core.changes import decode_cursor
+from core.changes import encode_cursor
+from core.changes import latest_change_statement
+from db import db
+
+EVENT_STREAM_MIMETYPE = "text/event-stream"
+# Sent with the stream, so neither caches nor proxies hold it back
+EVENT_STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# Sent when there's nothing else to send, so proxies don't time the stream out
+HEARTBEAT = ": heartbeat\n\n"
+STREAM_PAGE_SIZE = 500
+# A subscriber this many batches behind is dropped, and its client has to
+# reconnect and catch up from the change log, rather than the batches
+# piling up in memory
+SUBSCRIBER_MAX_BATCHES = 100
+
+STREAM_SUBSCRIBERS = Gauge(
+    "account_change_stream_subscribers",
+    "Clients subscribed to the account change stream",
+    multiprocess_mode="livesum",
+)
+STREAM_DROPPED_SUBSCRIBERS = Counter(
+    "account_change_stream_dropped_subscribers_total",
+    "Subscribers dropped for falling too far behind the account change stream",
+)
+
+
+class Subscription:
+    """
+    The batches of changes the stream has read since a client subscribed.
+
+    It stays open until it's dropped or expires_at, a time.monotonic().
+
+    cursor is the last change the stream read before the client subscribed,
+    so a client reconnecting with the id of an earlier event has missed the
+    changes after it up to cursor. Workers read the change log independently,
+    so a client reconnecting to another worker may already have received
+    some of the changes it reads next, and those are skipped.
+    """
+
+    def __init__(
+        self,
+        stream: "AccountChangeStream",
+        wake: Callable[[], None],
+        last_event_id: Optional[str] = None,
+    ):
+        self.cursor: Optional[str] = None
+        self.last_event_id = last_event_id
+        self.batches: Deque[List[Change]] = collections.deque()
+        self.dropped = False
+        self.expires_at = time.monotonic() + stream.max_seconds
+        self._stream = stream
+        self._wake = wake
+        self._after = decode_cursor(last_event_id) if last_event_id else None
+
+    @property
+    def open(self) -> bool:
+        return not self.dropped and time.monotonic() < self.expires_at
+
+    def wait_seconds(self) -> float:
+        """
+        How long to wait for changes before sending a heartbeat
+        """
+        return max(
+            min(self._stream.heartbeat_seconds, self.expires_at - time.monotonic()), 0
+        )
+
+    @property
+    def missed(self) -> Optional[Tuple[str, str]]:
+        """
+        The cursors after which and up to which the client missed changes
+        """
+        if self.last_event_id and self.cursor:
+            return self.last_event_id, self.cursor
+        return None
+
+    def deliver(self, changes: List[Change]):
+        if len(self.batches) >= SUBSCRIBER_MAX_BATCHES:
+            self.dropped = True
+            STREAM_DROPPED_SUBSCRIBERS.inc()
+            self._stream.unsubscribe(self)
+        else:
+            self.batches.append(changes)
+        self._wake()
+
+    def take(self) -> List[Change]:
+        changes = []
+        while self.batches:
+            for cursor, change in self.batches.popleft():
+                position = decode_cursor(cursor)
+                if self._after is None or position > self._after:
+                    changes.append((cursor, change))
+                    self._after = position
+        return changes
+
+    def close(self):
+        self._stream.unsubscribe(self)
+
+
+class AccountChangeStream:
+    """
+    Runs a background thread that reads the changes after the last one it
+    read whenever the account change listener is notified of a change, and
+    every poll_seconds in case a change is only readable once an older
+    transaction finishes, and delivers them to every subscription.
+
+    The thread is started by the first subscription, so processes that
+    don't serve the stream, or fork workers that do, don't run it.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.poll_seconds = 5
+        self.heartbeat_seconds = 15
+        self.max_seconds = 300
+        self.logger = logging.getLogger(__name__)
+        self._subscriptions: List[Subscription] = []
+        self._cursor: Optional[str] = None
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._started = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_seconds = app.config["ACCOUNT_CHANGE_STREAM_POLL_SECONDS"]
+        self.heartbeat_seconds = app.config["ACCOUNT_CHANGE_STREAM_HEARTBEAT_SECONDS"]
+        self.max_seconds = app.config["ACCOUNT_CHANGE_STREAM_MAX_SECONDS"]
+        self.logger = app.logger
+        app.extensions["account_change_stream"] = self
+
+    def notify(self, account_id: Optional[str] = None):
+        """
+        Wake the stream to read new changes, subscribed to the account
+        change listener
+        """
+        self._changed.set()
+
+    def subscribe(
+        self,
+        wake: Callable[[], None],
+        last_event_id: Optional[str] = None,
+        timeout: float = 10,
+    ) -> Subscription:
+        """
+        Subscribe to the changes read from now on, calling wake from the
+        stream's thread whenever there are more, once the stream has read
+        where the change log ends. Blocks until it has.
+        :raises ValueError: if last_event_id isn't a valid cursor
+        :raises TimeoutError: if the stream can't read the change log
+        """
+        subscription = Subscription(self, wake, last_event_id)
+        self.start()
+        if not self._started.wait(timeout):
+            raise TimeoutError("The account change stream hasn't started")
+        with self._lock:
+            subscription.cursor = self._cursor
+            self._subscriptions.append(subscription)
+        STREAM_SUBSCRIBERS.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription not in self._subscriptions:
+                return
+            self._subscriptions.remove(subscription)
+        STREAM_SUBSCRIBERS.dec()
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._started.clear()
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="account-change-stream", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stopping.set()
+        self._changed.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # Cleared before reading, so a change notified while reading is
+            # read straight after
+            self._changed.clear()
+            try:
+                self._read_changes()
+                self._started.set()
+            except Exception:
+                self.logger.exception("Account change stream failed to read changes")
+            self._changed.wait(self.poll_seconds)
+
+    def _read_changes(self):
+        with self.app.app_context():
+            if not self._subscriptions:
+                # Only keep up with the end of the change log, so the next
+                # subscription starts from there
+                latest = db.session.execute(latest_change_statement()).first()
+                with self._lock:
+                    if not self._subscriptions:
+                        self._cursor = (
+                            encode_cursor(latest.xid, latest.id) if latest else None
+                        )
+                        return
+
+            for results in change_pages(db.session, self._cursor, STREAM_PAGE_SIZE):
+                with self._lock:
+                    self._cursor = results[-1][0]
+                    subscriptions = list(self._subscriptions)
+                for subscription in subscriptions:
+                    try:
+                        subscription.deliver(results)
+                    except Exception:
+                        self.logger.exception(
+                            f"Account change subscription {subscription} failed"
+                        )
+                        self.unsubscribe(subscription)
+
+
+def format_event(cursor: str, change: dict) -> str:
+    return (
+        f"id: {cursor}\nevent: account_change\n"
+        f"data: {current_app.json.dumps(change)}\n\n"
+    )
+
+
+account_change_stream = AccountChangeStream()
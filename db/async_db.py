@@ -0,0 +1,52 @@
+"""
+The asyncio engine used by the async request path.
+"""
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from db.replica import use_replica
+
+
+class AsyncDB:
+    """
+    An asyncio engine and session factory connected through asyncpg to the
+    same database as db.
+
+    Both are created by init_app, and only when ASYNC_REQUEST_PATH_ENABLED is
+    set, as asyncpg connections belong to the event loop that opened them.
+    Sessions opened by operations that read from the replica, see db.replica,
+    are bound to an engine connected to REPLICA_DATABASE_URL where it is set.
+    """
+
+    def __init__(self, app=None):
+        self.engine: AsyncEngine = None
+        self.replica_engine: AsyncEngine = None
+        self._sessionmaker: async_sessionmaker = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        url = make_url(app.config["SQLALCHEMY_DATABASE_URI"]).set(
+            drivername="postgresql+asyncpg"
+        )
+        self.engine = create_async_engine(
+            url, **app.config.get("ASYNC_SQLALCHEMY_ENGINE_OPTIONS", {})
+        )
+        if app.config.get("REPLICA_DATABASE_URL"):
+            self.replica_engine = create_async_engine(
+                make_url(app.config["REPLICA_DATABASE_URL"]).set(
+                    drivername="postgresql+asyncpg"
+                ),
+                **app.config.get("ASYNC_REPLICA_SQLALCHEMY_ENGINE_OPTIONS", {}),
+            )
+        self._sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+        app.extensions["async_db"] = self
+
+    def session(self) -> AsyncSession:
+        if self.replica_engine is not None and use_replica():
+            return self._sessionmaker(bind=self.replica_engine)
+        return self._sessionmaker()
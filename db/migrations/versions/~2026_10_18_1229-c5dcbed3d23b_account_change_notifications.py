@@ -0,0 +1,98 @@
+"""account change notifications
+
+Revision ID: c5dcbed3d23b
+Revises: d7ec79e76cf0
+Create Date: 2026-10-18 12:29:17.318051
+
+"""
+
+import sqlalchemy_utils  # noqa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c5dcbed3d23b"
+down_revision = "d7ec79e76cf0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Statements touching more accounts than this send a single notification
+    # with a null account_id, telling listeners to drop everything they hold.
+    op.execute(
+        """
+        CREATE FUNCTION publish_account_changes(account_ids uuid[])
+        RETURNS void AS $$
+        BEGIN
+            IF cardinality(account_ids) > 1000 THEN
+                PERFORM pg_notify(
+                    'account_changes', json_build_object('account_id', NULL)::text
+                );
+            ELSE
+                PERFORM pg_notify(
+                    'account_changes',
+                    json_build_object('account_id', account_id)::text
+                )
+                FROM unnest(account_ids) AS account_id
+                WHERE account_id IS NOT NULL;
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    for table, account_id_column in (("account", "id"), ("role", "account_id")):
+        op.execute(
+            f"""
+            CREATE FUNCTION notify_{table}_changes() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    PERFORM publish_account_changes(
+                        ARRAY(SELECT DISTINCT {account_id_column} FROM new_rows)
+                    );
+                ELSIF TG_OP = 'UPDATE' THEN
+                    PERFORM publish_account_changes(
+                        ARRAY(
+                            SELECT {account_id_column} FROM new_rows
+                            UNION
+                            SELECT {account_id_column} FROM old_rows
+                        )
+                    );
+                ELSE
+                    PERFORM publish_account_changes(
+                        ARRAY(SELECT DISTINCT {account_id_column} FROM old_rows)
+                    );
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """
+        )
+        op.execute(
+            f"""
+            CREATE TRIGGER {table}_insert_notify AFTER INSERT ON {table}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_{table}_changes()
+            """
+        )
+        op.execute(
+            f"""
+            CREATE TRIGGER {table}_update_notify AFTER UPDATE ON {table}
+            REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_{table}_changes()
+            """
+        )
+        op.execute(
+            f"""
+            CREATE TRIGGER {table}_delete_notify AFTER DELETE ON {table}
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_{table}_changes()
+            """
+        )
+
+
+def downgrade():
+    for table in ("role", "account"):
+        for operation in ("insert", "update", "delete"):
+            op.execute(f"DROP TRIGGER {table}_{operation}_notify ON {table}")
+        op.execute(f"DROP FUNCTION notify_{table}_changes()")
+    op.execute("DROP FUNCTION publish_account_changes(uuid[])")
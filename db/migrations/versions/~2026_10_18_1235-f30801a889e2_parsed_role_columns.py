@@ -0,0 +1,114 @@
+"""parsed role columns
+
+Revision ID: f30801a889e2
+Revises: c5dcbed3d23b
+Create Date: 2026-10-18 12:35:41.207311
+
+"""
+
+import sqlalchemy as sa
+import sqlalchemy_utils  # noqa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "f30801a889e2"
+down_revision = "c5dcbed3d23b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Roles look like <FUND>_<ROLE TYPE>_<ROUND> or <FUND>_<ROUND>_<ROLE TYPE>,
+    # eg. COF_ASSESSOR_R1 or COF_R2W3_LEAD_ASSESSOR. Roles without a known
+    # role type, eg. SECTION_151, have no fund, round or role type.
+    op.execute(
+        """
+        CREATE FUNCTION role_type_of(role text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE RETURNS NULL ON NULL INPUT AS $$
+            SELECT CASE
+                WHEN role ~ '(^|_)LEAD_ASSESSOR(_|$)' THEN 'LEAD_ASSESSOR'
+                WHEN role ~ '(^|_)ASSESSOR(_|$)' THEN 'ASSESSOR'
+                WHEN role ~ '(^|_)COMMENTER(_|$)' THEN 'COMMENTER'
+            END
+        $$
+        """
+    )
+    # The role without its role type, eg. COF_R2W3 for COF_R2W3_LEAD_ASSESSOR
+    op.execute(
+        """
+        CREATE FUNCTION role_scope_of(role text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE RETURNS NULL ON NULL INPUT AS $$
+            SELECT nullif(
+                btrim(
+                    regexp_replace(
+                        '_' || role || '_', '_' || role_type_of(role) || '_', '_'
+                    ),
+                    '_'
+                ),
+                ''
+            )
+        $$
+        """
+    )
+    op.execute(
+        """
+        CREATE FUNCTION role_fund_of(role text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE RETURNS NULL ON NULL INPUT AS $$
+            SELECT split_part(role_scope_of(role), '_', 1)
+        $$
+        """
+    )
+    op.execute(
+        """
+        CREATE FUNCTION role_round_of(role text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE RETURNS NULL ON NULL INPUT AS $$
+            SELECT nullif(substring(role_scope_of(role) from '^[^_]+_(.*)$'), '')
+        $$
+        """
+    )
+
+    with op.batch_alter_table("role", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "fund",
+                sa.String(),
+                sa.Computed("role_fund_of(role)", persisted=True),
+                nullable=True,
+            )
+        )
+        batch_op.add_column(
+            sa.Column(
+                "round",
+                sa.String(),
+                sa.Computed("role_round_of(role)", persisted=True),
+                nullable=True,
+            )
+        )
+        batch_op.add_column(
+            sa.Column(
+                "role_type",
+                sa.String(),
+                sa.Computed("role_type_of(role)", persisted=True),
+                nullable=True,
+            )
+        )
+        batch_op.create_index(
+            "ix_role_fund_role_type_round",
+            ["fund", "role_type", "round", "account_id"],
+            unique=False,
+        )
+        batch_op.create_index("ix_role_role", ["role"], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table("role", schema=None) as batch_op:
+        batch_op.drop_index("ix_role_role")
+        batch_op.drop_index("ix_role_fund_role_type_round")
+        batch_op.drop_column("role_type")
+        batch_op.drop_column("round")
+        batch_op.drop_column("fund")
+
+    op.execute("DROP FUNCTION role_round_of(text)")
+    op.execute("DROP FUNCTION role_fund_of(text)")
+    op.execute("DROP FUNCTION role_scope_of(text)")
+    op.execute("DROP FUNCTION role_type_of(text)")
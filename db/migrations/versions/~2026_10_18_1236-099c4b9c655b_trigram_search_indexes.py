@@ -0,0 +1,38 @@
+"""trigram search indexes
+
+Revision ID: 099c4b9c655b
+Revises: f30801a889e2
+Create Date: 2026-10-18 12:36:52.113807
+
+"""
+
+import sqlalchemy_utils  # noqa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "099c4b9c655b"
+down_revision = "f30801a889e2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # Build the indexes without taking a write lock on the tables, which
+    # can't be done inside a transaction
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_role_role_trgm "
+            "ON role USING gin (role gin_trgm_ops)"
+        )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_account_email_trgm "
+            "ON account USING gin (email gin_trgm_ops)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_account_email_trgm")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_role_role_trgm")
@@ -0,0 +1,49 @@
+"""account email domain
+
+Revision ID: 6e1ad2683444
+Revises: 099c4b9c655b
+Create Date: 2026-10-18 12:38:07.560841
+
+"""
+
+import sqlalchemy as sa
+import sqlalchemy_utils  # noqa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "6e1ad2683444"
+down_revision = "099c4b9c655b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("account", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "email_domain",
+                sa.String(),
+                sa.Computed("lower(split_part(email, '@', 2))", persisted=True),
+                nullable=True,
+            )
+        )
+
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_account_email_domain "
+            "ON account (email_domain)"
+        )
+        # Domain searches no longer use a wildcard on email
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_account_email_trgm")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_account_email_trgm "
+            "ON account USING gin (email gin_trgm_ops)"
+        )
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_account_email_domain")
+
+    with op.batch_alter_table("account", schema=None) as batch_op:
+        batch_op.drop_column("email_domain")
@@ -0,0 +1,30 @@
+"""role account_id index
+
+Revision ID: b523818aaefd
+Revises: 6e1ad2683444
+Create Date: 2026-10-18 12:40:43.608721
+
+"""
+
+import sqlalchemy_utils  # noqa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b523818aaefd"
+down_revision = "6e1ad2683444"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serves loading the roles of a batch of accounts
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_role_account_id "
+            "ON role (account_id)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_role_account_id")
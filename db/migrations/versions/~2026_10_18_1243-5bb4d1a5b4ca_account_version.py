@@ -0,0 +1,29 @@
+"""account version
+
+Revision ID: 5bb4d1a5b4ca
+Revises: b523818aaefd
+Create Date: 2026-10-18 12:43:15.225562
+
+"""
+
+import sqlalchemy as sa
+import sqlalchemy_utils  # noqa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5bb4d1a5b4ca"
+down_revision = "b523818aaefd"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("account", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column("version", sa.Integer(), server_default="1", nullable=False)
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("account", schema=None) as batch_op:
+        batch_op.drop_column("version")
@@ -0,0 +1,134 @@
+"""account changes
+
+Revision ID: 2266ab7d6db5
+Revises: 5bb4d1a5b4ca
+Create Date: 2026-10-18 14:13:47.216972
+
+"""
+
+import sqlalchemy as sa
+import sqlalchemy_utils  # noqa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "2266ab7d6db5"
+down_revision = "5bb4d1a5b4ca"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("account", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "updated_at",
+                sa.DateTime(timezone=True),
+                server_default=sa.text("now()"),
+                nullable=False,
+            )
+        )
+    op.execute(
+        """
+        CREATE FUNCTION set_account_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at := now();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER account_set_updated_at BEFORE UPDATE ON account
+        FOR EACH ROW
+        EXECUTE FUNCTION set_account_updated_at()
+        """
+    )
+
+    # xid is the id of the transaction making the change, which orders the
+    # changes by commit closely enough for the changes endpoint to page
+    # through them, see core.changes.changes_statement()
+    op.create_table(
+        "account_change",
+        sa.Column("id", sa.BigInteger(), sa.Identity(always=True), nullable=False),
+        sa.Column("account_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column(
+            "xid",
+            sa.BigInteger(),
+            server_default=sa.text("pg_current_xact_id()::text::bigint"),
+            nullable=False,
+        ),
+        sa.Column(
+            "changed_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_account_change")),
+    )
+    with op.batch_alter_table("account_change", schema=None) as batch_op:
+        batch_op.create_index("ix_account_change_xid_id", ["xid", "id"], unique=False)
+
+    # The statement triggers on account and role already call this with the
+    # accounts each statement changes, deleted accounts included
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION publish_account_changes(account_ids uuid[])
+        RETURNS void AS $$
+        BEGIN
+            INSERT INTO account_change (account_id)
+            SELECT DISTINCT account_id
+            FROM unnest(account_ids) AS account_id
+            WHERE account_id IS NOT NULL;
+
+            IF cardinality(account_ids) > 1000 THEN
+                PERFORM pg_notify(
+                    'account_changes', json_build_object('account_id', NULL)::text
+                );
+            ELSE
+                PERFORM pg_notify(
+                    'account_changes',
+                    json_build_object('account_id', account_id)::text
+                )
+                FROM unnest(account_ids) AS account_id
+                WHERE account_id IS NOT NULL;
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    # So a client syncing from the start gets every existing account
+    op.execute("INSERT INTO account_change (account_id) SELECT id FROM account")
+
+
+def downgrade():
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION publish_account_changes(account_ids uuid[])
+        RETURNS void AS $$
+        BEGIN
+            IF cardinality(account_ids) > 1000 THEN
+                PERFORM pg_notify(
+                    'account_changes', json_build_object('account_id', NULL)::text
+                );
+            ELSE
+                PERFORM pg_notify(
+                    'account_changes',
+                    json_build_object('account_id', account_id)::text
+                )
+                FROM unnest(account_ids) AS account_id
+                WHERE account_id IS NOT NULL;
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    with op.batch_alter_table("account_change", schema=None) as batch_op:
+        batch_op.drop_index("ix_account_change_xid_id")
+    op.drop_table("account_change")
+
+    op.execute("DROP TRIGGER account_set_updated_at ON account")
+    op.execute("DROP FUNCTION set_account_updated_at()")
+    with op.batch_alter_table("account", schema=None) as batch_op:
+        batch_op.drop_column("updated_at")
@@ -1,13 +1,35 @@
+import logging
 import uuid  # noqa
+from functools import lru_cache
 from typing import Mapping
+from typing import Tuple
 
 from flask import current_app
 from fsd_utils.authentication.utils import get_highest_role_map
+from sqlalchemy import Computed
+from sqlalchemy import text
 from sqlalchemy.dialects.postgresql import UUID
 
 from db import db
 
 
+def email_domain_of(email: str) -> str:
+    """
+    Returns the lowercased domain of an email address, exactly as the db
+    computes the account's email_domain column.
+    """
+    parts = email.split("@")
+    return parts[1].lower() if len(parts) > 1 else ""
+
+
+@lru_cache(maxsize=4096)
+def _highest_role_map(roles: Tuple[str, ...]) -> Mapping[str, str]:
+    # Most accounts share one of a handful of role sets. The roles are given
+    # sorted, so each set is cached once, and the funds are in the same order
+    # in every worker, whatever order the account's roles were read in
+    return get_highest_role_map(list(roles))
+
+
 class Account(db.Model):
     id = db.Column(
         "id",
@@ -21,13 +43,31 @@ class Account(db.Model):
     azure_ad_subject_id = db.Column(
         "azure_ad_subject_id", db.String(), nullable=True, unique=True
     )
+    # Kept in step with email_domain_of()
+    email_domain = db.Column(
+        "email_domain",
+        db.String(),
+        Computed("lower(split_part(email, '@', 2))", persisted=True),
+        index=True,
+    )
+    # Bumped whenever the account or its roles are updated, and used as the
+    # account's ETag
+    version = db.Column("version", db.Integer(), nullable=False, server_default="1")
+    # Set by a trigger whenever the account's row is updated
+    updated_at = db.Column(
+        "updated_at",
+        db.DateTime(timezone=True),
+        nullable=False,
+        server_default=text("now()"),
+    )
     roles = db.relationship(
         "Role", lazy="select", backref=db.backref("account", lazy="joined")
     )
 
     @property
     def highest_role_map(self) -> Mapping[str, str]:
-        roles_as_strings = [r.role for r in self.roles]
-        role_map = get_highest_role_map(roles_as_strings)
-        current_app.logger.debug(f"Role map for {self.id}: {role_map}")
+        roles = tuple(sorted({r.role for r in self.roles}))
+        role_map = dict(_highest_role_map(roles))
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            current_app.logger.debug(f"Role map for {self.id}: {role_map}")
         return role_map
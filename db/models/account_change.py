@@ -0,0 +1,32 @@
+from sqlalchemy import Identity
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import UUID
+
+from db import db
+
+
+class AccountChange(db.Model):
+    """
+    A change to an account or its roles, written by the db's triggers on
+    account and role whenever a statement changes them. There's no foreign
+    key to account, so the changes of deleted accounts stay to tell clients
+    syncing the accounts to delete them.
+    """
+
+    id = db.Column("id", db.BigInteger(), Identity(always=True), primary_key=True)
+    account_id = db.Column("account_id", UUID(as_uuid=True), nullable=False)
+    # The id of the transaction making the change
+    xid = db.Column(
+        "xid",
+        db.BigInteger(),
+        nullable=False,
+        server_default=text("pg_current_xact_id()::text::bigint"),
+    )
+    changed_at = db.Column(
+        "changed_at",
+        db.DateTime(timezone=True),
+        nullable=False,
+        server_default=text("now()"),
+    )
+
+    __table_args__ = (db.Index("ix_account_change_xid_id", xid, id),)
@@ -1,10 +1,15 @@
 import uuid  # noqa
 
+from sqlalchemy import Computed
 from sqlalchemy.dialects.postgresql import UUID
 
 from db import db
 from db.models.account import Account
 
+LEAD_ASSESSOR = "LEAD_ASSESSOR"
+ASSESSOR = "ASSESSOR"
+COMMENTER = "COMMENTER"
+
 
 class Role(db.Model):
     id = db.Column(
@@ -17,9 +22,42 @@ class Role(db.Model):
         "account_id",
         UUID(as_uuid=True),
         db.ForeignKey(Account.id),
+        index=True,
     )
     role = db.Column(
         "role",
         db.String(),
         nullable=False,
     )
+    # Parsed from role by the db, eg. COF, R2W3 and LEAD_ASSESSOR for
+    # COF_R2W3_LEAD_ASSESSOR, or all null for roles like SECTION_151
+    fund = db.Column(
+        "fund",
+        db.String(),
+        Computed("role_fund_of(role)", persisted=True),
+        nullable=True,
+    )
+    round = db.Column(
+        "round",
+        db.String(),
+        Computed("role_round_of(role)", persisted=True),
+        nullable=True,
+    )
+    role_type = db.Column(
+        "role_type",
+        db.String(),
+        Computed("role_type_of(role)", persisted=True),
+        nullable=True,
+    )
+
+    __table_args__ = (
+        db.Index("ix_role_fund_role_type_round", fund, role_type, round, account_id),
+        db.Index("ix_role_role", role),
+        # Serves the leading-wildcard LIKEs used to search partial roles
+        db.Index(
+            "ix_role_role_trgm",
+            role,
+            postgresql_using="gin",
+            postgresql_ops={"role": "gin_trgm_ops"},
+        ),
+    )
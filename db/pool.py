@@ -0,0 +1,105 @@
+"""
+Connection pools that report how long requests wait for a db connection.
+"""
+
+import time
+import uuid
+import weakref
+
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.pool import QueuePool
+
+POOL_CHECKOUT_WAIT_SECONDS = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time taken to get a connection from the pool, including opening one",
+    ["engine"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total",
+    "Checkouts that gave up after waiting pool_timeout for a connection",
+    ["engine"],
+)
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Connections currently checked out of the pool",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow",
+    "Connections open beyond pool_size, negative while the pool is filling",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+POOL_SIZE = Gauge(
+    "db_pool_size",
+    "The pool_size of the pool",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+
+_pools = weakref.WeakSet()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool recording each checkout's wait in POOL_CHECKOUT_WAIT_SECONDS.
+    """
+
+    engine_label = "sync"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _pools.add(self)
+        _update_pool_gauges(self.engine_label)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.labels(self.engine_label).inc()
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT_SECONDS.labels(self.engine_label).observe(
+                time.perf_counter() - started
+            )
+            _update_pool_gauges(self.engine_label)
+
+    def _do_return_conn(self, record):
+        try:
+            super()._do_return_conn(record)
+        finally:
+            _update_pool_gauges(self.engine_label)
+
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    engine_label = "async"
+
+
+class InstrumentedReplicaQueuePool(InstrumentedQueuePool):
+    engine_label = "replica"
+
+
+class InstrumentedAsyncAdaptedReplicaQueuePool(InstrumentedAsyncAdaptedQueuePool):
+    engine_label = "async_replica"
+
+
+def _update_pool_gauges(engine_label: str):
+    # Gauges are set rather than collected on scrape, so that in multiprocess
+    # mode every worker's pools are summed
+    pools = [pool for pool in list(_pools) if pool.engine_label == engine_label]
+    POOL_CHECKED_OUT.labels(engine_label).set(sum(pool.checkedout() for pool in pools))
+    POOL_OVERFLOW.labels(engine_label).set(sum(pool.overflow() for pool in pools))
+    POOL_SIZE.labels(engine_label).set(sum(pool.size() for pool in pools))
+
+
+def unique_prepared_statement_name() -> str:
+    # PgBouncer may run each transaction on a different server connection,
+    # so asyncpg's prepared statements must never be reused by name
+    return f"__asyncpg_{uuid.uuid4()}__"
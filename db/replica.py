@@ -0,0 +1,201 @@
+"""
+Routes the reads of read only operations to a read replica of the db, when
+REPLICA_DATABASE_URL is set.
+
+Statements run by an operation decorated with reads_from_replica go to the
+replica, through RoutingSession for core.account and async_db for
+core.account_async. Everything else, including every write, goes to the
+primary.
+
+A replica replays the primary's changes a moment after they commit, so a
+client reading straight after it writes could miss its own write. Responses
+to requests that commit send the time REPLICA_READ_YOUR_WRITES_SECONDS later
+in a PRIMARY_HEADER header, and in a cookie for clients that keep cookies,
+and every read sending either back before then, whether its operation reads
+from the replica or not, goes to the primary. The api's clients are mostly
+other services that don't keep cookies, so they must send the header back
+themselves.
+"""
+
+import functools
+import inspect
+import time
+from contextvars import ContextVar
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import TypeVar
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.orm import Session as BaseSession
+from werkzeug.http import dump_cookie
+from werkzeug.http import parse_cookie
+
+# The key of the replica in SQLALCHEMY_BINDS
+REPLICA_BIND_KEY = "replica"
+# Hold the time until which the client's reads go to the primary
+PRIMARY_COOKIE = "account_store_primary_until"
+PRIMARY_HEADER = "X-Account-Store-Primary-Until"
+
+T = TypeVar("T")
+
+
+class RequestRouting:
+    """
+    Whether a request may read from the replica, and whether it has written
+    """
+
+    def __init__(self, primary_until: float = 0.0):
+        self.replica_allowed = primary_until <= time.time()
+        self.wrote = False
+
+
+# Set for the duration of each request by ReplicaRoutingMiddleware
+_request_routing: ContextVar[Optional[RequestRouting]] = ContextVar(
+    "request_routing", default=None
+)
+# Set while an operation decorated with reads_from_replica runs
+_reads_from_replica: ContextVar[bool] = ContextVar("reads_from_replica", default=False)
+
+
+def reads_from_replica(function):
+    """
+    Run the statements of an api operation, which mustn't write, on the
+    replica, unless the client has just written
+    """
+    if inspect.iscoroutinefunction(function):
+
+        @functools.wraps(function)
+        async def read_from_replica(*args, **kwargs):
+            token = _reads_from_replica.set(True)
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                _reads_from_replica.reset(token)
+
+    else:
+
+        @functools.wraps(function)
+        def read_from_replica(*args, **kwargs):
+            token = _reads_from_replica.set(True)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _reads_from_replica.reset(token)
+
+    return read_from_replica
+
+
+def iterate_as_read(iterable: Iterable[T]) -> Iterator[T]:
+    """
+    Iterate over an iterable, e.g. the generator streaming an operation's
+    response, reading from the replica if the operation creating it does.
+    Streams are iterated after the operation has returned, when its
+    statements would otherwise go to the primary
+    """
+    # Read now, while the operation runs, rather than on the first next()
+    replica = _reads_from_replica.get()
+
+    def iterate():
+        iterator = iter(iterable)
+        while True:
+            # Set for each item rather than across yields, which would leak
+            # it into the code iterating
+            token = _reads_from_replica.set(replica)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _reads_from_replica.reset(token)
+            yield item
+
+    return iterate()
+
+
+def use_replica() -> bool:
+    routing = _request_routing.get()
+    return _reads_from_replica.get() and routing is not None and routing.replica_allowed
+
+
+class RoutingSession(Session):
+    """
+    Flask-SQLAlchemy's session, choosing the replica for the statements of
+    operations that read from it
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and use_replica():
+            replica = self._db.engines.get(REPLICA_BIND_KEY)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _after_commit(session):
+    routing = _request_routing.get()
+    if routing is not None:
+        routing.wrote = True
+
+
+class ReplicaRoutingMiddleware:
+    """
+    ASGI middleware deciding whether each request may read from the replica,
+    from the header or cookie sent on responses to the client's writes, and
+    sending them on responses to requests that commit
+    """
+
+    def __init__(self, app, flask_app):
+        self.app = app
+        self.read_your_writes_seconds = flask_app.config[
+            "REPLICA_READ_YOUR_WRITES_SECONDS"
+        ]
+        # Commits of sync and async sessions alike
+        if not event.contains(BaseSession, "after_commit", _after_commit):
+            event.listen(BaseSession, "after_commit", _after_commit)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        routing = RequestRouting(_primary_until(scope))
+        token = _request_routing.set(routing)
+
+        async def send_with_primary_until(message):
+            if message["type"] == "http.response.start" and routing.wrote:
+                primary_until = f"{time.time() + self.read_your_writes_seconds:.3f}"
+                cookie = dump_cookie(
+                    PRIMARY_COOKIE,
+                    primary_until,
+                    max_age=self.read_your_writes_seconds,
+                    httponly=True,
+                )
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (PRIMARY_HEADER.lower().encode(), primary_until.encode()),
+                    (b"set-cookie", cookie.encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_primary_until)
+        finally:
+            _request_routing.reset(token)
+
+
+def _primary_until(scope) -> float:
+    primary_until = 0.0
+    for name, value in scope.get("headers", []):
+        try:
+            if name == PRIMARY_HEADER.lower().encode():
+                primary_until = max(primary_until, float(value))
+            elif name == b"cookie":
+                primary_until = max(
+                    primary_until,
+                    float(parse_cookie(value.decode("latin-1"))[PRIMARY_COOKIE]),
+                )
+        except (KeyError, ValueError):
+            pass
+    return primary_until
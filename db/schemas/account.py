@@ -9,6 +9,7 @@ from db.models.account import Account
 class AccountSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = Account
+        exclude = ("email_domain", "version", "updated_at")
 
     id = fields.UUID(data_key="account_id")
     email = fields.String(data_key="email_address")
@@ -16,3 +17,19 @@ class AccountSchema(SQLAlchemyAutoSchema):
     azure_ad_subject_id = auto_field()
     roles = Function(lambda obj: [role.role for role in obj.roles])
     highest_role_map = Function(lambda obj: obj.highest_role_map)
+
+
+def serialize_account(account: Account) -> dict:
+    """
+    Serialise an account to exactly what AccountSchema().dump(account) returns,
+    without marshmallow's per-field dispatch, for endpoints returning many
+    accounts at once. Any change to AccountSchema must be made here too.
+    """
+    return {
+        "account_id": str(account.id) if account.id is not None else None,
+        "email_address": account.email,
+        "full_name": account.full_name,
+        "azure_ad_subject_id": account.azure_ad_subject_id,
+        "roles": [role.role for role in account.roles],
+        "highest_role_map": account.highest_role_map,
+    }
@@ -1,3 +1,20 @@
+import os
+import tempfile
+
 from fsd_utils.gunicorn.config.devtest import *  # noqa
 
 # bind = "127.0.0.1:5000"
+
+
+# Workers write their metrics to files in this directory, so /metrics can
+# report the totals across every worker. It must be set before
+# prometheus_client is imported, and start out empty.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="prometheus-multiproc-")
+)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
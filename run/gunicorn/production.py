@@ -0,0 +1,50 @@
+import gc
+import os
+
+from fsd_utils.gunicorn.config.devtest import post_fork as log_post_fork
+from fsd_utils.gunicorn.config.devtest import when_ready as log_when_ready
+
+from run.gunicorn.devtest import *  # noqa
+
+# bind = "127.0.0.1:5000"
+
+# Each worker has its own db pools, account change listener and change stream
+# thread, so set WEB_CONCURRENCY for each environment with its task's cpu and
+# memory and the db's connections in mind, see the README
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+# Create the app once, in the master, and fork the workers from it, so the
+# pages holding the modules, the spec and connexion's validators are shared
+# by every worker rather than each worker creating its own.
+preload_app = True
+
+# Sharing pages only lasts until a worker writes to them, and the garbage
+# collector writes to every object it tracks. So the master doesn't collect
+# while the app is created, which would leave freed gaps in its pages for the
+# workers to fill, and freezes every object before forking so the workers'
+# collectors never touch them.
+gc.disable()
+
+
+def when_ready(server):
+    from app import app
+    from app import before_fork
+    from app import worker_db_connections
+
+    before_fork(app)
+    gc.freeze()
+    gc.enable()
+    server.log.info(f"Froze {gc.get_freeze_count()} objects before forking")
+    server.log.info(
+        f"Forking {workers} workers, each using up to"
+        f" {worker_db_connections(app.app.config)} db connections"
+    )
+    log_when_ready(server)
+
+
+def post_fork(server, worker):
+    from app import after_fork
+    from app import app
+
+    after_fork(app)
+    log_post_fork(server, worker)
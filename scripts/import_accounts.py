@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Script to load accounts and their roles from a CSV or JSONL file
+
+The file is streamed into a temporary staging table with COPY, then merged
+into the account and role tables with a handful of set-based statements, all
+in one transaction:
+
+- emails are lowercased, and rows with the same email are merged into one
+  account with all of their roles
+- accounts are created, or updated if a full_name or azure_ad_subject_id is
+  given that they don't already have
+- roles the accounts don't already have are added, existing roles are kept
+- accounts whose azure_ad_subject_id belongs to another account, or is given
+  for more than one email, are skipped
+
+------------------------ How to run the script -----------------------
+CSV files need a header row with an email_address column, and optionally
+full_name, azure_ad_subject_id and roles columns. Separate multiple roles in
+one row with semicolons, or give each role on a row of its own.
+
+    email_address,full_name,azure_ad_subject_id,roles
+    a@example.com,Jane Doe,,COF_ASSESSOR;COF_COMMENTER
+
+JSONL files need an object per line with the same keys, with roles as a list.
+
+    {"email_address": "a@example.com", "roles": ["COF_ASSESSOR"]}
+
+==============
+To Run
+=============
+>> python -m scripts.import_accounts /path/to/accounts.csv --database_url postgresql://...
+
+or, against the local development db
+
+>> invoke import-accounts /path/to/accounts.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+from typing import Callable
+from typing import Dict
+from typing import IO
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+
+import psycopg2
+
+PROGRESS_EVERY_ROWS = 100_000
+
+CREATE_STAGING_TABLE = """
+    CREATE TEMPORARY TABLE account_import (
+        email text,
+        full_name text,
+        azure_ad_subject_id text,
+        role text
+    ) ON COMMIT DROP
+"""
+
+COPY_STAGING_TABLE = "COPY account_import FROM STDIN"
+
+# One row per account, with its roles de-duplicated
+MERGE_STAGING_TABLE = """
+    CREATE TEMPORARY TABLE account_import_merged ON COMMIT DROP AS
+    SELECT
+        lower(btrim(email)) AS email,
+        max(nullif(btrim(full_name), '')) AS full_name,
+        max(nullif(btrim(azure_ad_subject_id), '')) AS azure_ad_subject_id,
+        coalesce(
+            array_agg(DISTINCT upper(btrim(role)))
+                FILTER (WHERE nullif(btrim(role), '') IS NOT NULL),
+            '{}'
+        ) AS roles
+    FROM account_import
+    WHERE nullif(btrim(email), '') IS NOT NULL
+    GROUP BY lower(btrim(email))
+"""
+
+# As with PUT /accounts/{account_id}, an account's azure_ad_subject_id can be
+# set but not changed
+REMOVE_CONFLICTS = """
+    DELETE FROM account_import_merged AS merged
+    WHERE merged.azure_ad_subject_id IN (
+        SELECT azure_ad_subject_id
+        FROM account_import_merged
+        GROUP BY azure_ad_subject_id
+        HAVING count(*) > 1
+    )
+    OR EXISTS (
+        SELECT 1
+        FROM account
+        WHERE (
+            account.azure_ad_subject_id = merged.azure_ad_subject_id
+            AND account.email <> merged.email
+        )
+        OR (
+            account.email = merged.email
+            AND account.azure_ad_subject_id <> merged.azure_ad_subject_id
+        )
+    )
+    RETURNING merged.email
+"""
+
+CREATE_UPSERTED_TABLE = """
+    CREATE TEMPORARY TABLE account_import_upserted (
+        id uuid PRIMARY KEY,
+        created boolean NOT NULL
+    ) ON COMMIT DROP
+"""
+
+# xmax is only zero for rows that were inserted rather than updated
+UPSERT_ACCOUNTS = """
+    WITH upserted AS (
+        INSERT INTO account (id, email, full_name, azure_ad_subject_id)
+        SELECT gen_random_uuid(), email, full_name, azure_ad_subject_id
+        FROM account_import_merged
+        ON CONFLICT (email) DO UPDATE SET
+            full_name = coalesce(excluded.full_name, account.full_name),
+            azure_ad_subject_id = coalesce(
+                excluded.azure_ad_subject_id, account.azure_ad_subject_id
+            ),
+            version = account.version + 1
+        WHERE (account.full_name, account.azure_ad_subject_id)
+            IS DISTINCT FROM (
+                coalesce(excluded.full_name, account.full_name),
+                coalesce(excluded.azure_ad_subject_id, account.azure_ad_subject_id)
+            )
+        RETURNING id, xmax = 0 AS created
+    )
+    INSERT INTO account_import_upserted SELECT id, created FROM upserted
+"""
+
+COUNT_UPSERTED = """
+    SELECT count(*) FILTER (WHERE created), count(*) FILTER (WHERE NOT created)
+    FROM account_import_upserted
+"""
+
+# Accounts that were created or updated above already have a new version
+ADD_ROLES = """
+    WITH added AS (
+        INSERT INTO role (id, account_id, role)
+        SELECT gen_random_uuid(), account.id, roles.role
+        FROM account_import_merged AS merged
+        JOIN account ON account.email = merged.email
+        CROSS JOIN unnest(merged.roles) AS roles(role)
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM role
+            WHERE role.account_id = account.id AND role.role = roles.role
+        )
+        RETURNING account_id
+    ),
+    bumped AS (
+        UPDATE account SET version = version + 1
+        WHERE id IN (
+            SELECT account_id FROM added
+            EXCEPT
+            SELECT id FROM account_import_upserted
+        )
+        RETURNING id
+    )
+    SELECT (SELECT count(*) FROM added), (SELECT count(*) FROM bumped)
+"""
+
+
+def read_csv(file: IO[str]) -> Iterator[dict]:
+    for row in csv.DictReader(file):
+        yield {
+            "email_address": row.get("email_address"),
+            "full_name": row.get("full_name"),
+            "azure_ad_subject_id": row.get("azure_ad_subject_id"),
+            "roles": re.split(r"[;\s]+", row.get("roles") or ""),
+        }
+
+
+def read_jsonl(file: IO[str]) -> Iterator[dict]:
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl}
+
+
+def file_format_of(path: str) -> str:
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    return "jsonl" if extension in ("jsonl", "ndjson") else "csv"
+
+
+def _copy_value(value: Optional[str]) -> str:
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class _CopyRows:
+    """
+    A file-like object serving accounts in COPY's text format as they are
+    read, so the file is never held in memory
+    """
+
+    def __init__(self, accounts: Iterable[dict], progress: Callable[[int], None]):
+        self.accounts = iter(accounts)
+        self.progress = progress
+        self.rows_read = 0
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            account = next(self.accounts, None)
+            if account is None:
+                break
+            self._buffer += self._lines(account)
+            self.rows_read += 1
+            if self.rows_read % PROGRESS_EVERY_ROWS == 0:
+                self.progress(self.rows_read)
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size: int = -1) -> str:
+        return self.read(size)
+
+    @staticmethod
+    def _lines(account: dict) -> str:
+        roles = account.get("roles") or []
+        if isinstance(roles, str):
+            roles = [roles]
+        # One row per role, or a single row with no role
+        return "".join(
+            "\t".join(
+                _copy_value(value)
+                for value in (
+                    account.get("email_address"),
+                    account.get("full_name"),
+                    account.get("azure_ad_subject_id"),
+                    role,
+                )
+            )
+            + "\n"
+            for role in (roles or [None])
+        )
+
+
+def load_accounts(
+    connection, accounts: Iterable[dict], log: Callable[[str], None] = print
+) -> Dict[str, int]:
+    """
+    Load accounts into the account store, committing them in one transaction
+    :param connection: an open psycopg2 connection
+    :param accounts: dicts with email_address and optionally full_name,
+        azure_ad_subject_id and roles, eg. from read_csv or read_jsonl
+    :param log: called with progress messages
+    :return:
+        Counts of the rows read, accounts created, updated and skipped, and
+        roles added
+    """
+    rows = _CopyRows(accounts, lambda count: log(f"Read {count} rows..."))
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_STAGING_TABLE)
+            cursor.copy_expert(COPY_STAGING_TABLE, rows)
+            log(f"Copied {rows.rows_read} rows into the staging table")
+            cursor.execute("ANALYZE account_import")
+
+            cursor.execute(MERGE_STAGING_TABLE)
+            accounts_in_file = cursor.rowcount
+            cursor.execute("ANALYZE account_import_merged")
+            cursor.execute(REMOVE_CONFLICTS)
+            skipped = [email for (email,) in cursor.fetchall()]
+            for email in skipped:
+                log(f"Skipping {email}, its azure_ad_subject_id conflicts")
+
+            cursor.execute(CREATE_UPSERTED_TABLE)
+            cursor.execute(UPSERT_ACCOUNTS)
+            cursor.execute(COUNT_UPSERTED)
+            created, updated = cursor.fetchone()
+            # Let the planner see the accounts just added, which can be most
+            # of the table, before joining the imported roles to them
+            cursor.execute("ANALYZE account")
+            cursor.execute(ADD_ROLES)
+            roles_added, role_only_updates = cursor.fetchone()
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    counts = {
+        "rows": rows.rows_read,
+        "accounts": accounts_in_file,
+        "created": created,
+        "updated": updated + role_only_updates,
+        "skipped": len(skipped),
+        "roles_added": roles_added,
+    }
+    log(
+        "Imported {accounts} accounts from {rows} rows: {created} created, "
+        "{updated} updated, {skipped} skipped, {roles_added} roles added".format(
+            **counts
+        )
+    )
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="The CSV or JSONL file of accounts to load")
+    parser.add_argument(
+        "--file_format",
+        help="csv or jsonl, by default guessed from the file extension",
+        choices=READERS,
+        required=False,
+    )
+    parser.add_argument(
+        "--database_url",
+        help="The account store db, by default DATABASE_URL",
+        required=False,
+        default=os.getenv("DATABASE_URL"),
+    )
+    args = parser.parse_args()
+
+    with open(args.path, newline="") as file:
+        connection = psycopg2.connect(args.database_url)
+        try:
+            load_accounts(
+                connection,
+                READERS[args.file_format or file_format_of(args.path)](file),
+            )
+        finally:
+            connection.close()
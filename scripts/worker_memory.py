@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Prints the memory of a gunicorn master and each of its workers, to size how
+many workers fit in a task.
+
+rss counts every page a process has, including the pages it shares with the
+other workers, so adding up the workers' rss overstates what they use. uss
+is the memory only that process uses, which is what each extra worker costs,
+and pss shares each shared page between the processes sharing it, so the
+pss of the master and workers add up to the memory they use between them.
+
+------------------------ How to run the script -----------------------
+On the host or in the container running gunicorn
+
+>> python -m scripts.worker_memory <gunicorn master pid>
+
+or, where gunicorn is the container's main process
+
+>> python -m scripts.worker_memory 1
+"""
+
+import argparse
+from typing import List
+
+from core.metrics import process_memory
+
+
+def _children(pid: int) -> List[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as file:
+        return [int(child) for child in file.read().split()]
+
+
+def _mib(value: int) -> str:
+    return f"{value / 1024 / 1024:.1f} MiB"
+
+
+def format_memory(master_pid: int) -> str:
+    rows = [("", "pid", "rss", "pss", "uss")]
+    totals = {"rss": 0, "pss": 0, "uss": 0}
+    for name, pid in [("master", master_pid)] + [
+        ("worker", child) for child in _children(master_pid)
+    ]:
+        memory = process_memory(pid)
+        if memory is None:
+            # The worker exited
+            continue
+        for kind, value in memory.items():
+            totals[kind] += value
+        rows.append(
+            (name, str(pid), *(_mib(memory[kind]) for kind in ("rss", "pss", "uss")))
+        )
+    rows.append(("total", "", *(_mib(totals[kind]) for kind in ("rss", "pss", "uss"))))
+    widths = [max(len(row[column]) for row in rows) for column in range(5)]
+    return "\n".join(
+        "  ".join(
+            value.ljust(width) if column < 2 else value.rjust(width)
+            for column, (value, width) in enumerate(zip(row, widths))
+        ).rstrip()
+        for row in rows
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pid", type=int, help="The pid of the gunicorn master")
+    args = parser.parse_args()
+
+    print(format_memory(args.pid))
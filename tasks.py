@@ -4,11 +4,26 @@ from uuid import uuid4
 from colored import attr
 from colored import fg
 from colored import stylize
+from invoke import Exit
 from invoke import task
-from app import app as connexionapp
+from app import create_flask_app
+from benchmarks.compare import BASELINE_PATH
+from benchmarks.compare import compare_results
+from benchmarks.compare import format_comparison
+from benchmarks.compare import load_baseline
+from benchmarks.compare import rerun_baseline
+from benchmarks.population import Population
+from benchmarks.population import seed_population
+from benchmarks.run import InProcessClient
+from benchmarks.run import format_results
+from benchmarks.run import run_benchmarks
+from benchmarks.run import write_results
 from db.models.account import Account
 from sqlalchemy import select
 from db.models.role import Role  # noqa:E402
+from scripts.import_accounts import READERS
+from scripts.import_accounts import file_format_of
+from scripts.import_accounts import load_accounts
 
 ECHO_STYLE = fg("blue") + attr("bold")
 DB_NAME = "fsd_account_store_dev"
@@ -34,7 +49,7 @@ def bootstrap_dev_db(c, database_host="localhost"):
 @task
 def seed_local_account_store(c):
     with _env_var("FLASK_ENV", "development"):
-        with connexionapp.app.app_context():
+        with create_flask_app().app_context():
             from db import db
 
             LEAD_ASSESSOR = "lead_assessor@example.com"
@@ -74,3 +89,113 @@ def seed_local_account_store(c):
 
             db.session.bulk_save_objects(roles_to_add)
             db.session.commit()
+
+
+@task
+def import_accounts(c, path, file_format=None):
+    """Load accounts and roles from a CSV or JSONL file with COPY"""
+    with _env_var("FLASK_ENV", "development"):
+        with create_flask_app().app_context():
+            from db import db
+
+            connection = db.engine.raw_connection()
+            try:
+                with open(path, newline="") as file:
+                    load_accounts(
+                        connection,
+                        READERS[file_format or file_format_of(path)](file),
+                        log=lambda message: print(stylize(message, ECHO_STYLE)),
+                    )
+            finally:
+                connection.close()
+
+
+@task
+def seed_benchmark_db(c, accounts=500_000, roles_per_account=6.0, seed=1, reset=False):
+    """Seed a synthetic population of accounts and roles to benchmark against"""
+    with _env_var("FLASK_ENV", "development"):
+        with create_flask_app().app_context():
+            from db import db
+
+            connection = db.engine.raw_connection()
+            try:
+                if reset:
+                    with connection.cursor() as cursor:
+                        cursor.execute("TRUNCATE role, account")
+                    connection.commit()
+                seed_population(
+                    connection,
+                    Population(int(accounts), float(roles_per_account), int(seed)),
+                    log=lambda message: print(stylize(message, ECHO_STYLE)),
+                )
+            finally:
+                connection.close()
+
+
+@task
+def benchmark(c, requests=200, operation=None, seed=1, output=None):
+    """Benchmark every api operation, or one, against the seeded db"""
+    with _env_var("FLASK_ENV", "development"):
+        with create_flask_app().app_context():
+            from db import db
+
+            connection = db.engine.raw_connection()
+            client = InProcessClient()
+            try:
+                results = run_benchmarks(
+                    connection,
+                    client,
+                    operation_ids=[operation] if operation else None,
+                    requests=int(requests),
+                    seed=int(seed),
+                    log=lambda message: print(stylize(message, ECHO_STYLE)),
+                )
+            finally:
+                client.close()
+                connection.close()
+            print(format_results(results))
+            if output:
+                write_results(results, output)
+
+
+@task
+def benchmark_compare(
+    c, update=False, latency_tolerance=0.25, statements_tolerance=0.0
+):
+    """Fail if any core.account operation has regressed against the baseline"""
+    baseline = load_baseline()
+    if baseline is None and not update:
+        raise Exit(f"There is no baseline at {BASELINE_PATH}, record one with --update")
+    with _env_var("FLASK_ENV", "development"):
+        with create_flask_app().app_context():
+            from db import db
+
+            connection = db.engine.raw_connection()
+            client = InProcessClient()
+            try:
+                results = rerun_baseline(
+                    connection,
+                    client,
+                    baseline,
+                    check_population=not update,
+                    log=lambda message: print(stylize(message, ECHO_STYLE)),
+                )
+            finally:
+                client.close()
+                connection.close()
+
+    if update:
+        write_results(results, BASELINE_PATH)
+        print(stylize(f"Updated {BASELINE_PATH}", ECHO_STYLE))
+        return
+
+    rows, regressions = compare_results(
+        baseline,
+        results,
+        latency_tolerance=float(latency_tolerance),
+        statements_tolerance=float(statements_tolerance),
+    )
+    print(format_comparison(rows))
+    if regressions:
+        raise Exit("\n".join(["", "Regressions:", *regressions]), code=1)
+    print(stylize("No regressions", ECHO_STYLE))
@@ -2,11 +2,17 @@
 Contains test configuration.
 """
 
+from unittest import mock
 from uuid import uuid4
 
 import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from app import create_app
+from config import Config
+from core.cache import account_cache
+from core.metrics import metrics
 from db.models.account import Account
 from db.models.role import Role
 
@@ -31,6 +37,71 @@ def flask_test_client():
         yield test_client
 
 
+@pytest.fixture(scope="session")
+def async_test_client():
+    """
+    Creates a test client for the app serving the api with core.account_async
+    """
+    with mock.patch.object(Config, "ASYNC_REQUEST_PATH_ENABLED", True):
+        connexion_app = create_app()
+
+    with connexion_app.test_client() as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def sql_statements():
+    """
+    Records the SQL of every statement sent to the db during a test.
+    """
+    statements = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record_statement)
+    yield statements
+    event.remove(Engine, "before_cursor_execute", record_statement)
+
+
+@pytest.fixture(autouse=True)
+def query_budget(request):
+    """
+    Fails a test marked with query_budget(n) if any request it makes runs
+    more than n db statements.
+    """
+    marker = request.node.get_closest_marker("query_budget")
+    if not marker:
+        yield
+        return
+
+    budget = marker.args[0]
+    over_budget = []
+
+    def check_budget(operation, db_stats):
+        if db_stats.statements > budget:
+            over_budget.append(f"{operation} ran {db_stats.statements}")
+
+    metrics.subscribe(check_budget)
+    yield
+    metrics.unsubscribe(check_budget)
+    if over_budget:
+        pytest.fail(
+            f"Requests exceeded the query budget of {budget} statements: "
+            + ", ".join(over_budget)
+        )
+
+
+@pytest.fixture(autouse=True)
+def clear_account_cache():
+    """
+    Tests seed and clear accounts directly in the db, so make sure no
+    cached accounts leak between tests.
+    """
+    account_cache.clear()
+    yield
+
+
 test_user_1 = {
     "email": "seeded_user_1@example.com",
     "subject_id": "subject_id_1",
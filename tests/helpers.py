@@ -5,6 +5,17 @@ from typing import List
 from deepdiff import DeepDiff
 
 
+def close_lifespan_streams(test_client):
+    """
+    Close the streams a starlette test client leaves open to the app's
+    lifespan, which otherwise warn when they're garbage collected, failing
+    whichever test is running then
+    """
+    for stream in (test_client.stream_send, test_client.stream_receive):
+        stream.send_stream.close()
+        stream.receive_stream.close()
+
+
 def expected_data_within_response(
     test_client,
     endpoint: str,
@@ -0,0 +1,164 @@
+"""
+Tests the async request path in core.account_async.
+"""
+
+import json
+import uuid
+
+import pytest
+
+assessor = {
+    "email": "async_assessor@example.com",
+    "subject_id": "async_subject_id_1",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_ASSESSOR_R1"],
+}
+commenter = {
+    "email": "async_commenter@example.com",
+    "subject_id": "async_subject_id_2",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_COMMENTER", "NSTF_LEAD_ASSESSOR"],
+}
+
+
+@pytest.mark.user_config([assessor, commenter])
+class TestAsyncAccounts:
+    def test_get_account(self, async_test_client, seed_test_data_fn):
+        response = async_test_client.get(
+            f"/accounts?email_address={commenter['email'].upper()}"
+        )
+
+        assert response.status_code == 200
+        assert response.headers["ETag"] == f'"{commenter["account_id"]}-1"'
+        assert response.json() == {
+            "account_id": str(commenter["account_id"]),
+            "email_address": commenter["email"],
+            "azure_ad_subject_id": commenter["subject_id"],
+            "full_name": None,
+            "roles": commenter["roles"],
+            "highest_role_map": {"COF": "COMMENTER", "NSTF": "LEAD_ASSESSOR"},
+        }
+
+    def test_get_account_not_modified(self, async_test_client, seed_test_data_fn):
+        response = async_test_client.get(
+            f"/accounts?account_id={assessor['account_id']}",
+            headers={"If-None-Match": f'"{assessor["account_id"]}-1"'},
+        )
+
+        assert response.status_code == 304
+
+    def test_get_missing_account(self, async_test_client, seed_test_data_fn):
+        response = async_test_client.get(
+            "/accounts?email_address=does_not_exist@example.com"
+        )
+
+        assert response.status_code == 404
+
+    def test_bulk_accounts(self, async_test_client, seed_test_data_fn):
+        account_ids = [str(assessor["account_id"]), str(commenter["account_id"])]
+
+        get_response = async_test_client.get(
+            f"/bulk-accounts?account_id={account_ids[0]}&account_id={account_ids[1]}"
+        )
+        post_response = async_test_client.post(
+            "/bulk-accounts",
+            json={"account_ids": account_ids},
+            headers={"If-None-Match": get_response.headers["ETag"]},
+        )
+
+        assert get_response.status_code == 200
+        assert get_response.json().keys() == set(account_ids)
+        assert post_response.status_code == 304
+
+    def test_post_and_put_account(self, async_test_client, seed_test_data_fn):
+        post_response = async_test_client.post(
+            "/accounts", json={"email_address": "Async_New@example.com"}
+        )
+        account_id = post_response.json()["account_id"]
+
+        put_response = async_test_client.put(
+            f"/accounts/{account_id}",
+            json={
+                "roles": ["cof_lead_assessor"],
+                "azure_ad_subject_id": "async_subject_id_3",
+                "full_name": "Async User",
+            },
+        )
+        conflict_response = async_test_client.put(
+            f"/accounts/{account_id}",
+            json={
+                "roles": [],
+                "azure_ad_subject_id": "async_subject_id_3",
+                "email_address": assessor["email"],
+            },
+        )
+
+        assert post_response.status_code == 201
+        assert put_response.status_code == 201
+        assert put_response.headers["ETag"] == f'"{account_id}-2"'
+        assert put_response.json()["roles"] == ["COF_LEAD_ASSESSOR"]
+        assert put_response.json()["full_name"] == "Async User"
+        assert conflict_response.status_code == 401
+        assert conflict_response.json()["domain"] == "example.com"
+
+    def test_put_bulk_accounts(self, async_test_client, seed_test_data_fn):
+        response = async_test_client.put(
+            "/bulk-accounts",
+            json={
+                "accounts": [
+                    {
+                        "email_address": "async_new_user@example.com",
+                        "roles": ["COF_ASSESSOR"],
+                    },
+                    {"email_address": assessor["email"], "roles": ["COF_ASSESSOR_R1"]},
+                    {"email_address": commenter["email"], "roles": ["COF_COMMENTER"]},
+                ]
+            },
+        )
+
+        assert response.status_code == 200
+        assert [a["status"] for a in response.json()["accounts"]] == [
+            "created",
+            "unchanged",
+            "updated",
+        ]
+        assert async_test_client.get(
+            f"/accounts?account_id={commenter['account_id']}"
+        ).json()["roles"] == ["COF_COMMENTER"]
+
+    def test_accounts_for_fund(self, async_test_client, seed_test_data_fn):
+        url = "/accounts/fund/COF?round_short_name=R1&include_commenters=false"
+
+        response = async_test_client.get(url)
+        streamed_response = async_test_client.get(
+            url, headers={"Accept": "application/x-ndjson"}
+        )
+
+        assert response.status_code == streamed_response.status_code == 200
+        assert [a["account_id"] for a in response.json()] == [
+            str(assessor["account_id"])
+        ]
+        assert [
+            json.loads(line) for line in streamed_response.text.splitlines()
+        ] == response.json()
+
+    def test_search_accounts(self, async_test_client, seed_test_data_fn):
+        first_page = async_test_client.post(
+            "/accounts/search", json={"partial_roles": ["COF_"], "limit": 1}
+        ).json()
+        second_page = async_test_client.post(
+            "/accounts/search", json={"cursor": first_page["next_cursor"]}
+        ).json()
+
+        assert [a["email_address"] for a in first_page["accounts"]] == [
+            assessor["email"]
+        ]
+        assert [a["email_address"] for a in second_page["accounts"]] == [
+            commenter["email"]
+        ]
+        assert second_page["next_cursor"] is None
+
+    def test_healthcheck(self, async_test_client):
+        response = async_test_client.get("/healthcheck")
+
+        assert response.status_code == 200
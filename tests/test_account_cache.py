@@ -0,0 +1,138 @@
+"""
+Tests the per-process account cache.
+"""
+
+import uuid
+
+import pytest
+
+from core.cache import AccountCache
+from core.cache import account_cache
+from tests.conftest import test_user_1
+from tests.conftest import test_user_to_update
+
+
+def _account(email="person@example.com", subject_id="subject"):
+    return {
+        "account_id": str(uuid.uuid4()),
+        "email_address": email,
+        "azure_ad_subject_id": subject_id,
+        "full_name": None,
+        "roles": [],
+        "highest_role_map": {},
+    }
+
+
+@pytest.fixture
+def cache():
+    cache = AccountCache()
+    cache.maxsize = 2
+    cache.ttl = 30
+    yield cache
+
+
+class TestAccountCache:
+    def test_lookup_by_every_key(self, cache):
+        account = _account()
+        cache.set(account)
+
+        assert cache.get(account_id=account["account_id"]) is account
+        assert cache.get(account_id=account["account_id"].upper()) is account
+        assert cache.get(email_address="person@example.com") is account
+        assert cache.get(azure_ad_subject_id="subject") is account
+        assert cache.stats()["hits"] == 4
+
+    def test_lookup_with_version(self, cache):
+        account = _account()
+        cache.set(account, version=3)
+
+        assert cache.get_versioned(email_address="person@example.com") == (
+            account,
+            3,
+        )
+
+    def test_mismatched_keys_miss(self, cache):
+        account = _account()
+        cache.set(account)
+
+        assert (
+            cache.get(
+                account_id=account["account_id"],
+                email_address="someone-else@example.com",
+            )
+            is None
+        )
+        assert cache.stats()["misses"] == 1
+
+    def test_least_recently_used_is_evicted(self, cache):
+        first, second, third = (
+            _account(f"person{i}@example.com", f"subject{i}") for i in range(3)
+        )
+        cache.set(first)
+        cache.set(second)
+        cache.get(account_id=first["account_id"])
+        cache.set(third)
+
+        assert cache.get(account_id=second["account_id"]) is None
+        assert cache.get(email_address="person1@example.com") is None
+        assert cache.get(account_id=first["account_id"]) is first
+        assert cache.get(account_id=third["account_id"]) is third
+        assert cache.stats()["evictions"] == 1
+
+    def test_expired_entries_miss(self, cache, mocker):
+        monotonic = mocker.patch("core.cache.time.monotonic", return_value=100)
+        account = _account()
+        cache.set(account)
+
+        monotonic.return_value = 131
+
+        assert cache.get(account_id=account["account_id"]) is None
+        assert cache.stats()["expirations"] == 1
+        assert cache.stats()["size"] == 0
+
+    def test_invalidate_by_secondary_key(self, cache):
+        account = _account()
+        cache.set(account)
+
+        cache.invalidate(azure_ad_subject_id="subject")
+
+        assert cache.get(email_address="person@example.com") is None
+        assert cache.stats()["size"] == 0
+
+    def test_disabled_cache_stores_nothing(self, cache):
+        cache.ttl = 0
+        cache.set(_account())
+
+        assert cache.stats()["size"] == 0
+
+
+class TestAccountCacheEndpoints:
+    def test_get_account_is_served_from_cache(self, flask_test_client, seed_test_data):
+        url = f"/accounts?account_id={test_user_1['account_id']}"
+        # Clearing the shared cache between tests keeps its counts
+        hits = account_cache.stats()["hits"]
+
+        first_response = flask_test_client.get(url)
+        second_response = flask_test_client.get(
+            f"/accounts?email_address={test_user_1['email']}"
+        )
+
+        assert first_response.status_code == second_response.status_code == 200
+        assert first_response.json() == second_response.json()
+        assert account_cache.stats()["hits"] == hits + 1
+
+    def test_put_account_invalidates_cache(self, flask_test_client, seed_test_data):
+        url = f"/accounts?account_id={test_user_to_update['account_id']}"
+        flask_test_client.get(url)
+
+        flask_test_client.put(
+            f"/accounts/{test_user_to_update['account_id']}",
+            json={
+                "roles": ["COF_LEAD_ASSESSOR"],
+                "azure_ad_subject_id": test_user_to_update["subject_id"],
+            },
+        )
+        response = flask_test_client.get(url)
+
+        assert response.status_code == 200
+        assert response.json()["roles"] == ["COF_LEAD_ASSESSOR"]
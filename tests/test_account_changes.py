@@ -0,0 +1,181 @@
+"""
+Tests the changes endpoint, which clients keeping a copy of the accounts use
+to fetch the accounts changed since they last synced.
+"""
+
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+from core.changes import change_pages
+from db.models.account import Account
+from db.models.account_change import AccountChange
+from db.models.role import Role
+from tests.conftest import create_user_with_roles
+
+test_user_1 = {
+    "email": "changes_user_1@example.com",
+    "subject_id": "changes_subject_id_1",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_ASSESSOR"],
+}
+test_user_2 = {
+    "email": "changes_user_2@example.com",
+    "subject_id": "changes_subject_id_2",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_COMMENTER"],
+}
+
+
+@pytest.fixture(params=["flask_test_client", "async_test_client"])
+def test_client(request, _db, app):
+    # Start each test with an empty change log
+    with app.app_context():
+        _db.session.query(AccountChange).delete()
+        _db.session.commit()
+    yield request.getfixturevalue(request.param)
+
+
+@pytest.fixture
+def seeded_accounts(app, _db, clear_test_data):
+    # Only this module's accounts are removed afterwards, as seeded_accounts
+    # would also remove those of the session scoped seed_test_data
+    for user in (test_user_1, test_user_2):
+        create_user_with_roles(user, _db)
+    yield
+    account_ids = select(Account.id).filter(Account.email.like("changes_%"))
+    Role.query.filter(Role.account_id.in_(account_ids)).delete()
+    Account.query.filter(Account.id.in_(account_ids)).delete()
+    _db.session.commit()
+
+
+def _changes(test_client, **params):
+    response = test_client.get("/accounts/changes", params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def _changed_account_ids(page):
+    return [change["account_id"] for change in page["changes"]]
+
+
+class TestAccountChanges:
+    def test_returns_every_changed_account(self, test_client, seeded_accounts):
+        page = _changes(test_client)
+
+        assert _changed_account_ids(page) == [
+            str(test_user_1["account_id"]),
+            str(test_user_2["account_id"]),
+        ]
+        assert page["changes"][0]["deleted"] is False
+        assert page["changes"][0]["account"]["email_address"] == test_user_1["email"]
+        assert page["changes"][0]["account"]["roles"] == test_user_1["roles"]
+        assert page["has_more"] is False
+
+    def test_returns_changes_since_the_cursor(self, test_client, seeded_accounts):
+        cursor = _changes(test_client)["next_cursor"]
+
+        response = test_client.put(
+            f"/accounts/{test_user_2['account_id']}",
+            json={
+                "email_address": test_user_2["email"],
+                "azure_ad_subject_id": test_user_2["subject_id"],
+                "full_name": "Changed User",
+                "roles": ["COF_LEAD_ASSESSOR"],
+            },
+        )
+        assert response.status_code == 201
+
+        page = _changes(test_client, since=cursor)
+        assert _changed_account_ids(page) == [str(test_user_2["account_id"])]
+        assert page["changes"][0]["account"]["full_name"] == "Changed User"
+        assert page["changes"][0]["account"]["roles"] == ["COF_LEAD_ASSESSOR"]
+
+        # Nothing has changed since
+        assert _changes(test_client, since=page["next_cursor"]) == {
+            "changes": [],
+            "next_cursor": page["next_cursor"],
+            "has_more": False,
+        }
+
+    def test_returns_deleted_accounts(self, test_client, seeded_accounts, _db):
+        cursor = _changes(test_client)["next_cursor"]
+
+        Role.query.filter_by(account_id=test_user_1["account_id"]).delete()
+        Account.query.filter_by(id=test_user_1["account_id"]).delete()
+        _db.session.commit()
+
+        assert _changes(test_client, since=cursor)["changes"] == [
+            {
+                "account_id": str(test_user_1["account_id"]),
+                "deleted": True,
+                "account": None,
+            }
+        ]
+
+    def test_pages_through_the_changes(self, test_client, seeded_accounts):
+        # Each seeded account is changed twice, once creating it and once
+        # adding its roles
+        first_page = _changes(test_client, limit=2)
+        second_page = _changes(test_client, limit=2, since=first_page["next_cursor"])
+
+        assert _changed_account_ids(first_page) == [str(test_user_1["account_id"])]
+        assert first_page["has_more"] is True
+        assert _changed_account_ids(second_page) == [str(test_user_2["account_id"])]
+        assert second_page["has_more"] is False
+
+    def test_waits_for_running_transactions(self, test_client, seeded_accounts, _db):
+        cursor = _changes(test_client)["next_cursor"]
+        account_id = uuid.uuid4()
+
+        with _db.engine.connect() as connection:
+            connection.execute(
+                Account.__table__.insert().values(
+                    id=account_id, email="changes_running@example.com"
+                )
+            )
+            # Committed after the running transaction started
+            account = _db.session.get(Account, test_user_1["account_id"])
+            account.full_name = "Committed User"
+            _db.session.commit()
+
+            # So it could be committed before it, and isn't returned yet
+            assert _changes(test_client, since=cursor)["changes"] == []
+
+            connection.commit()
+
+        assert _changed_account_ids(_changes(test_client, since=cursor)) == [
+            str(account_id),
+            str(test_user_1["account_id"]),
+        ]
+
+    def test_updates_updated_at(self, seeded_accounts, _db):
+        account = _db.session.get(Account, test_user_1["account_id"])
+        created_at = account.updated_at
+
+        account.full_name = "Updated User"
+        _db.session.commit()
+
+        assert _db.session.get(Account, test_user_1["account_id"]).updated_at > (
+            created_at
+        )
+
+
+def test_change_pages(test_client, seeded_accounts, _db):
+    pages = list(change_pages(_db.session, None, 2))
+
+    # Each seeded account is changed twice, once creating it and once adding
+    # its roles, so each page holds one account
+    assert [[change["account_id"] for _, change in page] for page in pages] == [
+        [str(test_user_1["account_id"])],
+        [str(test_user_2["account_id"])],
+    ]
+    assert list(change_pages(_db.session, pages[0][-1][0], 2)) == pages[1:]
+
+
+@pytest.mark.parametrize("since", ["not a cursor", "MTIz", "YS5i"])
+def test_invalid_cursor(test_client, since):
+    response = test_client.get("/accounts/changes", params={"since": since})
+
+    assert response.status_code == 400
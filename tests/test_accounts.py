@@ -2,9 +2,16 @@
 Tests the GET and POST functionality of our api.
 """
 
+import json
 import uuid
+from unittest import mock
 
 import pytest
+from sqlalchemy import text
+
+from core.account import _search_accounts_statement
+from core.account import parse_domain
+from core.cache import account_cache
 
 from tests.conftest import test_user_1
 from tests.conftest import test_user_2
@@ -12,6 +19,7 @@ from tests.conftest import test_user_to_update
 from tests.helpers import expected_data_within_response
 
 
+@pytest.mark.query_budget(2)
 class TestAccountsPost:
     def test_create_account_with_email(self, flask_test_client, clear_test_data):
         """
@@ -129,6 +137,7 @@ class TestAccountsPost:
         assert second_response.status_code == 409
 
 
+@pytest.mark.query_budget(2)
 class TestAccountsGet:
     @pytest.mark.parametrize(
         "url_params_map, expected_status_code, expected_user_result",
@@ -219,7 +228,27 @@ class TestAccountsGet:
             assert user_in_response
             assert user_in_response["email_address"] == expected_user["email"]
 
+    def test_post_bulk_accounts(self, flask_test_client, seed_test_data):
+        account_ids = [
+            str(test_user_1["account_id"]),
+            str(test_user_2["account_id"]),
+            "ca69e0c8-0000-0000-0000-177038a16e56",
+        ]
+        response = flask_test_client.post(
+            "/bulk-accounts", json={"account_ids": account_ids}
+        )
+
+        assert response.status_code == 200
+        assert response.json().keys() == set(account_ids[:2])
+        assert response.json()[account_ids[0]]["roles"] == test_user_1["roles"]
+
+    def test_post_bulk_accounts_requires_ids(self, flask_test_client):
+        response = flask_test_client.post("/bulk-accounts", json={"account_ids": []})
 
+        assert response.status_code == 400
+
+
+@pytest.mark.query_budget(4)
 class TestAccountsPut:
     test_email_1 = "person1@example.com"
     test_email_2 = "person2@example.com"
@@ -368,6 +397,35 @@ class TestAccountsPut:
         assert update_response.json()["domain"] == "example.com"
 
 
+class TestBulkAccountsQueries:
+    @pytest.mark.query_budget(2)
+    @pytest.mark.user_config(
+        [
+            {
+                "email": f"bulk_user_{i}@example.com",
+                "subject_id": f"bulk_subject_id_{i}",
+                "account_id": uuid.uuid4(),
+                "roles": ["COF_ASSESSOR", "NSTF_COMMENTER"],
+            }
+            for i in range(20)
+        ]
+    )
+    def test_bulk_accounts_query_count_is_constant(
+        self, flask_test_client, seed_test_data_fn, sql_statements
+    ):
+        account_ids = [str(user["account_id"]) for user in seed_test_data_fn]
+
+        response = flask_test_client.post(
+            "/bulk-accounts", json={"account_ids": account_ids}
+        )
+
+        assert response.status_code == 200
+        assert len(response.json()) == 20
+        assert all(len(a["roles"]) == 2 for a in response.json().values())
+        assert len(sql_statements) == 2
+
+
+@pytest.mark.query_budget(2)
 class TestGetAccountsForFund:
     @pytest.mark.user_config(
         [
@@ -450,12 +508,86 @@ class TestGetAccountsForFund:
         assert len(response.json()) == 1  # Only the commenter should be returned
         assert all("COMMENTER" in role for role in response.json()[0]["roles"])
 
+    @pytest.mark.user_config(
+        [
+            {
+                "email": "assessor@example.com",
+                "subject_id": "1",
+                "account_id": uuid.uuid4(),
+                "roles": ["COF_ASSESSOR_R10"],
+            },
+            {
+                "email": "otherfund@example.com",
+                "subject_id": "2",
+                "account_id": uuid.uuid4(),
+                "roles": ["COFX_ASSESSOR_R1"],
+            },
+        ]
+    )
+    def test_fund_and_round_must_match_exactly(
+        self, flask_test_client, seed_test_data_fn
+    ):
+        response = flask_test_client.get("/accounts/fund/COF?round_short_name=R1")
+        assert response.status_code == 404
+
+        response = flask_test_client.get("/accounts/fund/COF?round_short_name=R10")
+        assert response.status_code == 200
+        assert [account["email_address"] for account in response.json()] == [
+            "assessor@example.com"
+        ]
+
     @pytest.mark.user_config([])  # No users configured
     def test_no_matching_accounts(self, flask_test_client, seed_test_data_fn):
         response = flask_test_client.get("/accounts/fund/unknownfund")
         assert response.status_code == 404
         assert response.json() == {"error": "No matching accounts found"}
 
+    @pytest.mark.user_config(
+        [
+            {
+                "email": "assessor@example.com",
+                "subject_id": "1",
+                "account_id": uuid.uuid4(),
+                "roles": ["COF_ASSESSOR_R1", "COF_COMMENTER_R1"],
+            },
+            {
+                "email": "commenter@example.com",
+                "subject_id": "2",
+                "account_id": uuid.uuid4(),
+                "roles": ["COF_COMMENTER_R1"],
+            },
+            {
+                "email": "otherfund@example.com",
+                "subject_id": "3",
+                "account_id": uuid.uuid4(),
+                "roles": ["HSRA_ASSESSOR_R1"],
+            },
+        ]
+    )
+    def test_streamed_retrieval(self, flask_test_client, seed_test_data_fn):
+        response = flask_test_client.get(
+            "/accounts/fund/COF", headers={"Accept": "application/x-ndjson"}
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "application/x-ndjson"
+        accounts = [json.loads(line) for line in response.text.splitlines()]
+        assert sorted(account["email_address"] for account in accounts) == [
+            "assessor@example.com",
+            "commenter@example.com",
+        ]
+        assert {account["account_id"] for account in accounts} == {
+            account["account_id"]
+            for account in flask_test_client.get("/accounts/fund/COF").json()
+        }
+
+    @pytest.mark.user_config([])  # No users configured
+    def test_streamed_no_matching_accounts(self, flask_test_client, seed_test_data_fn):
+        response = flask_test_client.get(
+            "/accounts/fund/unknownfund", headers={"Accept": "application/x-ndjson"}
+        )
+        assert response.status_code == 404
+        assert response.json() == {"error": "No matching accounts found"}
+
     @pytest.mark.user_config(
         [
             {
@@ -476,6 +608,7 @@ class TestGetAccountsForFund:
         }
 
 
+@pytest.mark.query_budget(2)
 @pytest.mark.user_config(
     [
         {
@@ -563,6 +696,33 @@ class TestAccountSearch:
         assert accounts[0]["email_address"] == "assessor-1@example.com"
         assert accounts[1]["email_address"] == "assessor-2@communities.gov.uk"
 
+    def test_search_all_accounts_by_roles_with_wildcards(
+        self, flask_test_client, seed_test_data_fn
+    ):
+        response = flask_test_client.post(
+            "/accounts/search", json={"roles": ["COF_ASSESSOR_%"]}
+        )
+
+        assert response.status_code == 200
+        assert [account["email_address"] for account in response.json()] == [
+            "assessor-1@example.com",
+            "assessor-3@communities.gov.uk",
+        ]
+
+    def test_search_returns_each_account_once(
+        self, flask_test_client, seed_test_data_fn
+    ):
+        # assessor-3 has two roles matching each filter
+        for body in ({"roles": ["COF_%"]}, {"partial_roles": ["COF"]}):
+            response = flask_test_client.post("/accounts/search", json=body)
+
+            assert response.status_code == 200
+            assert [account["email_address"] for account in response.json()] == [
+                "assessor-1@example.com",
+                "assessor-2@communities.gov.uk",
+                "assessor-3@communities.gov.uk",
+            ]
+
     def test_search_all_accounts_by_roles_case_sensitive(
         self, flask_test_client, seed_test_data_fn
     ):
@@ -631,3 +791,357 @@ class TestAccountSearch:
         )
 
         assert response.status_code == 400
+
+    def test_search_accounts_paginated(self, flask_test_client, seed_test_data_fn):
+        first_page = flask_test_client.post("/accounts/search", json={"limit": 3})
+
+        assert first_page.status_code == 200
+        assert [
+            account["email_address"] for account in first_page.json()["accounts"]
+        ] == [
+            "assessor-1@example.com",
+            "assessor-2@communities.gov.uk",
+            "assessor-3@communities.gov.uk",
+        ]
+        assert first_page.json()["next_cursor"]
+
+        second_page = flask_test_client.post(
+            "/accounts/search",
+            json={"limit": 3, "cursor": first_page.json()["next_cursor"]},
+        )
+
+        assert second_page.status_code == 200
+        assert [
+            account["email_address"] for account in second_page.json()["accounts"]
+        ] == ["section-151@communities.gov.uk"]
+        assert second_page.json()["next_cursor"] is None
+
+    def test_search_accounts_paginated_with_filters(
+        self, flask_test_client, seed_test_data_fn
+    ):
+        response = flask_test_client.post(
+            "/accounts/search",
+            json={"email_domain": "communities.gov.uk", "limit": 2},
+        )
+
+        assert response.status_code == 200
+        assert len(response.json()["accounts"]) == 2
+        assert response.json()["next_cursor"]
+
+    def test_search_accounts_invalid_cursor(self, flask_test_client, seed_test_data_fn):
+        response = flask_test_client.post(
+            "/accounts/search", json={"limit": 2, "cursor": "not a cursor"}
+        )
+
+        assert response.status_code == 400
+
+
+class TestAccountSearchIndexes:
+    @pytest.mark.parametrize(
+        "search, expected_index",
+        [
+            ({"email_domain": "communities.gov.uk"}, "ix_account_email_domain"),
+            ({"partial_roles": ["ASSESSOR", "R1"]}, "ix_role_role_trgm"),
+        ],
+    )
+    def test_search_uses_index(self, app, _db, clear_test_data, search, expected_index):
+        with app.test_request_context():
+            statement = _search_accounts_statement(**search)
+            compiled = statement.compile(dialect=_db.engine.dialect)
+            # The tables are tiny in tests, so stop the planner preferring to
+            # scan them in full, either directly or in email order
+            _db.session.execute(text("SET LOCAL enable_seqscan = off"))
+            _db.session.execute(text("SET LOCAL enable_indexscan = off"))
+            plan = "\n".join(
+                _db.session.connection()
+                .exec_driver_sql(f"EXPLAIN {compiled}", compiled.params)
+                .scalars()
+            )
+            _db.session.rollback()
+
+        assert expected_index in plan
+
+
+@pytest.mark.query_budget(4)
+class TestConditionalGet:
+    def test_get_account_returns_etag(self, flask_test_client, seed_test_data_fn):
+        url = f"/accounts?account_id={test_user_1['account_id']}"
+        response = flask_test_client.get(url)
+
+        assert response.status_code == 200
+        assert response.headers["ETag"] == f'"{test_user_1["account_id"]}-1"'
+
+    @pytest.mark.parametrize("cached", [True, False])
+    def test_get_account_not_modified(
+        self, flask_test_client, seed_test_data_fn, cached
+    ):
+        url = f"/accounts?email_address={test_user_1['email']}"
+        etag = flask_test_client.get(url).headers["ETag"]
+        if not cached:
+            account_cache.clear()
+
+        response = flask_test_client.get(url, headers={"If-None-Match": etag})
+
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.content == b""
+
+    def test_get_account_not_modified_still_404s(
+        self, flask_test_client, seed_test_data_fn
+    ):
+        response = flask_test_client.get(
+            "/accounts?email_address=does_not_exist@example.com",
+            headers={"If-None-Match": "*"},
+        )
+
+        assert response.status_code == 404
+
+    def test_put_account_changes_etag(self, flask_test_client, seed_test_data_fn):
+        url = f"/accounts?account_id={test_user_to_update['account_id']}"
+        etag = flask_test_client.get(url).headers["ETag"]
+
+        put_response = flask_test_client.put(
+            f"/accounts/{test_user_to_update['account_id']}",
+            json={
+                "roles": ["COF_ASSESSOR"],
+                "azure_ad_subject_id": test_user_to_update["subject_id"],
+            },
+        )
+        response = flask_test_client.get(url, headers={"If-None-Match": etag})
+
+        assert put_response.headers["ETag"] != etag
+        assert response.status_code == 200
+        assert response.headers["ETag"] == put_response.headers["ETag"]
+        assert response.json()["roles"] == ["COF_ASSESSOR"]
+
+    def test_bulk_accounts_not_modified(self, flask_test_client, seed_test_data_fn):
+        account_ids = [str(test_user_1["account_id"]), str(test_user_2["account_id"])]
+        response = flask_test_client.post(
+            "/bulk-accounts", json={"account_ids": account_ids}
+        )
+        etag = response.headers["ETag"]
+
+        get_response = flask_test_client.get(
+            f"/bulk-accounts?account_id={account_ids[1]}&account_id={account_ids[0]}",
+            headers={"If-None-Match": etag},
+        )
+        other_response = flask_test_client.post(
+            "/bulk-accounts",
+            json={"account_ids": account_ids[:1]},
+            headers={"If-None-Match": etag},
+        )
+
+        assert get_response.status_code == 304
+        assert other_response.status_code == 200
+        assert other_response.headers["ETag"] != etag
+
+
+@pytest.mark.query_budget(4)
+@pytest.mark.user_config(
+    [
+        {
+            "email": "role_diff_user@example.com",
+            "subject_id": "role_diff_subject_id",
+            "account_id": uuid.uuid4(),
+            "roles": ["COF_ASSESSOR", "NSTF_COMMENTER"],
+        }
+    ]
+)
+class TestAccountsPutRoleDiff:
+    def test_only_changed_roles_are_written(
+        self, flask_test_client, _db, seed_test_data_fn, sql_statements
+    ):
+        user = seed_test_data_fn[0]
+        kept_role_id = _db.session.scalar(
+            text("SELECT id FROM role WHERE role = 'NSTF_COMMENTER'")
+        )
+        _db.session.commit()
+        sql_statements.clear()
+
+        response = flask_test_client.put(
+            f"/accounts/{user['account_id']}",
+            json={
+                "roles": ["nstf_commenter", "CTDF_LEAD_ASSESSOR", "NSTF_COMMENTER"],
+                "azure_ad_subject_id": user["subject_id"],
+                "full_name": "Role Diff",
+            },
+        )
+
+        assert response.status_code == 201
+        assert response.json()["roles"] == ["NSTF_COMMENTER", "CTDF_LEAD_ASSESSOR"]
+        assert response.json()["full_name"] == "Role Diff"
+        assert response.headers["ETag"] == f'"{user["account_id"]}-2"'
+        assert [statement.split()[0] for statement in sql_statements] == [
+            "SELECT",
+            "UPDATE",
+            "DELETE",
+            "INSERT",
+        ]
+        assert _db.session.execute(
+            text("SELECT id, role FROM role ORDER BY role")
+        ).all() == [
+            (mock.ANY, "CTDF_LEAD_ASSESSOR"),
+            (kept_role_id, "NSTF_COMMENTER"),
+        ]
+
+    def test_unchanged_account_is_not_written(
+        self, flask_test_client, seed_test_data_fn, sql_statements
+    ):
+        user = seed_test_data_fn[0]
+
+        response = flask_test_client.put(
+            f"/accounts/{user['account_id']}",
+            json={
+                "roles": ["NSTF_COMMENTER", "COF_ASSESSOR"],
+                "azure_ad_subject_id": user["subject_id"],
+                "email_address": user["email"],
+            },
+        )
+
+        assert response.status_code == 201
+        assert response.json()["roles"] == ["NSTF_COMMENTER", "COF_ASSESSOR"]
+        assert response.headers["ETag"] == f'"{user["account_id"]}-1"'
+        assert [statement.split()[0] for statement in sql_statements] == ["SELECT"]
+
+
+upsert_user_to_update = {
+    "email": "upsert_user_to_update@example.com",
+    "subject_id": "upsert_subject_id_1",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_ASSESSOR", "NSTF_COMMENTER"],
+}
+upsert_user_unchanged = {
+    "email": "upsert_user_unchanged@example.com",
+    "subject_id": "upsert_subject_id_2",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_ASSESSOR"],
+}
+
+
+@pytest.mark.query_budget(7)
+@pytest.mark.user_config([upsert_user_to_update, upsert_user_unchanged])
+class TestPutBulkAccounts:
+    def test_put_bulk_accounts(
+        self, flask_test_client, seed_test_data_fn, sql_statements
+    ):
+        response = flask_test_client.put(
+            "/bulk-accounts",
+            json={
+                "accounts": [
+                    {
+                        "email_address": "Upsert_New_User@example.com",
+                        "full_name": "New User",
+                        "roles": ["cof_commenter", "COF_COMMENTER"],
+                    },
+                    {
+                        "email_address": upsert_user_to_update["email"],
+                        "roles": ["NSTF_COMMENTER", "CTDF_LEAD_ASSESSOR"],
+                    },
+                    {
+                        "email_address": upsert_user_unchanged["email"],
+                        "azure_ad_subject_id": upsert_user_unchanged["subject_id"],
+                        "roles": ["COF_ASSESSOR"],
+                    },
+                    {
+                        "email_address": "upsert_clash@example.com",
+                        "azure_ad_subject_id": upsert_user_to_update["subject_id"],
+                        "roles": ["COF_ASSESSOR"],
+                    },
+                ]
+            },
+        )
+
+        assert response.status_code == 200
+        results = response.json()["accounts"]
+        assert [(r["email_address"], r["status"]) for r in results] == [
+            ("upsert_new_user@example.com", "created"),
+            (upsert_user_to_update["email"], "updated"),
+            (upsert_user_unchanged["email"], "unchanged"),
+            ("upsert_clash@example.com", "error"),
+        ]
+        assert results[1]["account_id"] == str(upsert_user_to_update["account_id"])
+        assert results[2]["account_id"] == str(upsert_user_unchanged["account_id"])
+        assert "account_id" not in results[3]
+        # The statements don't depend on how many accounts are upserted
+        assert len(sql_statements) == 7
+
+        new_user = flask_test_client.get(
+            f"/accounts?account_id={results[0]['account_id']}"
+        )
+        assert new_user.headers["ETag"] == f'"{results[0]["account_id"]}-1"'
+        assert new_user.json()["full_name"] == "New User"
+        assert new_user.json()["roles"] == ["COF_COMMENTER"]
+        updated_user = flask_test_client.get(
+            f"/accounts?account_id={upsert_user_to_update['account_id']}"
+        )
+        assert updated_user.headers["ETag"] == (
+            f'"{upsert_user_to_update["account_id"]}-2"'
+        )
+        assert sorted(updated_user.json()["roles"]) == [
+            "CTDF_LEAD_ASSESSOR",
+            "NSTF_COMMENTER",
+        ]
+        unchanged_user = flask_test_client.get(
+            f"/accounts?account_id={upsert_user_unchanged['account_id']}"
+        )
+        assert unchanged_user.headers["ETag"] == (
+            f'"{upsert_user_unchanged["account_id"]}-1"'
+        )
+
+    def test_put_bulk_accounts_updates_full_name(
+        self, flask_test_client, seed_test_data_fn
+    ):
+        response = flask_test_client.put(
+            "/bulk-accounts",
+            json={
+                "accounts": [
+                    {
+                        "email_address": upsert_user_unchanged["email"].upper(),
+                        "full_name": "Renamed User",
+                        "roles": ["COF_ASSESSOR"],
+                    }
+                ]
+            },
+        )
+
+        assert response.json()["accounts"][0]["status"] == "updated"
+        account = flask_test_client.get(
+            f"/accounts?account_id={upsert_user_unchanged['account_id']}"
+        )
+        assert account.json()["full_name"] == "Renamed User"
+        assert (
+            account.json()["azure_ad_subject_id"]
+            == (upsert_user_unchanged["subject_id"])
+        )
+        assert account.headers["ETag"] == (f'"{upsert_user_unchanged["account_id"]}-2"')
+
+    def test_put_bulk_accounts_rejects_duplicate_emails(
+        self, flask_test_client, seed_test_data_fn
+    ):
+        account = {"email_address": "duplicate@example.com", "roles": []}
+
+        response = flask_test_client.put(
+            "/bulk-accounts",
+            json={
+                "accounts": [
+                    account,
+                    {**account, "email_address": "DUPLICATE@example.com"},
+                ]
+            },
+        )
+
+        assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "email, domain",
+    [
+        ("person@example.com", "example.com"),
+        ("person@Example.COM", "example.com"),
+        ("a@b@c", None),
+        ("person@not a domain", None),
+        ("no-domain", None),
+    ],
+)
+def test_parse_domain(email, domain):
+    assert parse_domain(email) == domain
@@ -0,0 +1,211 @@
+"""
+Tests the benchmark suite in benchmarks, on a small population.
+"""
+
+import random
+
+import pytest
+from fsd_utils.authentication.utils import get_highest_role_map
+
+from app import create_app
+from benchmarks.compare import compare_results
+from benchmarks.compare import format_comparison
+from benchmarks.compare import gated_operation_ids
+from benchmarks.compare import load_baseline
+from benchmarks.compare import rerun_baseline
+from benchmarks.operations import OPERATIONS
+from benchmarks.operations import Sample
+from benchmarks.operations import spec_operation_ids
+from benchmarks.population import Population
+from benchmarks.population import seed_population
+from benchmarks.run import InProcessClient
+from benchmarks.run import format_results
+from benchmarks.run import percentile
+from benchmarks.run import run_benchmarks
+
+
+@pytest.fixture
+def connection(_db):
+    connection = _db.engine.raw_connection()
+    yield connection
+    connection.close()
+
+
+def test_every_operation_has_a_benchmark():
+    assert sorted(spec_operation_ids()) == sorted(OPERATIONS)
+
+
+def test_population_is_reproducible():
+    accounts = list(Population(200, 6, seed=7))
+
+    assert accounts == list(Population(200, 6, seed=7))
+    assert accounts != list(Population(200, 6, seed=8))
+    assert len({account[1] for account in accounts}) == 200
+    assert any(account[1] != account[1].lower() for account in accounts)
+    assert any(account[3] is None for account in accounts)
+    # Roles are skewed: most accounts hold a few, some hold many
+    role_counts = sorted(len(account[4]) for account in accounts)
+    assert role_counts[len(role_counts) // 2] < role_counts[-1] / 2
+    for account in accounts:
+        get_highest_role_map(account[4])
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([1, 2, 3, 4], 100) == 4
+
+
+def population(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT account.email, account.version, role.id, role.role "
+            "FROM account LEFT JOIN role ON role.account_id = account.id "
+            "ORDER BY account.email, role.id"
+        )
+        rows = cursor.fetchall()
+    connection.rollback()
+    return rows
+
+
+@pytest.mark.user_config([])
+def test_run_benchmarks(_db, seed_test_data_fn, connection):
+    added = seed_population(
+        connection, Population(100, 4, seed=1), log=lambda message: None
+    )
+    seeded = population(connection)
+    client = InProcessClient(create_app())
+    try:
+        results = run_benchmarks(
+            connection,
+            client,
+            requests=3,
+            warmup_requests=1,
+            sample_size=100,
+            log=lambda message: None,
+        )
+    finally:
+        client.close()
+
+    assert results["meta"]["population"] == {
+        "accounts": added[0],
+        "roles": added[1],
+    }
+    assert list(results["operations"]) == spec_operation_ids()
+    for operation_id, result in results["operations"].items():
+        assert result["errors"] == 0, (operation_id, result["status_codes"])
+        assert result["requests"] >= 1
+        assert result["latency_ms"]["p95"] > 0
+        assert result["db_statements"]["max"] >= 1
+    assert "core.account.put_bulk_accounts" in format_results(results)
+
+    # Updated accounts are restored, and accounts created are removed
+    assert population(connection) == seeded
+
+
+def test_requests_are_reproducible():
+    sample = Sample(
+        [
+            ("id-1", "a@example.com", "subject-1", ["COF_ASSESSOR"]),
+            ("id-2", "B@Example.com", None, ["NSTF_COMMENTER_R2"]),
+        ],
+        [("COF", None), ("NSTF", "R2")],
+    )
+
+    for operation_id, build_request in OPERATIONS.items():
+        first = build_request(random.Random(1), sample, 0)
+        second = build_request(random.Random(1), sample, 0)
+        assert vars(first) == vars(second), operation_id
+    assert sample.writable_accounts == [sample.accounts[0]]
+    assert sample.email_domains == ["example.com"]
+
+
+def operation_result(p95_ms, p95_statements, errors=0):
+    return {
+        "errors": errors,
+        "status_codes": {"200": 10 - errors, "500": errors} if errors else {"200": 10},
+        "latency_ms": {"p95": p95_ms},
+        "db_statements": {"p95": p95_statements},
+    }
+
+
+def test_compare_results():
+    baseline = {
+        "operations": {
+            "core.account.get_account": operation_result(10, 2),
+            "core.account.put_account": operation_result(20, 4),
+            "core.account.search_accounts": operation_result(100, 2),
+        }
+    }
+    results = {
+        "operations": {
+            "core.account.get_account": operation_result(12, 2),
+            "core.account.put_account": operation_result(30, 5),
+            "core.account.search_accounts": operation_result(50, 2, errors=1),
+            "core.account.post_account": operation_result(5, 1),
+        }
+    }
+
+    rows, regressions = compare_results(baseline, results, latency_tolerance=0.25)
+
+    assert regressions == [
+        "core.account.put_account p95 ms went from 20 to 30, +50% against a "
+        "tolerance of +25%",
+        "core.account.put_account stmts p95 went from 4 to 5, +25% against a "
+        "tolerance of +0%",
+        "core.account.search_accounts had 1 errors, {'200': 9, '500': 1}",
+    ]
+    assert [row[-1] for row in rows] == [
+        "",
+        "",
+        "REGRESSED",
+        "REGRESSED",
+        "",
+        "",
+        "NEW",
+    ]
+    table = format_comparison(rows).splitlines()
+    assert table[1].split() == [
+        "core.account.get_account",
+        "p95",
+        "ms",
+        "10",
+        "12",
+        "+20.0%",
+    ]
+
+    assert compare_results(
+        baseline, results, latency_tolerance=0.6, statements_tolerance=0.3
+    )[1] == ["core.account.search_accounts had 1 errors, {'200': 9, '500': 1}"]
+
+
+def test_compare_results_missing_operation():
+    baseline = {"operations": {"core.account.get_account": operation_result(10, 2)}}
+
+    assert compare_results(baseline, {"operations": {}})[1] == [
+        "core.account.get_account wasn't benchmarked"
+    ]
+
+
+def test_gated_operations_are_core_account_operations():
+    assert gated_operation_ids() == spec_operation_ids()
+    assert all(
+        operation_id.startswith("core.account.")
+        for operation_id in gated_operation_ids()
+    )
+
+
+def test_baseline_covers_every_gated_operation():
+    assert list(load_baseline()["operations"]) == gated_operation_ids()
+
+
+@pytest.mark.user_config([])
+def test_rerun_baseline_checks_the_population(_db, seed_test_data_fn, connection):
+    baseline = {
+        "meta": {"population": {"accounts": 1, "roles": 1}},
+        "operations": {},
+    }
+
+    with pytest.raises(ValueError, match="Seed the db with the same population"):
+        rerun_baseline(connection, client=None, baseline=baseline)
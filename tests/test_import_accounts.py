@@ -0,0 +1,121 @@
+"""
+Tests the COPY based account import in scripts.import_accounts.
+"""
+
+import io
+import json
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from scripts import import_accounts
+from scripts.import_accounts import load_accounts
+from scripts.import_accounts import read_csv
+from scripts.import_accounts import read_jsonl
+
+existing_user = {
+    "email": "import_existing@example.com",
+    "subject_id": "import_subject_id_1",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_ASSESSOR"],
+}
+unchanged_user = {
+    "email": "import_unchanged@example.com",
+    "subject_id": "import_subject_id_2",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_COMMENTER"],
+}
+
+
+@pytest.fixture
+def connection(_db):
+    connection = _db.engine.raw_connection()
+    yield connection
+    connection.close()
+
+
+def accounts_and_roles(_db):
+    rows = _db.session.execute(
+        text(
+            "SELECT account.email, account.full_name, account.version, role.role "
+            "FROM account LEFT JOIN role ON role.account_id = account.id "
+            "ORDER BY account.email, role.role"
+        )
+    ).all()
+    _db.session.commit()
+    return [tuple(row) for row in rows]
+
+
+@pytest.mark.user_config([existing_user, unchanged_user])
+class TestImportAccounts:
+    def test_import_csv(self, _db, seed_test_data_fn, connection):
+        file = io.StringIO(
+            "email_address,full_name,azure_ad_subject_id,roles\n"
+            "Import_New@example.com,New User,,cof_assessor;COF_COMMENTER\n"
+            "import_new@example.com,,,COF_ASSESSOR\n"
+            "IMPORT_EXISTING@example.com,,,NSTF_COMMENTER\n"
+            "import_unchanged@example.com,,import_subject_id_2,COF_COMMENTER\n"
+            "import_no_roles@example.com,,,\n"
+            "import_clash@example.com,,import_subject_id_1,COF_ASSESSOR\n"
+        )
+
+        counts = load_accounts(connection, read_csv(file), log=lambda message: None)
+
+        assert counts == {
+            "rows": 6,
+            "accounts": 5,
+            "created": 2,
+            "updated": 1,
+            "skipped": 1,
+            "roles_added": 3,
+        }
+        assert accounts_and_roles(_db) == [
+            ("import_existing@example.com", None, 2, "COF_ASSESSOR"),
+            ("import_existing@example.com", None, 2, "NSTF_COMMENTER"),
+            ("import_new@example.com", "New User", 1, "COF_ASSESSOR"),
+            ("import_new@example.com", "New User", 1, "COF_COMMENTER"),
+            ("import_no_roles@example.com", None, 1, None),
+            ("import_unchanged@example.com", None, 1, "COF_COMMENTER"),
+        ]
+
+    def test_import_jsonl(self, _db, seed_test_data_fn, connection):
+        file = io.StringIO(
+            json.dumps(
+                {
+                    "email_address": existing_user["email"],
+                    "full_name": "Tab\tAnd\\Backslash",
+                    "roles": ["COF_ASSESSOR"],
+                }
+            )
+            + "\n\n"
+        )
+
+        counts = load_accounts(connection, read_jsonl(file), log=lambda message: None)
+
+        assert counts["updated"] == 1
+        assert counts["roles_added"] == 0
+        assert accounts_and_roles(_db)[0] == (
+            existing_user["email"],
+            "Tab\tAnd\\Backslash",
+            2,
+            "COF_ASSESSOR",
+        )
+
+    def test_import_reports_progress(
+        self, _db, seed_test_data_fn, connection, monkeypatch
+    ):
+        monkeypatch.setattr(import_accounts, "PROGRESS_EVERY_ROWS", 2)
+        messages = []
+
+        load_accounts(
+            connection,
+            ({"email_address": f"import_progress_{i}@example.com"} for i in range(5)),
+            log=messages.append,
+        )
+
+        assert messages[:3] == [
+            "Read 2 rows...",
+            "Read 4 rows...",
+            "Copied 5 rows into the staging table",
+        ]
@@ -0,0 +1,169 @@
+"""
+Tests the request, cache and db metrics served at /metrics, and the db
+statements reported for each request.
+"""
+
+import re
+import uuid
+
+import pytest
+from prometheus_client import REGISTRY
+
+from core.metrics import metrics
+from core.metrics import process_memory
+
+test_user = {
+    "email": "metrics_user@example.com",
+    "subject_id": "metrics_subject_id",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_ASSESSOR"],
+}
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.user_config([test_user])
+class TestRequestMetrics:
+    def test_request_is_recorded_by_operation(
+        self, flask_test_client, seed_test_data_fn
+    ):
+        labels = {"operation": "core.account.get_account"}
+        requests = _sample(
+            "http_request_duration_seconds_count", method="GET", status="200", **labels
+        )
+        db_seconds = _sample("http_request_db_seconds_sum", **labels)
+        response_bytes = _sample("http_response_size_bytes_sum", **labels)
+
+        response = flask_test_client.get(
+            f"/accounts?account_id={test_user['account_id']}"
+        )
+
+        assert response.status_code == 200
+        assert (
+            _sample(
+                "http_request_duration_seconds_count",
+                method="GET",
+                status="200",
+                **labels,
+            )
+            == requests + 1
+        )
+        assert _sample("http_request_db_seconds_sum", **labels) > db_seconds
+        assert _sample("http_response_size_bytes_sum", **labels) == (
+            response_bytes + len(response.content)
+        )
+        assert _sample("http_requests_in_flight") == 0
+
+    def test_errors_are_recorded_with_their_status(
+        self, flask_test_client, seed_test_data_fn
+    ):
+        labels = {
+            "operation": "core.account.get_account",
+            "method": "GET",
+            "status": "404",
+        }
+        not_found = _sample("http_request_duration_seconds_count", **labels)
+
+        flask_test_client.get(f"/accounts?account_id={uuid.uuid4()}")
+
+        assert _sample("http_request_duration_seconds_count", **labels) == (
+            not_found + 1
+        )
+
+    def test_other_routes_are_recorded_together(self, flask_test_client):
+        labels = {"operation": "other", "method": "GET", "status": "200"}
+        other = _sample("http_request_duration_seconds_count", **labels)
+
+        flask_test_client.get("/healthcheck")
+
+        assert _sample("http_request_duration_seconds_count", **labels) == other + 1
+
+    def test_async_request_is_recorded(self, async_test_client, seed_test_data_fn):
+        labels = {"operation": "core.account.get_account"}
+        db_seconds = _sample("http_request_db_seconds_sum", **labels)
+
+        async_test_client.get(f"/accounts?account_id={test_user['account_id']}")
+
+        assert _sample("http_request_db_seconds_sum", **labels) > db_seconds
+
+    def test_db_statements_are_reported(
+        self, flask_test_client, seed_test_data_fn, caplog
+    ):
+        response = flask_test_client.get(
+            f"/accounts?account_id={test_user['account_id']}"
+        )
+
+        assert re.fullmatch(
+            r'db;dur=\d+\.\d;desc="2 statements"', response.headers["Server-Timing"]
+        )
+        assert "core.account.get_account ran 2 db statements" in caplog.text
+
+    def test_too_many_db_statements_are_logged_as_a_warning(
+        self, flask_test_client, seed_test_data_fn, caplog, monkeypatch
+    ):
+        monkeypatch.setattr(metrics, "statements_warning_threshold", 1)
+
+        flask_test_client.get(f"/accounts?account_id={test_user['account_id']}")
+
+        assert [
+            record.levelname
+            for record in caplog.records
+            if "db statements" in record.getMessage()
+        ] == ["WARNING"]
+
+    def test_cache_lookups_are_counted(self, flask_test_client, seed_test_data_fn):
+        hits = _sample("account_cache_lookups_total", result="hit")
+        misses = _sample("account_cache_lookups_total", result="miss")
+        url = f"/accounts?account_id={test_user['account_id']}"
+
+        flask_test_client.get(url)
+        flask_test_client.get(url)
+
+        assert _sample("account_cache_lookups_total", result="hit") == hits + 1
+        assert _sample("account_cache_lookups_total", result="miss") == misses + 1
+        assert _sample("account_cache_entries") == 1
+
+
+class TestProcessMemory:
+    def test_process_memory(self):
+        memory = process_memory()
+
+        assert 0 < memory["uss"] <= memory["rss"]
+        assert 0 < memory["pss"] <= memory["rss"]
+
+    def test_process_memory_of_missing_process(self):
+        assert process_memory("not-a-pid") is None
+
+    def test_memory_is_sampled_by_requests(self, flask_test_client, monkeypatch):
+        monkeypatch.setattr(metrics, "_memory_sampled_at", None)
+        monkeypatch.setattr(
+            "core.metrics.process_memory",
+            lambda: {"rss": 300, "pss": 200, "uss": 100},
+        )
+
+        flask_test_client.get("/healthcheck")
+
+        assert _sample("process_memory_bytes", kind="rss") == 300
+        assert _sample("process_memory_bytes", kind="uss") == 100
+
+
+class TestMetricsView:
+    def test_metrics_are_served(self, flask_test_client):
+        response = flask_test_client.get("/metrics")
+
+        assert response.status_code == 200
+        assert "http_request_duration_seconds" in response.text
+        assert "account_cache_lookups_total" in response.text
+
+    def test_multiprocess_metrics_are_read_from_the_directory(
+        self, flask_test_client, monkeypatch, tmp_path
+    ):
+        monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+
+        response = flask_test_client.get("/metrics")
+
+        # Only metrics written to the directory by workers are reported
+        assert response.status_code == 200
+        assert response.text == ""
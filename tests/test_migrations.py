@@ -0,0 +1,17 @@
+"""
+Tests the migrations.
+"""
+
+from pathlib import Path
+
+from alembic.script import ScriptDirectory
+
+MIGRATIONS_DIR = Path(__file__).parent.parent / "db" / "migrations"
+
+
+def test_current_alembic_head_is_the_head():
+    # scripts/migration-task-script.py only upgrades the db when its revision
+    # differs from the one in .current-alembic-head
+    head = (MIGRATIONS_DIR / ".current-alembic-head").read_text().strip()
+
+    assert ScriptDirectory(str(MIGRATIONS_DIR)).get_current_head() == head
@@ -0,0 +1,78 @@
+"""
+Tests the db models.
+"""
+
+import pytest
+from fsd_utils.authentication.utils import get_highest_role_map
+from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import select
+from sqlalchemy import text
+
+from db.models.account import Account
+from db.models.account import _highest_role_map
+from db.models.account import email_domain_of
+from db.models.role import Role
+
+
+class TestAccountHighestRoleMap:
+    def test_role_map_is_memoised_by_role_set(self, app, mocker):
+        _highest_role_map.cache_clear()
+        get_highest_role_map_spy = mocker.patch(
+            "db.models.account.get_highest_role_map", wraps=get_highest_role_map
+        )
+        first = Account(
+            roles=[Role(role="COF_ASSESSOR"), Role(role="COF_LEAD_ASSESSOR")]
+        )
+        second = Account(
+            roles=[Role(role="COF_LEAD_ASSESSOR"), Role(role="COF_ASSESSOR")]
+        )
+
+        with app.app_context():
+            first_role_map = first.highest_role_map
+            second_role_map = second.highest_role_map
+
+        assert first_role_map == second_role_map == {"COF": "LEAD_ASSESSOR"}
+        assert first_role_map is not second_role_map
+        get_highest_role_map_spy.assert_called_once()
+
+
+class TestAccountEmailDomain:
+    @pytest.mark.parametrize(
+        "email",
+        ["a@example.com", "B@Example.COM", "a@b@example.com", "no-domain", ""],
+    )
+    def test_email_domain_matches_db(self, _db, clear_test_data, email):
+        emails = select(literal(email).label("email")).subquery()
+        db_email_domain = _db.session.scalar(
+            select(
+                text(str(Account.email_domain.expression.computed.sqltext))
+            ).select_from(emails)
+        )
+
+        assert email_domain_of(email) == db_email_domain
+
+
+class TestRoleParsedColumns:
+    @pytest.mark.parametrize(
+        "role, expected",
+        [
+            ("COF_ASSESSOR_R1", ("COF", "R1", "ASSESSOR")),
+            ("COF_R2W3_LEAD_ASSESSOR", ("COF", "R2W3", "LEAD_ASSESSOR")),
+            ("CTDF_LEAD_ASSESSOR", ("CTDF", None, "LEAD_ASSESSOR")),
+            ("NSTF_COMMENTER", ("NSTF", None, "COMMENTER")),
+            ("COMMENTER", (None, None, "COMMENTER")),
+            ("SECTION_151", (None, None, None)),
+            ("COF_ENGLAND", (None, None, None)),
+        ],
+    )
+    def test_role_is_parsed(self, _db, clear_test_data, role, expected):
+        parsed = _db.session.execute(
+            select(
+                func.role_fund_of(role),
+                func.role_round_of(role),
+                func.role_type_of(role),
+            )
+        ).one()
+
+        assert tuple(parsed) == expected
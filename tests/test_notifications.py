@@ -0,0 +1,81 @@
+"""
+Tests the account change notifications published by the db triggers.
+"""
+
+import queue
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from core.cache import account_cache
+from core.notifications import AccountChangeListener
+from core.notifications import account_change_listener
+
+test_user_1 = {
+    "email": "listener_user_1@example.com",
+    "subject_id": "listener_subject_id_1",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_COMMENTER"],
+}
+test_user_2 = {
+    "email": "listener_user_2@example.com",
+    "subject_id": "listener_subject_id_2",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_ASSESSOR"],
+}
+
+
+@pytest.fixture
+def changes(seed_test_data_fn):
+    """
+    Starts a listener on the test db and yields a queue of the account ids
+    it is notified about, once it is listening.
+    """
+    changed_account_ids = queue.Queue()
+    listener = AccountChangeListener()
+    listener.dsn = account_change_listener.dsn
+    listener.enabled = True
+    listener.subscribe(account_cache.evict)
+    listener.subscribe(changed_account_ids.put)
+    listener.start()
+    assert changed_account_ids.get(timeout=5) is None
+    yield changed_account_ids
+    listener.stop()
+
+
+@pytest.mark.user_config([test_user_1, test_user_2])
+class TestAccountChangeNotifications:
+    def test_role_change_notifies_account_id(self, _db, changes):
+        _db.session.execute(
+            text("UPDATE role SET role = role WHERE account_id = :id"),
+            {"id": test_user_1["account_id"]},
+        )
+        _db.session.commit()
+
+        assert changes.get(timeout=5) == str(test_user_1["account_id"])
+
+    def test_uncommitted_change_does_not_notify(self, _db, changes):
+        _db.session.execute(
+            text("UPDATE account SET full_name = 'Rolled Back' WHERE id = :id"),
+            {"id": test_user_1["account_id"]},
+        )
+        _db.session.rollback()
+
+        with pytest.raises(queue.Empty):
+            changes.get(timeout=0.5)
+
+    def test_out_of_band_change_evicts_cached_account(
+        self, flask_test_client, _db, changes
+    ):
+        url = f"/accounts?account_id={test_user_2['account_id']}"
+        assert flask_test_client.get(url).json()["full_name"] is None
+
+        _db.session.execute(
+            text("UPDATE account SET full_name = 'Out Of Band' WHERE id = :id"),
+            {"id": test_user_2["account_id"]},
+        )
+        _db.session.commit()
+        assert changes.get(timeout=5) == str(test_user_2["account_id"])
+
+        assert flask_test_client.get(url).json()["full_name"] == "Out Of Band"
@@ -0,0 +1,89 @@
+"""
+Tests the instrumented db connection pool and the metrics endpoint.
+"""
+
+import pytest
+from flask import Flask
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+from sqlalchemy import exc
+
+from core.notifications import AccountChangeListener
+from db.pool import InstrumentedQueuePool
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, {"engine": "sync", **labels}) or 0
+
+
+@pytest.fixture
+def engine(app):
+    engine = create_engine(
+        app.config["SQLALCHEMY_DATABASE_URI"],
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    yield engine
+    engine.dispose()
+
+
+class TestInstrumentedQueuePool:
+    def test_app_engine_uses_configured_pool(self, app, _db):
+        with app.app_context():
+            pool = _db.engine.pool
+
+        assert isinstance(pool, InstrumentedQueuePool)
+        assert pool.size() == app.config["DB_POOL_SIZE"]
+        assert pool._recycle == app.config["DB_POOL_RECYCLE_SECONDS"]
+        assert pool._pre_ping is app.config["DB_POOL_PRE_PING"]
+
+    def test_checkout_wait_is_recorded(self, engine):
+        checkouts = _sample("db_pool_checkout_wait_seconds_count")
+
+        with engine.connect():
+            in_use = _sample("db_pool_checked_out")
+
+        assert _sample("db_pool_checkout_wait_seconds_count") == checkouts + 1
+        assert _sample("db_pool_checked_out") == in_use - 1
+
+    def test_checkout_timeout_is_counted(self, engine):
+        timeouts = _sample("db_pool_checkout_timeouts_total")
+
+        with engine.connect():
+            with pytest.raises(exc.TimeoutError):
+                engine.connect()
+
+        assert _sample("db_pool_checkout_timeouts_total") == timeouts + 1
+
+
+class TestMetricsEndpoint:
+    def test_pool_metrics_are_exposed(self, flask_test_client):
+        response = flask_test_client.get("/metrics")
+
+        assert response.status_code == 200
+        assert 'db_pool_checked_out{engine="sync"}' in response.text
+        assert 'db_pool_overflow{engine="sync"}' in response.text
+        assert "db_pool_checkout_wait_seconds_bucket" in response.text
+
+
+class TestAccountChangeListenerDatabaseUrl:
+    @pytest.mark.parametrize(
+        "listener_url, expected_dsn",
+        [
+            ("", "postgresql://app@pgbouncer/accounts"),
+            (
+                "postgresql+psycopg2://app@primary/accounts",
+                "postgresql://app@primary/accounts",
+            ),
+        ],
+    )
+    def test_listener_can_bypass_pgbouncer(self, listener_url, expected_dsn):
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = "postgresql://app@pgbouncer/accounts"
+        app.config["ACCOUNT_CHANGE_LISTENER_DATABASE_URL"] = listener_url
+
+        listener = AccountChangeListener(app)
+
+        assert listener.dsn == expected_dsn
@@ -0,0 +1,249 @@
+"""
+Tests routing the reads of read only operations to a read replica, which in
+these tests is a second engine connected to the test db.
+"""
+
+import time
+import uuid
+from unittest import mock
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+from config import Config
+from db import async_db
+from db import db
+from db.replica import PRIMARY_COOKIE
+from db.replica import PRIMARY_HEADER
+from db.replica import REPLICA_BIND_KEY
+from tests.helpers import close_lifespan_streams
+
+test_user = {
+    "email": "replica_user@example.com",
+    "subject_id": "replica_subject_id",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_ASSESSOR"],
+}
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = 0
+        event.listen(engine, "before_cursor_execute", self.count)
+
+    def count(self, *args):
+        self.statements += 1
+
+    def remove(self):
+        event.remove(self.engine, "before_cursor_execute", self.count)
+
+
+def _create_app_with_replica(async_request_path: bool):
+    with mock.patch.multiple(
+        Config,
+        REPLICA_DATABASE_URL=Config.SQLALCHEMY_DATABASE_URI,
+        SQLALCHEMY_BINDS={REPLICA_BIND_KEY: {"url": Config.SQLALCHEMY_DATABASE_URI}},
+        ASYNC_REQUEST_PATH_ENABLED=async_request_path,
+    ):
+        return create_app()
+
+
+@pytest.fixture(params=[False, True], ids=["sync", "async"])
+def replica_client(request, monkeypatch):
+    """
+    Yields a test client for an app with a replica, and counters of the
+    statements run on the primary and the replica
+    """
+    for attribute in ("engine", "replica_engine", "_sessionmaker"):
+        monkeypatch.setattr(async_db, attribute, getattr(async_db, attribute))
+    connexion_app = _create_app_with_replica(request.param)
+    if request.param:
+        engines = (async_db.engine.sync_engine, async_db.replica_engine.sync_engine)
+    else:
+        with connexion_app.app.app_context():
+            engines = (db.engines[None], db.engines[REPLICA_BIND_KEY])
+    primary, replica = StatementCounter(engines[0]), StatementCounter(engines[1])
+
+    with connexion_app.test_client() as test_client:
+        yield test_client, primary, replica
+
+    close_lifespan_streams(test_client)
+    primary.remove()
+    replica.remove()
+
+
+@pytest.mark.user_config([test_user])
+class TestReplicaRouting:
+    def test_search_reads_from_the_replica(self, replica_client, seed_test_data_fn):
+        test_client, primary, replica = replica_client
+
+        response = test_client.post(
+            "/accounts/search", json={"email_domain": "example.com"}
+        )
+
+        assert response.status_code == 200
+        assert [account["email_address"] for account in response.json()] == [
+            test_user["email"]
+        ]
+        assert replica.statements >= 1
+        assert primary.statements == 0
+
+    def test_fund_accounts_read_from_the_replica(
+        self, replica_client, seed_test_data_fn
+    ):
+        test_client, primary, replica = replica_client
+
+        response = test_client.get("/accounts/fund/COF?include_assessors=true")
+
+        assert response.status_code == 200
+        assert replica.statements >= 1
+        assert primary.statements == 0
+
+    def test_account_changes_read_from_the_replica(
+        self, replica_client, seed_test_data_fn
+    ):
+        test_client, primary, replica = replica_client
+
+        response = test_client.get("/accounts/changes")
+
+        assert response.status_code == 200
+        assert replica.statements >= 1
+        assert primary.statements == 0
+
+    def test_get_account_reads_from_the_primary(
+        self, replica_client, seed_test_data_fn
+    ):
+        test_client, primary, replica = replica_client
+
+        response = test_client.get(f"/accounts?account_id={test_user['account_id']}")
+
+        assert response.status_code == 200
+        assert primary.statements >= 1
+        assert replica.statements == 0
+
+    def test_reads_after_a_write_read_from_the_primary(
+        self, replica_client, seed_test_data_fn
+    ):
+        test_client, primary, replica = replica_client
+
+        put_response = test_client.put(
+            f"/accounts/{test_user['account_id']}",
+            json={
+                "email_address": test_user["email"],
+                "azure_ad_subject_id": test_user["subject_id"],
+                "full_name": "Replica User",
+                "roles": ["COF_LEAD_ASSESSOR"],
+            },
+        )
+        assert put_response.status_code == 201
+        assert PRIMARY_COOKIE in put_response.headers["set-cookie"]
+        replica_statements = replica.statements
+
+        # The test client sends the cookie back
+        response = test_client.post(
+            "/accounts/search", json={"email_domain": "example.com"}
+        )
+
+        assert response.json()[0]["full_name"] == "Replica User"
+        assert replica.statements == replica_statements
+
+    def test_clients_without_cookies_send_back_the_header(
+        self, replica_client, seed_test_data_fn
+    ):
+        test_client, primary, replica = replica_client
+
+        put_response = test_client.put(
+            f"/accounts/{test_user['account_id']}",
+            json={
+                "email_address": test_user["email"],
+                "azure_ad_subject_id": test_user["subject_id"],
+                "full_name": "Header User",
+                "roles": ["COF_LEAD_ASSESSOR"],
+            },
+        )
+        primary_until = put_response.headers[PRIMARY_HEADER]
+        assert float(primary_until) > time.time()
+        # As a client that doesn't keep cookies
+        test_client.cookies.clear()
+        replica_statements = replica.statements
+
+        response = test_client.post(
+            "/accounts/search",
+            json={"email_domain": "example.com"},
+            headers={PRIMARY_HEADER: primary_until},
+        )
+
+        assert response.json()[0]["full_name"] == "Header User"
+        assert replica.statements == replica_statements
+
+        # Without the header, it's up to the replica whether it has the write
+        test_client.post("/accounts/search", json={"email_domain": "example.com"})
+        assert replica.statements > replica_statements
+
+    def test_reads_after_the_cookie_expires_read_from_the_replica(
+        self, replica_client, seed_test_data_fn
+    ):
+        test_client, primary, replica = replica_client
+
+        response = test_client.post(
+            "/accounts/search",
+            json={"email_domain": "example.com"},
+            headers={"Cookie": f"{PRIMARY_COOKIE}={time.time() - 1}"},
+        )
+
+        assert response.status_code == 200
+        assert replica.statements >= 1
+        assert "set-cookie" not in response.headers
+
+    def test_reads_do_not_set_the_cookie(self, replica_client, seed_test_data_fn):
+        test_client, primary, replica = replica_client
+
+        response = test_client.get(f"/accounts?account_id={test_user['account_id']}")
+
+        assert "set-cookie" not in response.headers
+        assert PRIMARY_HEADER not in response.headers
+
+
+@pytest.mark.user_config(
+    [
+        test_user,
+        {
+            "email": "replica_user_2@example.com",
+            "subject_id": "replica_subject_id_2",
+            "account_id": uuid.uuid4(),
+            "roles": ["COF_COMMENTER"],
+        },
+    ]
+)
+def test_every_batch_of_a_streamed_fund_reads_from_the_replica(
+    replica_client, seed_test_data_fn, monkeypatch
+):
+    test_client, primary, replica = replica_client
+    # A batch for each account, each loading its roles with a further query
+    monkeypatch.setattr("core.account.STREAM_ACCOUNTS_BATCH_SIZE", 1)
+    monkeypatch.setattr("core.account_async.STREAM_ACCOUNTS_BATCH_SIZE", 1)
+
+    response = test_client.get(
+        "/accounts/fund/COF", headers={"Accept": "application/x-ndjson"}
+    )
+
+    assert len(response.text.splitlines()) == 2
+    assert replica.statements == 3
+    assert primary.statements == 0
+
+
+def test_writes_do_not_set_the_cookie_without_a_replica(
+    flask_test_client, seed_test_data_fn
+):
+    response = flask_test_client.post(
+        "/accounts",
+        json={
+            "email_address": "no_replica@example.com",
+            "azure_ad_subject_id": "no_replica_subject_id",
+        },
+    )
+
+    assert response.status_code == 201
+    assert "set-cookie" not in response.headers
@@ -0,0 +1,73 @@
+"""
+Tests the db schemas.
+"""
+
+import json
+import uuid
+
+import pytest
+
+from db.models.account import Account
+from db.models.role import Role
+from db.schemas.account import AccountSchema
+from db.schemas.account import serialize_account
+
+
+@pytest.mark.parametrize(
+    "account",
+    [
+        Account(),
+        Account(id=uuid.uuid4(), email="person@example.com"),
+        Account(
+            id=uuid.uuid4(),
+            email="assessor@communities.gov.uk",
+            full_name="Jane Doe",
+            azure_ad_subject_id="fg4FtjR5he365ir5h4k34_43jk34HreK6fr6rtDe47",
+            roles=[
+                Role(role="COF_ASSESSOR_R1"),
+                Role(role="COF_LEAD_ASSESSOR"),
+                Role(role="NSTF_COMMENTER"),
+                Role(role="SECTION_151"),
+            ],
+        ),
+    ],
+)
+def test_serialize_account_matches_account_schema(app, account):
+    with app.app_context():
+        expected = AccountSchema().dump(account)
+        serialized = serialize_account(account)
+
+    assert serialized == expected
+    assert json.dumps(serialized) == json.dumps(expected)
+
+
+def test_serialize_account_covers_every_account_schema_field(app):
+    with app.app_context():
+        data_keys = {
+            field.data_key or name
+            for name, field in AccountSchema().dump_fields.items()
+        }
+        serialized = serialize_account(Account())
+
+    assert set(serialized) == data_keys
+
+
+def test_highest_role_map_is_ordered_by_fund(app):
+    roles = ["NSTF_COMMENTER", "COF_ASSESSOR", "AAA_LEAD_ASSESSOR", "COF_COMMENTER"]
+    accounts = [
+        Account(id=uuid.uuid4(), roles=[Role(role=role) for role in ordered])
+        for ordered in (roles, list(reversed(roles)))
+    ]
+
+    with app.app_context():
+        role_maps = [
+            serialize_account(account)["highest_role_map"] for account in accounts
+        ]
+
+    for role_map in role_maps:
+        assert list(role_map.items()) == [
+            ("AAA", "LEAD_ASSESSOR"),
+            ("COF", "ASSESSOR"),
+            ("NSTF", "COMMENTER"),
+        ]
+    assert json.dumps(role_maps[0]) == json.dumps(role_maps[1])
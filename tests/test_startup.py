@@ -0,0 +1,173 @@
+"""
+Tests the cached openapi spec and the startup of the app.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from connexion.exceptions import InvalidSpecification
+from connexion.spec import OpenAPISpecification
+
+from app import after_fork
+from app import before_fork
+from app import create_app
+from app import create_flask_app
+from app import worker_db_connections
+from core import spec as spec_module
+from core.spec import SPEC_PATH
+from core.spec import cache_file_name
+from core.spec import load_spec
+from core.spec import skip_validation
+from db.replica import REPLICA_BIND_KEY
+from tests.helpers import close_lifespan_streams
+
+
+@pytest.fixture(autouse=True)
+def loaded_specs(monkeypatch):
+    monkeypatch.setattr(spec_module, "_loaded_specs", {})
+
+
+@pytest.fixture
+def spec_path(tmp_path):
+    path = tmp_path / "api.yml"
+    with open(SPEC_PATH) as file:
+        path.write_text(file.read())
+    return str(path)
+
+
+def test_load_spec_caches_the_validated_spec(spec_path, tmp_path):
+    cache_dir = tmp_path / "cache"
+
+    spec, cached = load_spec(spec_path, str(cache_dir))
+
+    assert not cached
+    assert os.listdir(cache_dir) == [cache_file_name(spec_path)]
+    with open(cache_dir / cache_file_name(spec_path)) as file:
+        assert json.load(file) == spec
+    # Response codes are strings, as connexion expects
+    assert "200" in spec["paths"]["/accounts"]["get"]["responses"]
+
+    spec_module._loaded_specs.clear()
+    assert load_spec(spec_path, str(cache_dir)) == (spec, True)
+
+
+def test_load_spec_returns_a_copy(spec_path):
+    spec, _ = load_spec(spec_path, cache_dir=None)
+    spec["paths"].clear()
+
+    assert load_spec(spec_path, cache_dir=None)[0]["paths"]
+
+
+def test_changed_spec_is_not_read_from_the_cache(spec_path, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    load_spec(spec_path, cache_dir)
+    old_name = cache_file_name(spec_path)
+
+    with open(spec_path, "a") as file:
+        file.write("\n# A change\n")
+    spec_module._loaded_specs.clear()
+
+    assert cache_file_name(spec_path) != old_name
+    assert not load_spec(spec_path, cache_dir)[1]
+    assert sorted(os.listdir(cache_dir)) == sorted(
+        [old_name, cache_file_name(spec_path)]
+    )
+
+
+def test_unreadable_cache_is_replaced(spec_path, tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    (cache_dir / cache_file_name(spec_path)).write_text('{"openapi": ')
+
+    spec, cached = load_spec(spec_path, str(cache_dir))
+
+    assert not cached
+    with open(cache_dir / cache_file_name(spec_path)) as file:
+        assert json.load(file) == spec
+
+
+def test_invalid_spec_is_not_cached(tmp_path):
+    spec_path = tmp_path / "api.yml"
+    spec_path.write_text("openapi: 3.0.0\npaths: {}\n")
+    cache_dir = tmp_path / "cache"
+
+    with pytest.raises(InvalidSpecification):
+        load_spec(str(spec_path), str(cache_dir))
+    assert not cache_dir.exists()
+
+
+def test_skip_validation():
+    with skip_validation():
+        OpenAPISpecification._validate_spec({})
+
+    with pytest.raises(InvalidSpecification):
+        OpenAPISpecification._validate_spec({})
+
+
+def test_create_app_reports_startup_timings():
+    create_app()
+    # The spec is cached by the first app created
+    timings = create_app().app.extensions["startup_timings"]
+
+    assert {"spec", "api", "extensions"} <= set(timings.phases)
+    assert timings.notes["spec"] == "cached"
+    assert timings.total_seconds >= sum(timings.phases.values())
+    assert timings.report().startswith("App created in ")
+
+
+def test_create_flask_app(_db):
+    flask_app = create_flask_app()
+
+    assert "sqlalchemy" in flask_app.extensions
+    assert "startup_timings" not in flask_app.extensions
+    assert not any(
+        rule.rule.startswith("/accounts") for rule in flask_app.url_map.iter_rules()
+    )
+
+
+def test_app_serves_requests_after_fork(_db):
+    connexion_app = create_app()
+
+    before_fork(connexion_app)
+    assert connexion_app.middleware.middleware_stack is not None
+    after_fork(connexion_app)
+
+    with connexion_app.test_client() as test_client:
+        assert test_client.get("/healthcheck").status_code == 200
+        assert test_client.get("/accounts?email_address=a@b.com").status_code == 404
+    close_lifespan_streams(test_client)
+
+
+def test_worker_db_connections():
+    config = {
+        "SQLALCHEMY_ENGINE_OPTIONS": {"pool_size": 5, "max_overflow": 10},
+        "SQLALCHEMY_BINDS": {},
+        "ASYNC_REQUEST_PATH_ENABLED": False,
+        "ASYNC_SQLALCHEMY_ENGINE_OPTIONS": {"pool_size": 2, "max_overflow": 3},
+        "ASYNC_REPLICA_SQLALCHEMY_ENGINE_OPTIONS": {"pool_size": 2, "max_overflow": 3},
+        "ACCOUNT_CHANGE_LISTENER_ENABLED": True,
+    }
+    # The pool and the listener's connection
+    assert worker_db_connections(config) == 16
+
+    config["SQLALCHEMY_BINDS"] = {REPLICA_BIND_KEY: {"pool_size": 1, "max_overflow": 1}}
+    config["ASYNC_REQUEST_PATH_ENABLED"] = True
+    config["ACCOUNT_CHANGE_LISTENER_ENABLED"] = False
+    assert worker_db_connections(config) == 15 + 2 + 5 + 5
+
+
+def test_importing_app_does_not_create_it():
+    # In a new process, as app has been imported by the tests
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, app; "
+            "assert 'connexion' not in sys.modules; "
+            "assert 'app' not in vars(app)",
+        ],
+        check=True,
+    )
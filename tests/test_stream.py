@@ -0,0 +1,188 @@
+"""
+Tests the account change stream, served by a real server as the test client
+waits for the whole response before returning it.
+"""
+
+import contextlib
+import json
+import threading
+import uuid
+from unittest import mock
+
+import httpx
+import pytest
+import uvicorn
+from sqlalchemy import select
+
+from app import create_app
+from config import Config
+from core.changes import decode_cursor
+from core.changes import encode_cursor
+from core.stream import SUBSCRIBER_MAX_BATCHES
+from core.stream import AccountChangeStream
+from core.stream import Subscription
+from core.stream import account_change_stream
+from db import async_db
+from db.models.account import Account
+from db.models.role import Role
+from tests.conftest import create_user_with_roles
+
+test_user = {
+    "email": "stream_user@example.com",
+    "subject_id": "stream_subject_id",
+    "account_id": uuid.uuid4(),
+    "roles": ["COF_ASSESSOR"],
+}
+
+
+@pytest.fixture
+def seeded_account(app, _db, clear_test_data):
+    create_user_with_roles(test_user, _db)
+    yield
+    account_ids = select(Account.id).filter(Account.email.like("stream_%"))
+    Role.query.filter(Role.account_id.in_(account_ids)).delete()
+    Account.query.filter(Account.id.in_(account_ids)).delete()
+    _db.session.commit()
+
+
+@pytest.fixture(params=[False, True], ids=["sync", "async"])
+def base_url(request, monkeypatch):
+    """
+    Serves the app on a free port, and yields its url
+    """
+    for attribute in ("engine", "replica_engine", "_sessionmaker"):
+        monkeypatch.setattr(async_db, attribute, getattr(async_db, attribute))
+    with mock.patch.object(Config, "ASYNC_REQUEST_PATH_ENABLED", request.param):
+        connexion_app = create_app()
+    server = uvicorn.Server(
+        uvicorn.Config(connexion_app, port=0, log_level="warning", lifespan="off")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        assert thread.is_alive()
+        threading.Event().wait(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    yield f"http://127.0.0.1:{port}"
+
+    server.should_exit = True
+    thread.join(5)
+    account_change_stream.stop()
+
+
+def _events(response):
+    """
+    Yields each event in a stream of server-sent events as a dict of its
+    fields, skipping comments
+    """
+    event = {}
+    for line in response.iter_lines():
+        if line.startswith(":"):
+            continue
+        elif line:
+            name, _, value = line.partition(": ")
+            event[name] = value
+        elif event:
+            yield event
+            event = {}
+
+
+def _rename(_db, full_name):
+    account = _db.session.get(Account, test_user["account_id"])
+    account.full_name = full_name
+    _db.session.commit()
+
+
+def _stream(base_url, **headers):
+    return httpx.stream(
+        "GET", f"{base_url}/accounts/stream", headers=headers, timeout=5
+    )
+
+
+class TestAccountChangeStream:
+    def test_streams_changes(self, base_url, seeded_account, _db):
+        with _stream(base_url) as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/event-stream")
+
+            _rename(_db, "Streamed User")
+            event = next(_events(response))
+
+        assert event["event"] == "account_change"
+        change = json.loads(event["data"])
+        assert change["account_id"] == str(test_user["account_id"])
+        assert change["deleted"] is False
+        assert change["account"]["full_name"] == "Streamed User"
+        assert change["account"]["roles"] == test_user["roles"]
+
+    def test_resumes_from_last_event_id(self, base_url, seeded_account, _db):
+        with _stream(base_url) as response:
+            _rename(_db, "First Name")
+            last_event_id = next(_events(response))["id"]
+
+        # Changed while the client isn't connected
+        _rename(_db, "Missed Name")
+
+        with _stream(base_url, **{"Last-Event-ID": last_event_id}) as response:
+            event = next(_events(response))
+
+        assert decode_cursor(event["id"]) > decode_cursor(last_event_id)
+        assert json.loads(event["data"])["account"]["full_name"] == "Missed Name"
+
+    def test_sends_heartbeats(self, base_url, seeded_account, monkeypatch):
+        monkeypatch.setattr(account_change_stream, "heartbeat_seconds", 0.1)
+
+        with _stream(base_url) as response:
+            lines = response.iter_lines()
+            # The first is sent as the stream starts
+            assert [next(lines) for _ in range(4)] == [": heartbeat", ""] * 2
+
+    def test_ends_streams_after_max_seconds(
+        self, base_url, seeded_account, monkeypatch
+    ):
+        monkeypatch.setattr(account_change_stream, "max_seconds", 0.2)
+
+        with _stream(base_url) as response:
+            # Returns once the stream ends
+            assert list(_events(response)) == []
+
+    def test_streams_dont_hold_threads(self, base_url, seeded_account, _db):
+        # More than the 10 threads the sync request path has
+        with contextlib.ExitStack() as stack:
+            responses = [stack.enter_context(_stream(base_url)) for _ in range(12)]
+            for response in responses:
+                assert response.status_code == 200
+            # Other requests are still served while they're open
+            assert httpx.get(f"{base_url}/healthcheck", timeout=5).status_code == 200
+
+            _rename(_db, "Fanned Out")
+            for response in responses:
+                event = next(_events(response))
+                assert json.loads(event["data"])["account"]["full_name"] == "Fanned Out"
+
+    def test_invalid_last_event_id(self, base_url):
+        response = httpx.get(
+            f"{base_url}/accounts/stream", headers={"Last-Event-ID": "not an id"}
+        )
+
+        assert response.status_code == 400
+
+
+class TestSubscription:
+    def test_skips_changes_already_received(self):
+        changes = [(encode_cursor(10, id), {"id": id}) for id in range(1, 4)]
+        subscription = Subscription(AccountChangeStream(), lambda: None, changes[1][0])
+        subscription.deliver(changes)
+
+        assert subscription.take() == changes[2:]
+
+    def test_drops_a_subscriber_too_far_behind(self):
+        stream = AccountChangeStream()
+        subscription = Subscription(stream, lambda: None)
+        stream._subscriptions.append(subscription)
+        for _ in range(SUBSCRIBER_MAX_BATCHES + 1):
+            subscription.deliver([(encode_cursor(1, 1), {})])
+
+        assert subscription.dropped
+        assert subscription not in stream._subscriptions
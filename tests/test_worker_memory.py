@@ -0,0 +1,23 @@
+"""
+Tests the script reporting the memory of gunicorn's workers.
+"""
+
+import os
+import subprocess
+import sys
+
+from scripts.worker_memory import format_memory
+
+
+def test_format_memory():
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(10)"])
+    try:
+        table = format_memory(os.getpid()).splitlines()
+    finally:
+        child.kill()
+        child.wait()
+
+    assert table[0].split() == ["pid", "rss", "pss", "uss"]
+    assert table[1].split()[:2] == ["master", str(os.getpid())]
+    assert ["worker", str(child.pid)] in [row.split()[:2] for row in table]
+    assert table[-1].startswith("total")